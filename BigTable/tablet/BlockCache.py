@@ -0,0 +1,73 @@
+import collections
+import threading
+
+class BlockCache:
+    def __init__(self, capacity):
+        """ LRU cache of SSTable data blocks shared by every tablet of a tablet server. Entries are charged by the size
+        of the block on disk and the least recently used blocks are evicted once the total charge exceeds capacity.
+        Hits and misses are counted per table.
+
+        Args:
+            capacity (int): Max total size of cached blocks in bytes, 0 disables caching
+        """
+        self.capacity = capacity
+        self.usage = 0
+        self.entries = collections.OrderedDict()
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def tableStats(self, tableName):
+        if tableName not in self.stats:
+            self.stats[tableName] = {"hits": 0, "misses": 0}
+        return self.stats[tableName]
+
+    def get(self, key, tableName):
+        with self.lock:
+            stats = self.tableStats(tableName)
+            if key not in self.entries:
+                stats["misses"] += 1
+                return None
+            stats["hits"] += 1
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+
+    def put(self, key, value, charge):
+        with self.lock:
+            if charge > self.capacity:
+                return
+            if key in self.entries:
+                self.usage -= self.entries.pop(key)[1]
+            self.entries[key] = (value, charge)
+            self.usage += charge
+            self.evict()
+
+    def evict(self):
+        while self.usage > self.capacity and self.entries:
+            _, (_, charge) = self.entries.popitem(last=False)
+            self.usage -= charge
+
+    def setCapacity(self, capacity):
+        with self.lock:
+            self.capacity = capacity
+            self.evict()
+
+    def evictFile(self, fileName):
+        """Drop every block of an SSTable, called when the file is deleted.
+        """
+        with self.lock:
+            for key in [k for k in self.entries if k[0] == fileName]:
+                self.usage -= self.entries.pop(key)[1]
+
+    def getStats(self, tableName):
+        with self.lock:
+            stats = dict(self.tableStats(tableName))
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups > 0 else 0.0
+        return stats
+
+    def dropTable(self, tableName):
+        with self.lock:
+            self.stats.pop(tableName, None)
+
+    def getUsage(self):
+        return {"capacity": self.capacity, "usage": self.usage, "blocks": len(self.entries)}
@@ -0,0 +1,48 @@
+import base64
+import hashlib
+import math
+
+class BloomFilter:
+    def __init__(self, numKeys, bitsPerKey, bits=None, numHashes=None):
+        """ Bloom filter over the row keys of an SSTable. Answers "definitely not present" or "maybe present", which
+        lets a lookup skip SSTables that cannot hold the key without reading any data blocks.
+
+        Args:
+            numKeys (int): Expected number of keys, used to size the filter
+            bitsPerKey (int): Filter bits spent per key. Higher means fewer false positives
+            bits (bytearray, optional): Existing filter bits, when loading a filter from disk
+            numHashes (int, optional): Number of probes per key, when loading a filter from disk
+        """
+        if bits is not None:
+            self.bits = bits
+            self.numHashes = numHashes
+        else:
+            self.bits = bytearray((max(numKeys * bitsPerKey, 64) + 7) // 8)
+            self.numHashes = min(max(int(round(bitsPerKey * math.log(2))), 1), 30)
+        self.numBits = len(self.bits) * 8
+
+    def probes(self, key):
+        """Double hashing: the i-th probe is h1 + i*h2, both halves taken from a single digest of the key.
+        """
+        digest = hashlib.md5(str(key).encode("utf-8")).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.numHashes):
+            yield (h1 + i * h2) % self.numBits
+
+    def add(self, key):
+        for p in self.probes(key):
+            self.bits[p >> 3] |= 1 << (p & 7)
+
+    def mayContain(self, key):
+        for p in self.probes(key):
+            if not self.bits[p >> 3] & (1 << (p & 7)):
+                return False
+        return True
+
+    def serialize(self):
+        return {"bits": base64.b64encode(bytes(self.bits)).decode("ascii"), "numHashes": self.numHashes}
+
+    @staticmethod
+    def deserialize(d):
+        return BloomFilter(None, None, bytearray(base64.b64decode(d["bits"])), d["numHashes"])
@@ -0,0 +1,110 @@
+import bisect
+import sys
+from array import array
+
+class ColumnIndex:
+    def __init__(self, columns=None):
+        """ Maps (column family, column key) pairs to small integer ids, so a row stores one int per cell instead of
+        its own copies of the family and column name strings. Seeded from the table schema; columns outside the schema
+        get ids the first time they are written. Names are interned, so every row and every decoded read shares the
+        same string objects.
+
+        Args:
+            columns (list[(str, str)], optional): Schema columns, see Table.getColumns
+        """
+        self.ids = {}
+        self.names = []
+        self.addColumns(columns or [])
+
+    def addColumns(self, columns):
+        for cf, col in columns:
+            self.getId(cf, col)
+
+    def getId(self, columnFamily, columnKey):
+        """Id of a column, assigning a new one if needed. The caller must hold the tablet lock.
+        """
+        colId = self.ids.get((columnFamily, columnKey))
+        if colId is None:
+            colId = len(self.names)
+            self.names.append((sys.intern(columnFamily), sys.intern(columnKey)))
+            self.ids[self.names[colId]] = colId
+        return colId
+
+    def findId(self, columnFamily, columnKey):
+        return self.ids.get((columnFamily, columnKey))
+
+    def getName(self, colId):
+        return self.names[colId]
+
+
+class CompactRow:
+    """All versions of all cells of one memtable row in three parallel arrays, ordered by column id and, within a
+    column, newest first:
+
+        columnIds (array('i')): column id of each version, see ColumnIndex
+        timestamps (array('d')): timestamp of each version
+        values (list): content of each version
+
+    A version costs 4 + 8 bytes in the arrays plus one list slot, instead of a tuple and a boxed float in a list in
+    two levels of dicts. The versions of a column are found by bisecting columnIds.
+    """
+    __slots__ = ("columnIds", "timestamps", "values")
+
+    def __init__(self):
+        self.columnIds = array("i")
+        self.timestamps = array("d")
+        self.values = []
+
+    def columnRange(self, colId):
+        lo = bisect.bisect_left(self.columnIds, colId)
+        return lo, bisect.bisect_right(self.columnIds, colId, lo)
+
+    def insert(self, colId, value, timestamp, maxCellCopies):
+        """Insert a version in place. Its position within the column is found by binary search on the timestamps
+        (usually it is the front), and the column's oldest version is dropped once it holds more than maxCellCopies.
+        A version equal to one the column already holds (such as a write replayed from the WAL) is dropped instead of
+        stored twice.
+
+        Returns:
+            tuple: the dropped (value, timestamp), or None
+        """
+        lo, hi = self.columnRange(colId)
+        first, end = lo, hi
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.timestamps[mid] >= timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        pos = lo
+        while pos > first and self.timestamps[pos - 1] == timestamp:
+            pos -= 1
+            if self.values[pos] == value:
+                return (value, timestamp)
+        self.columnIds.insert(lo, colId)
+        self.timestamps.insert(lo, timestamp)
+        self.values.insert(lo, value)
+        if end + 1 - first > maxCellCopies:
+            evicted = (self.values[end], self.timestamps[end])
+            del self.columnIds[end]
+            del self.timestamps[end]
+            del self.values[end]
+            return evicted
+        return None
+
+    def getCells(self, colId):
+        """Versions of one column, newest first, or None if the row does not have it.
+        """
+        lo, hi = self.columnRange(colId)
+        if lo == hi:
+            return None
+        return [(self.values[i], self.timestamps[i]) for i in range(lo, hi)]
+
+    def getColumnIds(self):
+        """Distinct column ids of the row, in increasing order.
+        """
+        ids = []
+        for colId in self.columnIds:
+            if not ids or ids[-1] != colId:
+                ids.append(colId)
+        return ids
@@ -0,0 +1,193 @@
+import itertools
+import queue
+import threading
+import traceback
+from Tablet import SSTable
+from MergeIterator import mergeSSTables
+
+class SizeTieredPolicy:
+    def __init__(self, minThreshold=4, maxThreshold=32, bucketLow=0.5, bucketHigh=1.5):
+        """ Size-tiered compaction: SSTs of similar size are grouped into buckets and a bucket is merged into one
+        larger SST once it holds minThreshold files. Fresh flushes therefore merge with each other, and the result
+        only gets merged again once enough SSTs of its own size have piled up.
+
+        Args:
+            minThreshold (int, optional): Files needed in a bucket before it is compacted, defaults to 4
+            maxThreshold (int, optional): Max files merged by a single compaction, defaults to 32
+            bucketLow (float, optional): A file joins a bucket if its size is >= bucketLow * average bucket size
+            bucketHigh (float, optional): ... and <= bucketHigh * average bucket size
+        """
+        self.minThreshold = minThreshold
+        self.maxThreshold = maxThreshold
+        self.bucketLow = bucketLow
+        self.bucketHigh = bucketHigh
+        self.targetFileSize = None
+
+    def getBuckets(self, ssTables):
+        buckets = []
+        for sst in sorted(ssTables, key=lambda s: s.getSize()):
+            size = sst.getSize()
+            for bucket in buckets:
+                avg = bucket["size"] / len(bucket["ssts"])
+                if self.bucketLow * avg <= size <= self.bucketHigh * avg:
+                    bucket["ssts"].append(sst)
+                    bucket["size"] += size
+                    break
+            else:
+                buckets.append({"ssts": [sst], "size": size})
+        return buckets
+
+    def select(self, tablet):
+        """Pick the SSTs to merge next: the bucket of smallest files that reached minThreshold. Locality groups are
+        compacted separately.
+
+        Returns:
+            (list[SSTable], int): SSTs to compact, empty if there is nothing to do, and the level of the output
+        """
+        for group in tablet.getLocalityGroupsInUse():
+            ssts = [sst for sst in tablet.ssTables if sst.localityGroup == group]
+            for bucket in self.getBuckets(ssts):
+                if len(bucket["ssts"]) >= self.minThreshold:
+                    return bucket["ssts"][:self.maxThreshold], 0
+        return [], 0
+
+
+class LeveledPolicy:
+    def __init__(self, level0Trigger=4, baseLevelSize=1024 * 1024, levelMultiplier=10, targetFileSize=256 * 1024):
+        """ Leveled compaction: flushes land in level 0, where SSTs may overlap. Every deeper level holds SSTs with
+        disjoint key ranges and is levelMultiplier times larger than the one above it, so a lookup touches at most
+        one SST per level. Once level 0 has level0Trigger SSTs they are merged with the overlapping SSTs of level 1;
+        once a level outgrows its size limit one of its SSTs is merged with the overlapping SSTs of the next level.
+
+        Args:
+            level0Trigger (int, optional): Number of level 0 SSTs that triggers a level 0 compaction, defaults to 4
+            baseLevelSize (int, optional): Size limit of level 1 in bytes, defaults to 1MB
+            levelMultiplier (int, optional): Size ratio between consecutive levels, defaults to 10
+            targetFileSize (int, optional): Compaction output is split into SSTs of about this size, defaults to 256KB
+        """
+        self.level0Trigger = level0Trigger
+        self.baseLevelSize = baseLevelSize
+        self.levelMultiplier = levelMultiplier
+        self.targetFileSize = targetFileSize
+
+    def maxLevelSize(self, level):
+        return self.baseLevelSize * self.levelMultiplier ** (level - 1)
+
+    def select(self, tablet):
+        """Every locality group has levels of its own. Level 0 is handled first. Otherwise the first level over its size
+        limit gives up the SST after the one compacted last time (round robin over the key space, tracked in
+        tablet.compactPointers).
+
+        Returns:
+            (list[SSTable], int): SSTs to compact, empty if there is nothing to do, and the level of the outputs
+        """
+        for group in tablet.getLocalityGroupsInUse():
+            level0 = [sst for sst in tablet.getLevel(0, group) if sst.minKey is not None]
+            if len(level0) >= self.level0Trigger:
+                minKey = min(sst.minKey for sst in level0)
+                maxKey = max(sst.maxKey for sst in level0)
+                return level0 + [sst for sst in tablet.getLevel(1, group) if sst.overlaps(minKey, maxKey)], 1
+        for group, level in tablet.getLevels():
+            ssts = tablet.getLevel(level, group)
+            if sum(sst.getSize() for sst in ssts) <= self.maxLevelSize(level):
+                continue
+            pointer = tablet.compactPointers.get((group, level))
+            pick = next((sst for sst in ssts if pointer is None or sst.minKey > pointer), ssts[0])
+            tablet.compactPointers[(group, level)] = pick.maxKey
+            nextLevel = tablet.getLevel(level + 1, group)
+            return [pick] + [sst for sst in nextLevel if sst.overlaps(pick.minKey, pick.maxKey)], level + 1
+        return [], 0
+
+
+POLICIES = {"tiered": SizeTieredPolicy, "leveled": LeveledPolicy}
+
+
+def writeRuns(tablet, rows, level, expectedKeys, targetFileSize, localityGroup):
+    """Stream a sorted row stream into output SSTs of about targetFileSize bytes each (a single SST if None). Each SST
+    consumes rows until it is full and the next one picks up where it stopped, so rows are never split and the outputs
+    have disjoint key ranges.
+    """
+    rows = iter(rows)
+    for first in rows:
+        yield SSTable(tablet.allocateSSTId(), None, tablet, itertools.chain([first], rows), level, expectedKeys, \
+            targetFileSize, localityGroup)
+
+
+def selectReference(tablet):
+    """A reference to a file shared by a tablet split (see SSTable.reference), to be rewritten into a file of the
+    tablet's own at the same level, so shared files go away even when the policy finds nothing to merge.
+
+    Returns:
+        (list[SSTable], int): the reference, empty if there is none, and the level of the output
+    """
+    for sst in tablet.ssTables:
+        if sst.shared:
+            return [sst], sst.level
+    return [], 0
+
+
+def compactTablet(tablet, metaMgr, policy):
+    """Run one compaction on the tablet if the policy finds work. The merged SST is written without holding the
+    tablet lock, so inserts and reads carry on meanwhile. The tablet's SST list is swapped under the lock and the
+    inputs are only deleted once the new metadata is on disk, so a crash leaves either the old or the new SST set.
+
+    Returns:
+        boolean: True if a compaction was done
+    """
+    with tablet.compactionLock:
+        with tablet.lock:
+            inputs, outputLevel = policy.select(tablet)
+            if not inputs:
+                inputs, outputLevel = selectReference(tablet)
+        if not inputs:
+            return False
+        expectedKeys = sum(sst.getCount() for sst in inputs)
+        rows = mergeSSTables(inputs, tablet.maxCellCopies)
+        outputs = list(writeRuns(tablet, rows, outputLevel, expectedKeys, policy.targetFileSize, inputs[0].localityGroup))
+        maxSeq = max(sst.maxSeq for sst in inputs)
+        for sst in outputs:
+            sst.maxSeq = maxSeq
+        tablet.replaceSSTs(inputs, outputs)
+        metaMgr.logTablet(tablet)
+        with tablet.lock:
+            for sst in inputs:
+                sst.delete()
+        return True
+
+
+class CompactionWorker:
+    def __init__(self, metaMgr):
+        """ Background thread that compacts tablets handed to it through schedule(). Tablets are scheduled after every
+        memtable flush, and a scheduled tablet is compacted until the policy of its compactionStrategy has nothing
+        left to merge.
+
+        Args:
+            metaMgr (MetadataManager): Used to persist the new SST lists
+        """
+        self.metaMgr = metaMgr
+        self.policies = {name: policy() for name, policy in POLICIES.items()}
+        self.tasks = queue.Queue()
+        self.stats = {"compactions": 0, "errors": 0}
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def schedule(self, tablet):
+        self.tasks.put(tablet)
+
+    def run(self):
+        while True:
+            tablet = self.tasks.get()
+            try:
+                policy = self.policies[tablet.compactionStrategy]
+                while compactTablet(tablet, self.metaMgr, policy):
+                    self.stats["compactions"] += 1
+            except Exception:
+                self.stats["errors"] += 1
+                traceback.print_exc()
+            finally:
+                self.tasks.task_done()
+
+    def wait(self):
+        """Block until every scheduled compaction is done.
+        """
+        self.tasks.join()
@@ -0,0 +1,52 @@
+import queue
+import threading
+import traceback
+
+class FlushWorker:
+    def __init__(self, metaMgr, compactor, commitLog):
+        """ Background thread that writes frozen memtables to SSTs. A tablet is scheduled every time it freezes its
+        memtable, and each run flushes the tablet's immutable memtables oldest first, persists the new SST list,
+        deletes the commit log segments that every tablet of the server has flushed and hands the tablet to the
+        compaction worker.
+
+        Args:
+            metaMgr (MetadataManager): Used to persist the new SST lists
+            compactor (CompactionWorker): Compacts tablets after a flush
+            commitLog (WAL): Commit log of the server
+        """
+        self.metaMgr = metaMgr
+        self.compactor = compactor
+        self.commitLog = commitLog
+        self.tasks = queue.Queue()
+        self.stats = {"flushes": 0, "errors": 0}
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def schedule(self, tablet):
+        self.tasks.put(tablet)
+
+    def run(self):
+        while True:
+            tablet = self.tasks.get()
+            try:
+                flushed = False
+                while tablet.flushMemTable(self.commitLog.getAppliedSeq):
+                    self.stats["flushes"] += 1
+                    flushed = True
+                if flushed:
+                    checkpoint = min([t.getCheckpoint(self.commitLog.getAppliedSeq()) \
+                        for tableName in self.metaMgr.getTables() for t in self.metaMgr.getAllTablets(tableName)], \
+                        default=self.commitLog.getAppliedSeq())
+                    self.metaMgr.logTablet(tablet)
+                    self.commitLog.truncate(checkpoint)
+                    self.compactor.schedule(tablet)
+            except Exception:
+                self.stats["errors"] += 1
+                traceback.print_exc()
+            finally:
+                self.tasks.task_done()
+
+    def wait(self):
+        """Block until every scheduled flush is done.
+        """
+        self.tasks.join()
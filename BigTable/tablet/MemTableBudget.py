@@ -0,0 +1,54 @@
+import threading
+
+class MemTableBudget:
+    def __init__(self, capacity):
+        """ Memory budget shared by the memtables of every tablet of a tablet server. Memtables charge the approximate
+        size of every cell they take in and release it once they are flushed. Memory of the active (mutable) memtables
+        is tracked separately from memtables that are frozen and waiting for a flush, since only flushing an active
+        memtable starts freeing memory.
+
+        Args:
+            capacity (int): Total memtable memory in bytes, 0 disables the budget
+        """
+        self.capacity = capacity
+        self.usage = 0
+        self.activeUsage = 0
+        self.lock = threading.Lock()
+
+    def charge(self, size):
+        with self.lock:
+            self.usage += size
+            self.activeUsage += size
+
+    def freeze(self, size):
+        """A memtable holding size bytes stopped taking writes.
+        """
+        with self.lock:
+            self.activeUsage -= size
+
+    def release(self, size, active=False):
+        """A memtable holding size bytes was flushed, or dropped while still active.
+        """
+        with self.lock:
+            self.usage -= size
+            if active:
+                self.activeUsage -= size
+
+    def shouldFlush(self):
+        """Once active memtables use 7/8 of the budget, or the budget is used up and at least half of it sits in
+        active memtables, the largest active memtable should be flushed. Memory that is already being flushed does
+        not trigger more flushes, so a slow flusher does not cause a stream of tiny SSTs.
+        """
+        if self.capacity <= 0:
+            return False
+        with self.lock:
+            if self.activeUsage > self.capacity * 7 // 8:
+                return True
+            return self.usage >= self.capacity and self.activeUsage >= self.capacity // 2
+
+    def setCapacity(self, capacity):
+        with self.lock:
+            self.capacity = capacity
+
+    def getUsage(self):
+        return {"capacity": self.capacity, "usage": self.usage, "active": self.activeUsage}
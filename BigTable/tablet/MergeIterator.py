@@ -0,0 +1,87 @@
+import heapq
+
+def newestFirst(cells):
+    """Cell lists are kept newest first by the memtable and written that way to SSTs. Lists from files written before
+    that are sorted here; ordered lists are returned as they are.
+    """
+    for i in range(1, len(cells)):
+        if float(cells[i][1]) > float(cells[i - 1][1]):
+            return sorted(cells, key=lambda c: float(c[1]), reverse=True)
+    return cells
+
+
+def mergeCells(cellLists, maxCellCopies):
+    """Merge the versions of one cell coming from several sources, newest first, dropping duplicates and everything
+    past maxCellCopies. The lists are already newest first, so this is a k-way merge that stops after maxCellCopies
+    versions.
+    """
+    seen = set()
+    merged = []
+    for c in heapq.merge(*[newestFirst(cells) for cells in cellLists], key=lambda c: float(c[1]), reverse=True):
+        key = (repr(c[0]), float(c[1]))
+        if key not in seen:
+            seen.add(key)
+            merged.append([c[0], float(c[1])])
+            if len(merged) == maxCellCopies:
+                break
+    return merged
+
+
+def mergeRows(rows, maxCellCopies):
+    """Merge several versions of the same row ({cf: {col: cells}}) cell by cell.
+    """
+    merged = {}
+    for row in rows:
+        for cf, cols in row.items():
+            mcf = merged.setdefault(cf, {})
+            for col, cells in cols.items():
+                mcf.setdefault(col, []).append(cells)
+    for cf, cols in merged.items():
+        for col in cols:
+            cols[col] = mergeCells(cols[col], maxCellCopies)
+    return merged
+
+
+def pastEnd(rowKey, rowKeyEnd):
+    """Row ranges are inclusive of rowKeyEnd and of every key that starts with it, i.e. keys are compared to the end
+    key on the end key's length.
+    """
+    return rowKeyEnd is not None and rowKey[:len(rowKeyEnd)] > rowKeyEnd
+
+
+class MergeIterator:
+    def __init__(self, sources, maxCellCopies, rowKeyEnd=None):
+        """ Ordered k-way merge over sorted row sources (the memtable and SSTs, each already positioned at the start
+        key). Yields (row key, row) pairs in key order, one per key, with the versions of every cell from all sources
+        merged newest first. Only one row per source is held in memory at a time and iteration stops at the first key
+        past rowKeyEnd, so a short range costs about as much as the rows it returns.
+
+        Args:
+            sources (list[iterable[(str, dict)]]): Sorted (row key, row) iterators
+            maxCellCopies (int): Versions kept per cell
+            rowKeyEnd (str, optional): Last key of the range (see pastEnd), defaults to no end
+        """
+        self.sources = sources
+        self.maxCellCopies = maxCellCopies
+        self.rowKeyEnd = rowKeyEnd
+
+    def __iter__(self):
+        tagged = [((key, i, row) for key, row in source) for i, source in enumerate(self.sources)]
+        currKey = None
+        currRows = []
+        for key, _, row in heapq.merge(*tagged, key=lambda x: (x[0], x[1])):
+            if currRows and key != currKey:
+                yield currKey, mergeRows(currRows, self.maxCellCopies)
+                currRows = []
+            if pastEnd(key, self.rowKeyEnd):
+                return
+            currKey = key
+            currRows.append(row)
+        if currRows:
+            yield currKey, mergeRows(currRows, self.maxCellCopies)
+
+
+def mergeSSTables(ssTables, maxCellCopies):
+    """Merge whole SSTs for compaction. Blocks read here are kept out of the block cache.
+    """
+    return MergeIterator([sst.iterRows(False) for sst in ssTables], maxCellCopies)
@@ -1,98 +1,314 @@
+import bisect
 import json
 import os
+import threading
 from Tablet import Tablet
 from Table import Table
 
+MANIFEST_LOG = "manifest.log"
+MANIFEST_SNAPSHOT = "manifest.snapshot"
+DEFAULT_SNAPSHOT_EVERY = 1000
+
+
+def readManifest(fileName):
+    """Yields the edits of a manifest log, one JSON object per line. Stops at the first torn or unreadable line, which
+    can only be the tail of a log whose last append did not complete, and cuts the log there so that later appends
+    are not hidden behind it.
+    """
+    if not os.path.exists(fileName):
+        return
+    good = 0
+    with open(fileName, "rb") as f:
+        for line in f:
+            try:
+                if not line.endswith(b"\n"):
+                    raise ValueError("torn edit")
+                edit = json.loads(line)
+            except ValueError:
+                break
+            good += len(line)
+            yield edit
+    if good < os.path.getsize(fileName):
+        with open(fileName, "r+b") as f:
+            f.truncate(good)
+
+
+def applyEdit(tables, tablets, createdSeqs, edit):
+    """Apply a manifest edit to the table definitions and tablet states being rebuilt on startup.
+
+    Args:
+        tables (dict): Table name to table definition (see Table.getAsJson)
+        tablets (dict): Table name to a dict of tablet id to tablet state (see Tablet.getState)
+        createdSeqs (dict): Table name to the commit log sequence number the table was created at
+        edit (dict): The edit
+    """
+    op = edit["op"]
+    if op == "create_table":
+        tables[edit["name"]] = edit["table"]
+        tablets[edit["name"]] = {s["id"]: s for s in edit["tablets"]}
+        createdSeqs[edit["name"]] = edit.get("createdSeq", 0)
+    elif op == "drop_table":
+        tables.pop(edit["table"], None)
+        tablets.pop(edit["table"], None)
+        createdSeqs.pop(edit["table"], None)
+    elif op == "replace_tablets":
+        for tabletId in edit["remove"]:
+            tablets[edit["table"]].pop(tabletId, None)
+        for s in edit["add"]:
+            tablets[edit["table"]][s["id"]] = s
+    elif op == "tablet":
+        state = tablets[edit["table"]][edit["id"]]
+        ssts = [m for m in state["ssts"] if m["id"] not in edit["removeSSTs"]] + edit["addSSTs"]
+        state.update(edit["state"])
+        state["ssts"] = ssts
+    else:
+        raise ValueError("Unknown manifest edit: " + op)
+
+
 class MetadataManager:
-    def __init__(self, metadataPath):
+    def __init__(self, metadataPath, blockCache=None, memTableBudget=None, snapshotEvery=DEFAULT_SNAPSHOT_EVERY):
         """ This class is responsible for handling stuff related to the METADATA file which contains mapping of
         table names to their tablets. Provides relevant tablet for a particular row key.
+
+        The tablets of a table are kept sorted by start key, with the start keys in a parallel list, so a row key is
+        routed with a single bisect. A tablet holds the half-open key range [startKey, endKey), except that the first
+        tablet of a table also takes every key below its start key and the last one every key from its end key on.
+
+        METADATA is kept as a manifest: every change (table created or dropped, tablets split or merged, SSTs of a
+        tablet added or removed) is appended to a log as a small edit, and every snapshotEvery edits a full snapshot is
+        written to a temp file, renamed over the old one, and the log is emptied. Startup loads the snapshot and
+        replays the edits logged after it.
         
         Args:
             metadataPath (str): METADATA file path
+            blockCache (BlockCache, optional): Block cache handed to every tablet loaded from disk
+            memTableBudget (MemTableBudget, optional): Memtable memory budget handed to every tablet loaded from disk
+            snapshotEvery (int, optional): Number of logged edits after which a snapshot is written, defaults to 1000
         """
+        self.blockCache = blockCache
+        self.memTableBudget = memTableBudget
+        self.snapshotEvery = snapshotEvery
+        self.lock = threading.Lock()
         self.tableTabletMap = {}
+        self.tabletIndex = {}
         self.tableIdx = {}
+        self.createdSeqs = {}
+        self.loggedSSTs = {}
+        self.editSeq = 0
+        self.editsSinceSnapshot = 0
         self.metadataPath = metadataPath
         self.table_meta = self.metadataPath + "/" + "meta.table"
         self.tablet_meta = self.metadataPath + "/" + "meta.tablet"
-        if os.path.exists(self.table_meta) and os.path.exists(self.tablet_meta):
+        self.manifestLog = self.metadataPath + "/" + MANIFEST_LOG
+        self.manifestSnapshot = self.metadataPath + "/" + MANIFEST_SNAPSHOT
+        if os.path.exists(self.manifestSnapshot) or os.path.exists(self.manifestLog):
+            self.loadManifest()
+        elif os.path.exists(self.table_meta) and os.path.exists(self.tablet_meta):
             self.loadFromDisk()
-
+            self.dumpToDisk()
+            os.remove(self.table_meta)
+            os.remove(self.tablet_meta)
 
     def loadFromDisk(self):
+        """Load the METADATA files written in full by earlier versions.
+        """
         with open(self.tablet_meta) as f:
             tablet_map = json.loads(f.read())
-            for tName, vals in tablet_map.items():
-                self.tableTabletMap[tName] = []
-                for val in vals:
-                    self.tableTabletMap[tName].append(Tablet(None,None,None,None,None,None,val))
-        
         with open(self.table_meta) as f:
             table_map = json.loads(f.read())
-            for tName, val in table_map.items():
-                self.tableIdx[tName] = Table(None,None,val)
+        self.buildTables(table_map, tablet_map)
+
+    def loadManifest(self):
+        tables, tablets = {}, {}
+        if os.path.exists(self.manifestSnapshot):
+            with open(self.manifestSnapshot) as f:
+                snapshot = json.loads(f.read())
+            self.editSeq = snapshot["edit"]
+            tables = snapshot["tables"]
+            tablets = {tName: {s["id"]: s for s in states} for tName, states in snapshot["tablets"].items()}
+            self.createdSeqs = snapshot.get("createdSeqs", {})
+        for edit in readManifest(self.manifestLog):
+            if edit["n"] <= self.editSeq:
+                continue
+            applyEdit(tables, tablets, self.createdSeqs, edit)
+            self.editSeq = edit["n"]
+            self.editsSinceSnapshot += 1
+        self.buildTables(tables, {tName: [json.dumps(s) for s in states.values()] for tName, states in tablets.items()})
+
+    def buildTables(self, table_map, tablet_map):
+        for tName, vals in tablet_map.items():
+            self.tableTabletMap[tName] = []
+            for val in vals:
+                self.tableTabletMap[tName].append(Tablet(None,None,None,None,None,None,val,blockCache=self.blockCache, \
+                    memTableBudget=self.memTableBudget))
+            self.indexTablets(tName)
+            for tablet in self.tableTabletMap[tName]:
+                self.loggedSSTs[tablet] = set(sst.id for sst in tablet.ssTables)
+        for tName, val in table_map.items():
+            self.tableIdx[tName] = Table(None,None,val)
+            for tablet in self.tableTabletMap.get(tName, []):
+                tablet.columnIndex.addColumns(self.tableIdx[tName].getColumns())
 
     def dumpToDisk(self):
-        serialized_dict = {}
-        for tableName, tablets in self.tableTabletMap.items():
-            serialized_dict[tableName] = []
-            for tablet in tablets:
-                serialized_dict[tableName].append(tablet.serialize())
-        s = json.dumps(serialized_dict)
-        with open(self.tablet_meta,"w") as f:
-            f.write(s)
-        
-        serialized_dict = {}
-        for tableName, table in self.tableIdx.items():
-            serialized_dict[tableName] = table.getAsJson()
-        s = json.dumps(serialized_dict)
-        with open(self.table_meta,"w") as f:
+        """Write a snapshot of the whole METADATA and empty the manifest log. The snapshot is written to a temp file
+        first and renamed over the old one, so readers never see a partially written snapshot, and it records the last
+        edit it covers so that edits left in the log by a crash right after the rename are skipped.
+        """
+        with self.lock:
+            self.writeSnapshot()
+
+    def writeSnapshot(self):
+        tablets = {}
+        for tableName, tabletList in list(self.tableTabletMap.items()):
+            tablets[tableName] = [tablet.getState() for tablet in tabletList]
+        tables = {}
+        for tableName, table in list(self.tableIdx.items()):
+            tables[tableName] = table.getAsJson()
+        self.writeAtomic(self.manifestSnapshot, json.dumps({"edit": self.editSeq, "tables": tables, "tablets": tablets, \
+            "createdSeqs": dict(self.createdSeqs)}))
+        open(self.manifestLog, "w").close()
+        self.editsSinceSnapshot = 0
+        for tableName, tabletList in list(self.tableTabletMap.items()):
+            for tablet, state in zip(tabletList, tablets[tableName]):
+                self.loggedSSTs[tablet] = set(m["id"] for m in state["ssts"])
+
+    def logEdit(self, edit):
+        """Durably append an edit to the manifest log, and write a snapshot once enough edits piled up. The caller
+        holds self.lock.
+        """
+        self.editSeq += 1
+        edit["n"] = self.editSeq
+        with open(self.manifestLog, "a") as f:
+            f.write(json.dumps(edit) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.editsSinceSnapshot += 1
+        if self.editsSinceSnapshot >= self.snapshotEvery:
+            self.writeSnapshot()
+
+    def logTablet(self, tablet):
+        """Log the SSTs a tablet gained and lost (by flushes and compactions) since it was last logged, along with its
+        settings.
+        """
+        with self.lock:
+            if tablet not in self.tableTabletMap.get(tablet.tableName, []):
+                return
+            state = tablet.getState()
+            ssts = state.pop("ssts")
+            logged = self.loggedSSTs.get(tablet, set())
+            current = set(m["id"] for m in ssts)
+            self.logEdit({"op": "tablet", "table": tablet.tableName, "id": tablet.id, "state": state, \
+                "addSSTs": [m for m in ssts if m["id"] not in logged], "removeSSTs": sorted(logged - current)})
+            self.loggedSSTs[tablet] = current
+
+    def writeAtomic(self, fileName, s):
+        tmp = fileName + ".tmp"
+        with open(tmp,"w") as f:
             f.write(s)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, fileName)
     
-    def getTables(self, serverIds):
+    def getTables(self, serverIds=None):
         tables = []
-        for t_name, tablets in self.tableTabletMap.items():
+        for t_name, tablets in list(self.tableTabletMap.items()):
             for tablet in tablets: 
-                if tablet.serverId in serverIds:
+                if serverIds is None or tablet.serverId in serverIds:
                     tables.append(t_name)
                     break
         return tables
     
     def getTable(self, tableName):
         return self.tableIdx[tableName]
+
+    def getCreatedSeq(self, tableName):
+        return self.createdSeqs.get(tableName, 0)
     
-    def addTable(self, table, tablet, dump=True):
-        self.tableIdx[table.name] = table
-        self.tableTabletMap[table.name] = [tablet]
-        if dump is True:
-            self.dumpToDisk()
+    def addTable(self, table, tablet, dump=True, createdSeq=0):
+        """Add a table along with its first tablet.
+
+        Args:
+            createdSeq (int, optional): Commit log sequence number at the time the table is created. Log records up to
+                it belong to an earlier table of the same name and are not replayed into this one, defaults to 0
+        """
+        with self.lock:
+            self.tableIdx[table.name] = table
+            self.tableTabletMap[table.name] = [tablet]
+            self.createdSeqs[table.name] = createdSeq
+            self.indexTablets(table.name)
+            if dump is True:
+                state = tablet.getState()
+                self.logEdit({"op": "create_table", "name": table.name, "table": table.getAsJson(), "tablets": [state], \
+                    "createdSeq": createdSeq})
+                self.loggedSSTs[tablet] = set(m["id"] for m in state["ssts"])
     
     def addTablet(self, tablet):
-        tablets_for_table = self.tableTabletMap[tablet.tableName]
-        tablets_for_table.append(tablet)
-        self.metaMgr.dumpToDisk()
-    
+        self.replaceTablets(tablet.tableName, [], [tablet])
+
+    def replaceTablets(self, tableName, oldTablets, newTablets, dump=True):
+        """Swap tablets of a table for others covering the same key range, as done by a split or a merge.
+        """
+        with self.lock:
+            self.tableTabletMap[tableName] = [t for t in self.tableTabletMap[tableName] if t not in oldTablets] + newTablets
+            self.indexTablets(tableName)
+            for t in oldTablets:
+                self.loggedSSTs.pop(t, None)
+            if dump is True:
+                states = [t.getState() for t in newTablets]
+                self.logEdit({"op": "replace_tablets", "table": tableName, "remove": [t.id for t in oldTablets], \
+                    "add": states})
+                for t, state in zip(newTablets, states):
+                    self.loggedSSTs[t] = set(m["id"] for m in state["ssts"])
+
+    def indexTablets(self, tableName):
+        """Sort the tablets of a table by start key and rebuild the start key list used for routing. Both are swapped in
+        at once, so routing never sees a half updated index.
+        """
+        tablets = sorted(self.tableTabletMap[tableName], key=lambda t: str(t.startKey))
+        self.tableTabletMap[tableName] = tablets
+        self.tabletIndex[tableName] = ([str(t.startKey) for t in tablets], tablets)
+
     def getRelevantTablet(self,tableName,rowKey):
-        tablets = self.getAllTablets(tableName)
-        for t in tablets:
-            if t.intersect(rowKey) is True:
-                return t
-        raise "ERROR: No relevant tablet!"
-        
+        starts, tablets = self.tabletIndex[tableName]
+        return tablets[max(bisect.bisect_right(starts, str(rowKey)) - 1, 0)]
+
+    def getTabletsInRange(self, tableName, rowKeyStart, rowKeyEnd, pastEnd):
+        """Tablets that may hold keys of a row range, in key order.
+
+        Args:
+            pastEnd (function): Tells whether a key is past rowKeyEnd, see MergeIterator.pastEnd
+        """
+        starts, tablets = self.tabletIndex[tableName]
+        first = 0 if rowKeyStart is None else max(bisect.bisect_right(starts, str(rowKeyStart)) - 1, 0)
+        inRange = []
+        for t in tablets[first:]:
+            if inRange and pastEnd(str(t.startKey), rowKeyEnd):
+                break
+            inRange.append(t)
+        return inRange
+
     def getAllTablets(self, tableName):
         if tableName in self.tableTabletMap:
             return self.tableTabletMap[tableName]
         return []
     
     def removeTable(self, tableName):
-        tablets = self.getAllTablets(tableName)
+        """The drop is logged, and synced, before any file of the table is deleted, so METADATA never points at
+        deleted SSTs.
+        """
+        with self.lock:
+            tablets = self.getAllTablets(tableName)
+            del self.tableTabletMap[tableName]
+            del self.tabletIndex[tableName]
+            del self.tableIdx[tableName]
+            self.createdSeqs.pop(tableName, None)
+            for t in tablets:
+                self.loggedSSTs.pop(t, None)
+            self.logEdit({"op": "drop_table", "table": tableName})
         for t in tablets:
             t.delete()
-        del self.tableTabletMap[tableName]
-        del self.tableIdx[tableName]
-        self.dumpToDisk()
     
     def delete(self):
-        os.remove(self.table_meta)
-        os.remove(self.tablet_meta)
\ No newline at end of file
+        for fileName in [self.manifestSnapshot, self.manifestLog, self.table_meta, self.tablet_meta]:
+            if os.path.exists(fileName):
+                os.remove(fileName)
\ No newline at end of file
@@ -1,29 +1,46 @@
 import json
 
+DEFAULT_LOCALITY_GROUP = "default"
+
+DURABILITY_SYNC = "sync"
+DURABILITY_INTERVAL = "interval"
+DURABILITY_NONE = "none"
+DURABILITY_MODES = (DURABILITY_SYNC, DURABILITY_INTERVAL, DURABILITY_NONE)
+DEFAULT_SYNC_INTERVAL_MS = 100
+
 class ColumnFamily:
-    def __init__(self, name, columns):
+    def __init__(self, name, columns, localityGroup=DEFAULT_LOCALITY_GROUP):
         """ Definition for a column family containing list of columns
         
         Args:
             name (str): name of column family
             columns (list[str]): list of column names
-            loadFromJson (str, optional: Load serialized ColumnFamily
+            localityGroup (str, optional): Locality group of the family. Each group of a tablet is flushed to its own
+                SSTs, so reads of one family never touch the bytes of families in other groups, defaults to "default"
         """
         self.columns = columns
         self.name = name
+        self.localityGroup = localityGroup
 
 
 class Table:
-    def __init__(self, name, columnFamilies, loadFromJson=None):
+    def __init__(self, name, columnFamilies, loadFromJson=None, durability=DURABILITY_SYNC, syncIntervalMs=DEFAULT_SYNC_INTERVAL_MS):
         """ Definition of a table. Consists of a name and a list of ColumnFamily objects.
         
         Args:
             name (str): Table name // Ignored if loadFromJson is not None
             columnFamilies (List[ColumnFamily]): List of column families // Ignored if loadFromJson is not None
             loadFromJson (str, optional): Serialized JSON str representing object.
+            durability (str, optional): How inserts are logged. "sync": an insert returns once its commit log record
+                is on disk. "interval": an insert returns right away and its record is on disk within syncIntervalMs.
+                "none": inserts are not logged, so rows not flushed to SSTs yet are lost on a crash. Defaults to "sync"
+            syncIntervalMs (int, optional): Max delay before a logged insert is on disk for the "interval" mode,
+                defaults to 100
         """
         self.name = name
         self.columnFamilies = columnFamilies
+        self.durability = durability
+        self.syncIntervalMs = syncIntervalMs
         
         if loadFromJson is not None:
             self.loadFromJson(loadFromJson)
@@ -31,10 +48,13 @@ class Table:
     def getAsJson(self):
         resp = {}
         resp["name"] = self.name
+        resp["durability"] = self.durability
+        resp["sync_interval_ms"] = self.syncIntervalMs
         resp["column_families"] = []
         for cf in self.columnFamilies:
             cf_resp = {}
             cf_resp["column_family_key"] = cf.name
+            cf_resp["locality_group"] = cf.localityGroup
             cf_resp["columns"] = []
             for c in cf.columns:
                 cf_resp["columns"].append(c)
@@ -44,8 +64,29 @@ class Table:
     def loadFromJson(self, jsonStr):
         resp = json.loads(jsonStr)
         self.name = resp["name"]
+        self.durability = resp.get("durability", DURABILITY_SYNC)
+        self.syncIntervalMs = resp.get("sync_interval_ms", DEFAULT_SYNC_INTERVAL_MS)
         self.columnFamilies = []
         for cf in resp["column_families"]:
             cf_name = cf["column_family_key"]
             cf_cols = cf["columns"]
-            self.columnFamilies.append(ColumnFamily(cf_name,cf_cols))
\ No newline at end of file
+            cf_group = cf.get("locality_group", DEFAULT_LOCALITY_GROUP)
+            self.columnFamilies.append(ColumnFamily(cf_name,cf_cols,cf_group))
+
+    def getLocalityGroups(self):
+        return {cf.name: cf.localityGroup for cf in self.columnFamilies}
+
+    def getSyncDelay(self):
+        """Seconds a logged insert may wait before it is on disk, 0 to wait for the fsync, None if inserts are not
+        logged.
+        """
+        if self.durability == DURABILITY_NONE:
+            return None
+        if self.durability == DURABILITY_INTERVAL:
+            return self.syncIntervalMs / 1000
+        return 0
+
+    def getColumns(self):
+        """(column family, column key) pairs of the schema, in schema order.
+        """
+        return [(cf.name, col) for cf in self.columnFamilies for col in cf.columns]
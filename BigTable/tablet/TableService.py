@@ -1,53 +1,136 @@
 from MetadataManager import MetadataManager
-from WAL import WAL
-from Tablet import Tablet
+import WAL
+from Tablet import Tablet, TabletSplitError
+from BlockCache import BlockCache
+from MemTableBudget import MemTableBudget
+from Compaction import CompactionWorker
+from Flush import FlushWorker
+from MergeIterator import pastEnd
 import os
+import threading
+
+DEFAULT_MEMTABLE_MAX_BYTES = 4 * 1024 * 1024
 
 class TableService:
-    def __init__(self, metadataPath, ssTablePath, walPath):
+    def __init__(self, metadataPath, ssTablePath, walPath, blockCacheSize = 8 * 1024 * 1024, memTableBudget = 64 * 1024 * 1024):
         """ This is the main data serving service. It will be used by clients for all kinds of queries.
         
         Args:
             metadataPath (str): Path to store the METADATA file. 
             ssTablePath (str): Path to store SSTables for each Tablet
-            walPath (str): Path to store Write Ahead Log for each table
+            walPath (str): Path to store the commit log shared by all tablets
+            blockCacheSize (int, optional): Size in bytes of the SST block cache shared by all tablets, defaults to 8MB
+            memTableBudget (int, optional): Memory in bytes shared by the memtables of all tablets. Once it runs out the
+                largest memtable is flushed, defaults to 64MB
         """
-        self.metaMgr = MetadataManager(metadataPath)
+        self.blockCache = BlockCache(blockCacheSize)
+        self.memTableBudget = MemTableBudget(memTableBudget)
+        self.metaMgr = MetadataManager(metadataPath, self.blockCache, self.memTableBudget)
         self.metadataPath = metadataPath
         self.ssTablePath = ssTablePath
         self.walPath = walPath
-        self.WALIdx = {}
+        self.commitLog = WAL.WAL(walPath)
+        self.splitLock = threading.Lock()
+        self.compactor = CompactionWorker(self.metaMgr)
+        self.flusher = FlushWorker(self.metaMgr, self.compactor, self.commitLog)
         self.loadWAL()
+        for tableName in self.metaMgr.getTables():
+            for tablet in self.metaMgr.getAllTablets(tableName):
+                self.compactor.schedule(tablet)
     
     def loadWAL(self):
-        tables = self.metaMgr.getTables()
-        for t in tables:
-            if os.path.exists(self.walPath + "/" + t.name + ".wal"):
-                with open(self.walPath + "/" + t.name + ".wal") as f:
-                    self.WALIdx[t.name] = WAL(self.walPath,t.name,f.read())
-                    self.WALIdx[t.name].replay(self)
+        """Recover the writes that did not make it to SSTs: per-table logs of earlier versions are replayed and flushed,
+        then the commit log is split by tablet and every tablet replays its own split. No segment is deleted until
+        every split is replayed, since flushes of the tablets replayed first would otherwise truncate the log past
+        records of tablets still waiting.
+        """
+        for t in self.metaMgr.getTables():
+            files = WAL.tableLogFiles(self.walPath, t)
+            if files:
+                self.migrateTableLog(t, files)
+        persistedSeqs = {}
+        def route(tableName, tabletId, rowKey, seq):
+            tablet = self.findLogTablet(tableName, rowKey, seq)
+            if tablet is None:
+                return None
+            if tablet not in persistedSeqs:
+                persistedSeqs[tablet] = tablet.getPersistedSeq()
+            return tablet if seq > persistedSeqs[tablet] else None
+        recoveryPath = self.walPath + "/recovery"
+        os.makedirs(recoveryPath, exist_ok=True)
+        self.commitLog.holdTruncation()
+        try:
+            for tablet, fileName in self.commitLog.splitByTablet(route, recoveryPath).items():
+                self.replayTablet(tablet, fileName)
+                os.remove(fileName)
+        finally:
+            self.commitLog.holdTruncation(False)
+        self.commitLog.skipTo(max([t.getPersistedSeq() for tableName in self.metaMgr.getTables() \
+            for t in self.metaMgr.getAllTablets(tableName)], default=0))
+
+    def findLogTablet(self, tableName, rowKey, seq=None):
+        """The tablet a commit log record belongs to: the one now holding its row key, which differs from the tablet it
+        was logged for if that one was split or merged since. None if the table was deleted, or if the record (with
+        sequence number seq) was logged before the table was created, i.e. for a dropped table of the same name.
+        """
+        if tableName not in self.metaMgr.getTables():
+            return None
+        if seq is not None and seq <= self.metaMgr.getCreatedSeq(tableName):
+            return None
+        return self.metaMgr.getRelevantTablet(tableName, rowKey)
+
+    def replayTablet(self, tablet, fileName):
+        """Apply a tablet's split of the commit log (see WAL.splitByTablet) to its memtable.
+        """
+        for seq, rowKey, colFam, col, content, timestamp in WAL.replaySplit(fileName):
+            if tablet.addRow(rowKey, colFam, col, content, timestamp, seq):
+                self.flusher.schedule(tablet)
+            self.enforceMemTableBudget()
+
+    def migrateTableLog(self, tableName, files):
+        """Replay the per-table log kept by earlier versions and flush the table, after which the log is deleted.
+        """
+        persistedSeqs = {}
+        for fileName in files:
+            for seq, rowKey, colFam, col, content, timestamp in WAL.readTableLog(fileName):
+                tablet = self.metaMgr.getRelevantTablet(tableName, rowKey)
+                if tablet not in persistedSeqs:
+                    persistedSeqs[tablet] = tablet.getPersistedSeq()
+                if seq is None or seq > persistedSeqs[tablet]:
+                    if tablet.addRow(rowKey, colFam, col, content, timestamp):
+                        self.flusher.schedule(tablet)
+                    self.enforceMemTableBudget()
+        for tablet in self.metaMgr.getAllTablets(tableName):
+            if tablet.freezeMemTable():
+                self.flusher.schedule(tablet)
+        self.flusher.wait()
+        for fileName in files:
+            os.remove(fileName)
     
-    def createTable(self, table, maxCellCopies = 5, tabletCapacity = 100, memTableCapacity = 100):
+    def createTable(self, table, maxCellCopies = 5, tabletCapacity = 100, memTableCapacity = 100, bloomBitsPerKey = 10, compactionStrategy = "tiered", memTableMaxBytes = DEFAULT_MEMTABLE_MAX_BYTES, durability = None, syncIntervalMs = None):
+        """Memtables of the new table are flushed once they hold memTableCapacity rows or memTableMaxBytes bytes,
+        whichever comes first. Either limit can be None. durability and syncIntervalMs, if given, override the ones
+        of the table definition (see Table) and are stored with it.
+        """
         if self.tableExists(table.name):
             return False
-        wal = WAL(self.walPath, table.name)
-        self.WALIdx[table.name] = wal
-        tablet = self.createTablet(table,maxCellCopies,tabletCapacity,memTableCapacity)
-        self.metaMgr.addTable(table,tablet)
+        if durability is not None:
+            table.durability = durability
+        if syncIntervalMs is not None:
+            table.syncIntervalMs = syncIntervalMs
+        tablet = self.createTablet(table,maxCellCopies,tabletCapacity,memTableCapacity,bloomBitsPerKey,compactionStrategy,memTableMaxBytes)
+        self.metaMgr.addTable(table,tablet,createdSeq=self.commitLog.getLastSeq())
         return True
     
     def tableExists(self,tableName):
-        return tableName in self.WALIdx
+        return tableName in self.metaMgr.getTables()
     
     def deleteTable(self,tableName):
         self.metaMgr.removeTable(tableName)
-        self.WALIdx[tableName].delete()
-        del self.WALIdx[tableName]
+        self.blockCache.dropTable(tableName)
     
     def listTables(self):
-        tables = self.metaMgr.getTables()
-        table_names = [t.name for t in tables]
-        return table_names
+        return self.metaMgr.getTables()
 
     def getTableInfo(self, tableName):
         table = self.metaMgr.getTable(tableName)
@@ -59,38 +142,134 @@ class TableService:
         return data
     
     def getEntryRange(self, tableName, rowKeyStart, rowKeyEnd, colFam, col):
-        tablet = self.metaMgr.getAllTablets(tableName)
+        return self.getEntryRangePage(tableName, rowKeyStart, rowKeyEnd, colFam, col)[0]
+
+    def getEntryRangePage(self, tableName, rowKeyStart, rowKeyEnd, colFam, col, limit=None):
+        """Returns at most limit rows of the range, in key order, and the row key to pass as rowKeyStart to get the
+        next page (None once the range is exhausted).
+        """
+        tablets = self.metaMgr.getTabletsInRange(tableName, rowKeyStart, rowKeyEnd, pastEnd)
         data = {}
-        for t in tablet:
-            curr = t.getRowRange(rowKeyStart,rowKeyEnd,colFam,col)
-            if curr is not None and len(curr) > 0:
-                data = dict(list(data.items()) + list(curr.items()))
-        return data
+        for t in tablets:
+            remaining = None if limit is None else limit - len(data)
+            curr, nextKey = t.getRowRangePage(rowKeyStart,rowKeyEnd,colFam,col,remaining)
+            data.update(curr)
+            if nextKey is not None:
+                return data, nextKey
+        return data, None
     
     def addNewEntry(self,tableName, rowKey, colFam, col, content, time_val, walWrite=True):
-        if walWrite is True:
-            self.WALIdx[tableName].appendAddQuery(rowKey, colFam, col, content, time_val)
-            self.WALIdx[tableName].save()
         tablet = self.metaMgr.getRelevantTablet(tableName, rowKey)
         if tablet.isFull() is True:
             self.splitTablet(tablet)
             tablet = self.metaMgr.getRelevantTablet(tableName, rowKey)
-        meta_change = tablet.addRow(rowKey, colFam, col, content, time_val)
-        if meta_change:
-            self.metaMgr.dumpToDisk()
+        seq = None
+        syncDelay = self.metaMgr.getTable(tableName).getSyncDelay()
+        if walWrite is True and syncDelay is not None:
+            seq = self.commitLog.appendAddQuery(tableName, tablet.id, rowKey, colFam, col, content, time_val, syncDelay)
+        try:
+            while True:
+                try:
+                    frozen = tablet.addRow(rowKey, colFam, col, content, time_val, seq)
+                    break
+                except TabletSplitError:
+                    tablet = tablet.getSplitChild(rowKey)
+            if frozen:
+                self.flusher.schedule(tablet)
+        finally:
+            if seq is not None:
+                self.commitLog.applied(seq)
+        self.enforceMemTableBudget()
+
+    def enforceMemTableBudget(self):
+        """Flush the largest active memtable of the server when the memtable budget says so. The write stalls while
+        that tablet's flush queue is backed up, so memtables frozen for the budget cannot pile up either.
+        """
+        if not self.memTableBudget.shouldFlush():
+            return
+        tablets = [t for tableName in self.metaMgr.getTables() for t in self.metaMgr.getAllTablets(tableName)]
+        if not tablets:
+            return
+        largest = max(tablets, key=lambda t: t.getActiveMemTableBytes())
+        if largest.freezeMemTable(stall=True):
+            self.flusher.schedule(largest)
     
     def changeMemtableCapacity(self,tableName,newVal):
         tablets = self.metaMgr.getAllTablets(tableName)
         for t in tablets:
-            t.changeMemtableCapacity(newVal)
+            if t.changeMemtableCapacity(newVal):
+                self.flusher.schedule(t)
+
+    def changeMemtableMaxBytes(self,tableName,newVal):
+        tablets = self.metaMgr.getAllTablets(tableName)
+        for t in tablets:
+            if t.changeMemtableMaxBytes(newVal):
+                self.flusher.schedule(t)
+
+    def changeMemtableBudget(self, newVal):
+        self.memTableBudget.setCapacity(newVal)
+        self.enforceMemTableBudget()
     
+    def waitForFlushes(self):
+        self.flusher.wait()
+
+    def waitForCompactions(self):
+        self.flusher.wait()
+        self.compactor.wait()
+
     def splitTablet(self,tablet):
-        pass
+        """Split a full tablet in two at an approximate median key of its data (see Tablet.findSplitKey). The new
+        tablets share the SST files of the old one until compaction rewrites them, so a split costs a pass over the
+        block indexes and the memtable keys rather than a copy of the data. A tablet without a usable split key is
+        tried again once it doubled in size.
+
+        Returns:
+            boolean: True if the tablet was split
+        """
+        with self.splitLock:
+            if tablet.children is not None or not tablet.isFull():
+                return False
+            with tablet.lock:
+                divider = tablet.findSplitKey()
+            if divider is None:
+                tablet.splitRetrySize = tablet.getCurrentSize() * 2
+                return False
+            nextId = max(t.id for t in self.metaMgr.getAllTablets(tablet.tableName)) + 1
+            children = tablet.split(divider, nextId, nextId + 1)
+            self.metaMgr.replaceTablets(tablet.tableName, [tablet], list(children))
+        for child in children:
+            if child.immutableMemTables:
+                self.flusher.schedule(child)
+            self.compactor.schedule(child)
+        return True
 
-    def createTablet(self, table, maxCellCopies, tabletCapacity, memTableCapacity):
+    def createTablet(self, table, maxCellCopies, tabletCapacity, memTableCapacity, bloomBitsPerKey = 10, compactionStrategy = "tiered", memTableMaxBytes = None):
         curr_tablets = self.metaMgr.getAllTablets(table.name)
-        tablet = Tablet(len(curr_tablets), 0, table.name, '0', 'z', self.ssTablePath, None, maxCellCopies, tabletCapacity, memTableCapacity)
+        tablet = Tablet(len(curr_tablets), 0, table.name, '0', 'z', self.ssTablePath, None, maxCellCopies, tabletCapacity, memTableCapacity, bloomBitsPerKey, self.blockCache, compactionStrategy, table.getLocalityGroups(), memTableMaxBytes, self.memTableBudget, table.getColumns())
         return tablet
     
+    def getBloomStats(self, tableName):
+        stats = {"hits": 0, "misses": 0, "false_positives": 0}
+        for t in self.metaMgr.getAllTablets(tableName):
+            for k, v in t.getBloomStats().items():
+                stats[k] += v
+        return stats
+
+    def getFlushStats(self, tableName):
+        stats = {"flushes": 0, "stalls": 0, "stall_seconds": 0.0, "immutable_memtables": 0, "memtable_bytes": 0}
+        for t in self.metaMgr.getAllTablets(tableName):
+            for k, v in t.getFlushStats().items():
+                stats[k] += v
+        return stats
+
+    def getWALStats(self):
+        return self.commitLog.getStats()
+
+    def getBlockCacheStats(self, tableName):
+        return self.blockCache.getStats(tableName)
+
+    def changeBlockCacheSize(self, newVal):
+        self.blockCache.setCapacity(newVal)
+
     def getTablets(self, tname):
         return self.metaMgr.getAllTablets(tname)
\ No newline at end of file
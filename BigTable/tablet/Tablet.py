@@ -1,178 +1,806 @@
-import collections
+import bisect
 import json
 import os
+import struct
+import sys
+import threading
+import time
+from BloomFilter import BloomFilter
+from CompactRow import ColumnIndex, CompactRow
+from MergeIterator import MergeIterator, mergeCells, mergeRows, pastEnd
+from Table import DEFAULT_LOCALITY_GROUP
+
+BLOCK_SIZE = 4096
+WRITE_BUFFER_SIZE = 64 * 1024
+SST_FORMAT_VERSION = 2
+SST_MAGIC = b"BTSSTBLK"
+SST_TRAILER_FORMAT = ">QI8s"
+SST_TRAILER_SIZE = struct.calcsize(SST_TRAILER_FORMAT)
+MAX_IMMUTABLE_MEMTABLES = 2
+MEMTABLE_ROW_OVERHEAD = 320
+MEMTABLE_CELL_OVERHEAD = 64
+
+
+class TabletSplitError(Exception):
+    """Raised by a write that reached a tablet after it was split. The write belongs to one of the new tablets, see
+    Tablet.getSplitChild.
+    """
+
+
+class SharedFiles:
+    def __init__(self):
+        """ Counts the SSTs, across all tablets, that read a file shared by a tablet split (see SSTable.reference), so
+        the file is only deleted along with the last of them.
+        """
+        self.refs = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, fileName):
+        with self.lock:
+            self.refs[fileName] = self.refs.get(fileName, 0) + 1
+
+    def release(self, fileName):
+        """Returns True if that was the last SST reading the file.
+        """
+        with self.lock:
+            self.refs[fileName] -= 1
+            if self.refs[fileName] > 0:
+                return False
+            del self.refs[fileName]
+            return True
+
+
+SHARED_FILES = SharedFiles()
+
 
 class MemTable:
-    """An in memory data structure for storing most recent insertions/deletions in this tablet. After it reaches capacity it is dumped
-    to disk as an SST and then cleare. 
+    """An in memory data structure for storing most recent insertions/deletions in this tablet. After it reaches capacity it is frozen
+    by the tablet, which starts a new one for writes, and a background flusher dumps it to disk as an SST.
+
+    Rows live in a dict for point lookups, and their keys are also kept in a sorted list (new keys are placed with
+    bisect), so flushes stream rows out in order without sorting and scans can seek straight to their start key. Each
+    row is a CompactRow keyed by the column ids of the tablet's ColumnIndex; reads turn the cells they ask for back
+    into {column family: {column key: cells}} dicts.
+
+    The memtable keeps an approximate count of the bytes it holds (keys and cell contents plus a fixed overhead per
+    row and per cell), which is charged to the tablet's memtable budget as rows come in. It also tracks the lowest WAL
+    sequence number among its cells, which bounds the log records the tablet still needs (see Tablet.getCheckpoint).
     """
 
-    def __init__(self, capacity, tablet, maxCellCopies):
+    def __init__(self, capacity, tablet, maxCellCopies, maxBytes=None):
         self.rowEntries = {}
+        self.rowKeys = []
         self.capacity = capacity
+        self.maxBytes = maxBytes
+        self.bytes = 0
+        self.minSeq = None
         self.tablet = tablet
         self.maxCellCopies = maxCellCopies
     
-    def changeCapacity(self, newVal):
-        self.capacity = newVal
-        if len(self.rowEntries) > newVal:
-            self.createSSTable()
-    
     def getCurrentSize(self):
         return len(self.rowEntries)
+
+    def getBytes(self):
+        return self.bytes
+
+    def isFull(self):
+        """Full once either limit is reached: capacity rows or maxBytes bytes. A limit set to None is not checked.
+        """
+        if self.capacity is not None and len(self.rowEntries) >= self.capacity:
+            return True
+        return self.maxBytes is not None and self.bytes >= self.maxBytes
+
+    def charge(self, size):
+        self.bytes += size
+        if self.tablet.memTableBudget is not None:
+            self.tablet.memTableBudget.charge(size)
     
     def clear(self):
         self.rowEntries = {}
+        self.rowKeys = []
+        self.bytes = 0
+        self.minSeq = None
+
+    def iterKeys(self, rowKeyStart=None):
+        """Yields the row keys in sorted order, starting at rowKeyStart. Callers must not modify the memtable while
+        iterating, which the tablet lock guarantees.
+        """
+        keys = self.rowKeys
+        i = 0 if rowKeyStart is None else bisect.bisect_left(keys, rowKeyStart)
+        while i < len(keys):
+            yield keys[i]
+            i += 1
     
-    def getRow(self, rowKey, columnFamily=None, columnKey=None):
-        if rowKey not in self.rowEntries:
+    def iterRows(self, rowKeyStart=None, projection=None):
+        """Yields (row key, row) pairs in sorted order, starting at rowKeyStart. With a projection only its cells are
+        returned and rows holding none of them are skipped.
+        """
+        for key in self.iterKeys(rowKeyStart):
+            row = self.expandRow(self.rowEntries[key], projection)
+            if row:
+                yield key, row
+
+    def expandRow(self, row, projection=None, localityGroup=None):
+        """Turn a CompactRow into a {column family: {column key: cells}} dict, keeping only the cells of the projection
+        and of the locality group if given.
+        """
+        columns = self.tablet.columnIndex
+        if projection is not None:
+            colIds = [columns.findId(cf, col) for cf, col in projection]
+        else:
+            colIds = row.getColumnIds()
+        expanded = {}
+        for colId in colIds:
+            if colId is None:
+                continue
+            cf, col = columns.getName(colId)
+            if localityGroup is not None and self.tablet.getLocalityGroup(cf) != localityGroup:
+                continue
+            cells = row.getCells(colId)
+            if cells is not None:
+                expanded.setdefault(cf, {})[col] = cells
+        return expanded
+
+    def getRow(self, rowKey, columnFamily=None, columnKey=None, projection=None):
+        """Returns the cells of one column if columnFamily and columnKey are given, else the row cut down to the
+        projection (see expandRow). None if the row, or the column, is not in the memtable.
+        """
+        row = self.rowEntries.get(rowKey)
+        if row is None:
             return None
         if columnFamily and columnKey:
-            if columnFamily in self.rowEntries[rowKey] and columnKey in self.rowEntries[rowKey][columnFamily]:
-                return self.rowEntries[rowKey][columnFamily][columnKey]
-            else:
-                return None
-        else:
-            return self.rowEntries[rowKey]
+            colId = self.tablet.columnIndex.findId(columnFamily, columnKey)
+            return None if colId is None else row.getCells(colId)
+        return self.expandRow(row, projection)
     
-    def addRow(self, rowKey, columnFamily, columnKey, cellContent, time_val):
-        created_sst = False
-        if len(self.rowEntries) == self.capacity:
-            self.createSSTable()
-            self.clear()
-            created_sst = True
-        if rowKey not in self.rowEntries:
-            entry = {}
-        else:
-            entry = self.rowEntries[rowKey]
-        if columnFamily not in entry:
-            entry[columnFamily] = {}
-        if columnKey in entry[columnFamily]:
-            cells = entry[columnFamily][columnKey]
-        else:
-            cells = []
-            entry[columnFamily][columnKey] = cells
-        if len(cells) == self.maxCellCopies:
-            cells = self.removeOldestCell(rowKey, columnFamily, columnKey)
-            entry[columnFamily][columnKey] = cells
-        cells.append((cellContent,float(time_val)))
-        self.rowEntries[rowKey] = entry
-        return created_sst
+    def addRow(self, rowKey, columnFamily, columnKey, cellContent, time_val, seq=None):
+        if seq is not None and (self.minSeq is None or seq < self.minSeq):
+            self.minSeq = seq
+        colId = self.tablet.columnIndex.getId(columnFamily, columnKey)
+        size = cellSize(cellContent)
+        row = self.rowEntries.get(rowKey)
+        if row is None:
+            row = CompactRow()
+            self.rowEntries[rowKey] = row
+            bisect.insort(self.rowKeys, rowKey)
+            size += len(str(rowKey)) + MEMTABLE_ROW_OVERHEAD
+        evicted = row.insert(colId, cellContent, float(time_val), self.maxCellCopies)
+        if evicted is not None:
+            size -= cellSize(evicted[0])
+        self.charge(size)
     
     def deleteRow(self, rowKey):
-        del self.rowEntries[rowKey]
+        row = self.rowEntries.pop(rowKey)
+        del self.rowKeys[bisect.bisect_left(self.rowKeys, rowKey)]
+        self.charge(-(len(str(rowKey)) + MEMTABLE_ROW_OVERHEAD + sum(cellSize(v) for v in row.values)))
+
+    def getKeySamples(self):
+        """(row key, bytes) pairs telling how the memtable's bytes spread over its keys, about one per BLOCK_SIZE bytes
+        like the block indexes of SSTs (see SSTable.getKeySamples). The per row overhead is left out, so the weights
+        come close to the bytes the rows take in an SST.
+        """
+        if not self.rowKeys:
+            return []
+        rowBytes = max(self.bytes / len(self.rowKeys) - MEMTABLE_ROW_OVERHEAD, 1)
+        stride = max(1, int(BLOCK_SIZE // rowBytes))
+        numRows = len(self.rowKeys)
+        return [(str(self.rowKeys[i]), rowBytes * min(stride, numRows - i)) for i in range(0, numRows, stride)]
+
+    def split(self, divider, left, right):
+        """Move the rows of this memtable to a new memtable for each of the two tablets of a split, rows below divider
+        going to the left one. The CompactRows themselves are moved, since the new tablets start with the column ids
+        of this one, and the bytes are shared out by row count. Both new memtables keep the minSeq of this one. Memory
+        is not charged to the memtable budget, see Tablet.split.
+
+        Returns:
+            (MemTable, MemTable): memtables of the left and the right tablet
+        """
+        halves = (MemTable(self.capacity, left, self.maxCellCopies, self.maxBytes), \
+            MemTable(self.capacity, right, self.maxCellCopies, self.maxBytes))
+        middle = bisect.bisect_left(self.rowKeys, divider)
+        for half, keys in zip(halves, (self.rowKeys[:middle], self.rowKeys[middle:])):
+            half.rowKeys = keys
+            half.rowEntries = {key: self.rowEntries[key] for key in keys}
+            half.bytes = self.bytes * len(keys) // max(len(self.rowKeys), 1)
+            if keys:
+                half.minSeq = self.minSeq
+        return halves
+
+    def iterGroupRows(self, localityGroup):
+        """Yields the rows in sorted order, cut down to the column families of one locality group. Rows without any
+        family of the group are skipped.
+        """
+        for key in self.rowKeys:
+            groupRow = self.expandRow(self.rowEntries[key], localityGroup=localityGroup)
+            if groupRow:
+                yield key, groupRow
+
+    def writeSSTables(self):
+        """Write every locality group present in the memtable to an SST of its own. The SSTs are returned, not added to
+        the tablet.
 
-    def removeOldestCell(self, rowKey, columnFamily, columnKey):
-        cells = self.getRow(rowKey,columnFamily,columnKey)
-        cells.sort(key = lambda x: x[1],reverse=True)
-        cells = cells[:-1]
-        return cells
+        Returns:
+            list[SSTable]: one level 0 SST per locality group
+        """
+        columns = self.tablet.columnIndex
+        groups = set()
+        for row in self.rowEntries.values():
+            for colId in row.getColumnIds():
+                groups.add(self.tablet.getLocalityGroup(columns.getName(colId)[0]))
+        ssts = []
+        for group in sorted(groups):
+            ssts.append(SSTable(self.tablet.allocateSSTId(), None, self.tablet, self.iterGroupRows(group), 0, \
+                len(self.rowEntries), localityGroup=group))
+        return ssts
 
     def createSSTable(self):
-        sst = SSTable(len(self.tablet.ssTables),self,self.tablet)
-        self.tablet.addSST(sst)
+        for sst in self.writeSSTables():
+            self.tablet.addSST(sst)
+
+
+class SSTableWriter:
+    def __init__(self, fileName, bloomBitsPerKey, expectedKeys):
+        """ Writes an SSTable in a single pass over sorted rows. Each row is encoded and appended to the current block as
+        it arrives, and full blocks go straight to a buffered file handle, so memory stays at about one block no matter
+        how many rows are written. The index, Bloom filter and trailer are written by finish().
+
+        Args:
+            fileName (str): Path of the new file
+            bloomBitsPerKey (int): Bloom filter bits per key, 0 for no filter
+            expectedKeys (int): Upper bound on the number of rows, used to size the Bloom filter
+        """
+        self.fileName = fileName
+        self.fp = open(fileName, "wb", buffering=WRITE_BUFFER_SIZE)
+        self.offset = 0
+        self.block = []
+        self.blockLen = 0
+        self.blockIndex = []
+        self.count = 0
+        self.minKey = None
+        self.maxKey = None
+        self.bloom = None
+        if bloomBitsPerKey > 0:
+            self.bloom = BloomFilter(expectedKeys or 0, bloomBitsPerKey)
+
+    def add(self, key, row):
+        """Rows must be added in increasing key order. A block is closed as soon as it grows past BLOCK_SIZE, so a
+        single large row gets a block of its own.
+        """
+        if self.minKey is None:
+            self.minKey = key
+        self.maxKey = key
+        self.count += 1
+        if self.bloom is not None:
+            self.bloom.add(key)
+        record = encodeRecord(key, row)
+        if not self.block:
+            self.blockIndex.append([key, self.offset, 0])
+        self.block.append(record)
+        self.blockLen += len(record)
+        if self.blockLen >= BLOCK_SIZE:
+            self.finishBlock()
+
+    def finishBlock(self):
+        self.fp.write(b"".join(self.block))
+        self.blockIndex[-1][2] = self.blockLen
+        self.offset += self.blockLen
+        self.block = []
+        self.blockLen = 0
+
+    def getSize(self):
+        return self.offset + self.blockLen
+
+    def finish(self):
+        """Write the last block, the footer and the trailer, and make the file durable before it gets published in the
+        tablet metadata.
+        """
+        if self.block:
+            self.finishBlock()
+        footer = {
+            "version": SST_FORMAT_VERSION,
+            "index": self.blockIndex,
+            "count": self.count,
+            "minKey": self.minKey,
+            "maxKey": self.maxKey,
+        }
+        if self.bloom is not None:
+            footer["bloom"] = self.bloom.serialize()
+        footer = json.dumps(footer).encode("utf-8")
+        self.fp.write(footer)
+        self.fp.write(struct.pack(SST_TRAILER_FORMAT, self.offset, len(footer), SST_MAGIC))
+        self.fp.flush()
+        os.fsync(self.fp.fileno())
+        self.fp.close()
+
+    def abort(self):
+        self.fp.close()
+        os.remove(self.fileName)
 
 
 class SSTable:
-    """Stores the memtable on disk in sorted order. Also maintains an index at the EOF for fast retrieval of keys from specific offsets.
+    """Stores the memtable on disk in sorted order. The file is a sequence of fixed-size data blocks followed by a footer
+    holding a sparse index (first key of every block) and a fixed-size trailer pointing at the footer. A point lookup
+    reads the trailer, the footer and then exactly one data block.
+
+    Layout:
+        [block 0][block 1]...[block N-1][footer (JSON)][trailer: footer offset (8B), footer length (4B), magic (8B)]
+
+    Each block is a run of new-line separated records. A record is the JSON encoded row key followed by one pair of
+    fields per cell column: the JSON encoded [column family, column key] and the JSON encoded cells, all seperated by
+    tabs. A read that only wants some columns compares the encoded column names and decodes just the cells it asked for
+    (see decodeRow). Format version 1 stored the whole row as a single JSON object and is still read. The footer also
+    carries a Bloom filter over the row keys, which lets a lookup rule the file out before touching any data block.
+    Files written before this format (JSON lines followed by a JSON index line) are still readable, see `legacy`.
+
+    An SST loaded from tablet metadata with its key range is not opened until a read first needs it (see open), so
+    starting a tablet server touches no SST file.
+
+    After a tablet split, the two new tablets read the files of the old one through references (see reference): SSTs
+    of their own that share the file and only see the keys of [keyStart, keyEnd). Compaction rewrites them into
+    files of the new tablets, and a shared file is deleted with the last SST reading it.
     """
 
-    def __init__(self, id, memTable, tablet):
+    def __init__(self, id, memTable, tablet, rows=None, level=0, expectedKeys=None, maxBytes=None, localityGroup=DEFAULT_LOCALITY_GROUP, keyRange=None, fileName=None):
+        """
+        Args:
+            id (int): SST id, unique within the tablet
+            memTable (MemTable): If given, the memtable to dump to disk
+            tablet (Tablet): Owning tablet
+            rows (iterable[(str, dict)], optional): If given, sorted (row key, row) pairs to write, used by compaction
+            level (int, optional): Compaction level of this SST, flushes land in level 0, defaults to 0
+            expectedKeys (int, optional): Upper bound on the number of rows, sizes the Bloom filter when writing rows
+            maxBytes (int, optional): When writing rows, stop once the file holds about this many bytes. The rest of
+                the rows iterator is left for the next SST
+            localityGroup (str, optional): Locality group whose column families this SST holds, defaults to "default"
+            keyRange ((str, str), optional): If given, the (min key, max key) of an existing file as stored in the
+                tablet metadata. The file is then only opened on first use
+            fileName (str, optional): Path of an existing file not named after the tablet's SST file prefix, such as
+                the files of tablets written before table qualified names or the files shared by a tablet split
+        """
         self.id = id
+        self.level = level
+        self.localityGroup = localityGroup
+        self.minKey = None
+        self.maxKey = None
+        self.count = 0
+        self.rows = None
+        self.maxSeq = 0
+        self.keyStart = None
+        self.keyEnd = None
+        self.shared = False
         self.tablet = tablet
-        self.fileName = self.tablet.ssTablePath + "/" + str(self.tablet.id) + "_" + str(self.id) + ".sst"
+        self.fileName = fileName if fileName is not None else self.tablet.getSSTFileName(self.id)
         self.sst = {}
         self.sstIndex = {}
+        self.blockIndex = []
+        self.blockKeys = []
+        self.bloom = None
+        self.legacy = False
+        self.version = SST_FORMAT_VERSION
+        self.opened = True
+        self.openLock = threading.Lock()
         if memTable:
-            self.createSST(memTable)
-            self.dumpToDisk()
-        else:   
+            self.dumpToDisk(memTable.iterRows(), memTable.getCurrentSize())
+        elif rows is not None:
+            self.dumpToDisk(rows, expectedKeys, maxBytes)
+        elif keyRange is not None:
+            self.minKey, self.maxKey = keyRange
+            self.opened = False
+        else:
             self.readIndexFromDisk()
-            self.readFromDisk()
+
+    def open(self):
+        """Read the footer of a file loaded from metadata, if not done yet. Data blocks are still read one at a time.
+        """
+        if self.opened:
+            return
+        with self.openLock:
+            if not self.opened:
+                self.readIndexFromDisk()
+                self.clipToLimits()
+                self.opened = True
+
+    def getCount(self):
+        self.open()
+        return self.count
+
+    def getRows(self):
+        """Number of rows, estimated for a reference, without opening the file if the metadata recorded it.
+        """
+        if self.rows is None:
+            self.open()
+            self.rows = self.count
+        return self.rows
+
+    def inLimits(self, rowKey):
+        return (self.keyStart is None or rowKey >= self.keyStart) and (self.keyEnd is None or rowKey < self.keyEnd)
+
+    def clipToLimits(self):
+        if self.keyStart is not None and self.minKey is not None and self.minKey < self.keyStart:
+            self.minKey = self.keyStart
+
+    def blockRange(self, keyStart, keyEnd):
+        """(first, end) positions of the data blocks that may hold keys of [keyStart, keyEnd), None meaning unbounded.
+        """
+        first = 0 if keyStart is None else max(self.findBlock(keyStart), 0)
+        end = len(self.blockIndex) if keyEnd is None else bisect.bisect_left(self.blockKeys, keyEnd)
+        return first, max(first, end)
+
+    def getKeySamples(self):
+        """(row key, bytes) pairs telling how the data of this SST spreads over its keys: the first key and the length
+        of every data block within its limits, or every key of a legacy file. Used to pick the split key of a tablet.
+        """
+        self.open()
+        if self.legacy:
+            weight = self.getSize() / max(len(self.sstIndex), 1)
+            return [(key, weight) for key in self.sstIndex if self.inLimits(key)]
+        first, end = self.blockRange(self.keyStart, self.keyEnd)
+        return [(key if self.keyStart is None else max(key, self.keyStart), length) \
+            for key, _, length in self.blockIndex[first:end]]
+
+    def reference(self, tablet, keyStart, keyEnd):
+        """An SST of another tablet that reads this SST's file, limited to the keys of both this SST and [keyStart,
+        keyEnd). Tablet splits use it to hand the files of a tablet to the new tablets without copying any data. None
+        if no key of this SST is in the range.
+        """
+        self.open()
+        if keyStart is not None and self.keyStart is not None:
+            keyStart = max(keyStart, self.keyStart)
+        elif keyStart is None:
+            keyStart = self.keyStart
+        if keyEnd is not None and self.keyEnd is not None:
+            keyEnd = min(keyEnd, self.keyEnd)
+        elif keyEnd is None:
+            keyEnd = self.keyEnd
+        if self.minKey is None or keyEnd is not None and self.minKey >= keyEnd or \
+                keyStart is not None and self.maxKey < keyStart:
+            return None
+        ref = SSTable(tablet.allocateSSTId(), None, tablet, level=self.level, localityGroup=self.localityGroup, \
+            keyRange=(self.minKey, self.maxKey), fileName=self.fileName)
+        ref.maxSeq = self.maxSeq
+        ref.keyStart = keyStart
+        ref.keyEnd = keyEnd
+        ref.shared = True
+        ref.legacy = self.legacy
+        ref.version = self.version
+        ref.sstIndex = self.sstIndex
+        ref.blockIndex = self.blockIndex
+        ref.blockKeys = self.blockKeys
+        ref.bloom = self.bloom
+        ref.count = self.count
+        ref.opened = True
+        ref.clipToLimits()
+        if self.legacy:
+            ref.rows = sum(1 for key in self.sstIndex if ref.inLimits(key))
+        else:
+            first, end = self.blockRange(self.keyStart, self.keyEnd)
+            refFirst, refEnd = self.blockRange(keyStart, keyEnd)
+            ref.rows = self.getRows() * (refEnd - refFirst) // max(end - first, 1)
+        SHARED_FILES.acquire(ref.fileName)
+        return ref
     
+    def getSize(self):
+        return os.path.getsize(self.fileName)
+
+    def coversKey(self, rowKey):
+        """False if rowKey falls outside the [minKey, maxKey] range of this SST, or outside its limits.
+        """
+        return self.minKey is not None and self.minKey <= rowKey <= self.maxKey and self.inLimits(rowKey)
+
+    def overlaps(self, minKey, maxKey):
+        return self.minKey is not None and self.minKey <= maxKey and minKey <= self.maxKey
+
+    def getMeta(self):
+        meta = {"id": self.id, "level": self.level, "minKey": self.minKey, "maxKey": self.maxKey, "group": self.localityGroup, \
+            "maxSeq": self.maxSeq, "rows": self.rows}
+        if self.fileName != self.tablet.getSSTFileName(self.id):
+            meta["file"] = os.path.basename(self.fileName)
+        if self.shared:
+            meta["shared"] = True
+            meta["keyStart"] = self.keyStart
+            meta["keyEnd"] = self.keyEnd
+        return meta
+
     def isLoadedInMemory(self):
         return self.sst is not None
-    
-    def createSST(self, memTable):
-        self.sst = collections.OrderedDict(sorted(memTable.rowEntries.items()))
-        
-    def serializeSSTAndCreateIndex(self):
-        """Each entry's value is new-line seperated in the string. The key is stored in the index and is mapped to the starting offset
-        of its value in the serialized string.
-        
-        Returns:
-            serialized_sst: the sst as string
-        """
-        serialized_sst = ""
-        for key, val in self.sst.items():
-            s = json.dumps(val) + "\n"
-            self.sstIndex[key] = len(serialized_sst)
-            serialized_sst += s
-        return serialized_sst
-
-    def serializeIndex(self):
-        return json.dumps(self.sstIndex)
-
-    def dumpToDisk(self):
-        serialised_dump = self.serializeSSTAndCreateIndex()
-        serialized_idx = self.serializeIndex()
-        with open(self.fileName,"w") as f:
-            f.write(serialised_dump+serialized_idx)
+
+    def dumpToDisk(self, rows, expectedKeys, maxBytes=None):
+        """Stream sorted rows into a new file through an SSTableWriter.
+
+        Args:
+            rows (iterable[(str, dict)]): Sorted (row key, row) pairs
+            expectedKeys (int): Upper bound on the number of rows, used to size the Bloom filter
+            maxBytes (int, optional): Stop consuming rows once the data blocks reach this size, defaults to no limit
+        """
+        writer = SSTableWriter(self.fileName, self.tablet.bloomBitsPerKey, expectedKeys)
+        try:
+            for key, row in rows:
+                writer.add(key, row)
+                if maxBytes is not None and writer.getSize() >= maxBytes:
+                    break
+            writer.finish()
+        except BaseException:
+            writer.abort()
+            raise
+        self.blockIndex = writer.blockIndex
+        self.blockKeys = [b[0] for b in self.blockIndex]
+        self.bloom = writer.bloom
+        self.minKey = writer.minKey
+        self.maxKey = writer.maxKey
+        self.count = writer.count
+        self.rows = writer.count
     
     def readIndexFromDisk(self):
-        """From the EOF seek backwards until the first newline is found. The newline indicates
-        the end_idx of the stored vals, and beginning of the index.
+        """Reads the trailer and the footer it points to. Files without the trailer magic are in the legacy format
+        and are handed to readLegacyIndexFromDisk.
         """
-        with open(self.fileName) as fp:
-            p = fp.seek(0,2)
-            while True:
-                if fp.read(1) == "\n":
-                    break
-                p -= 1
-                fp.seek(p,0)
-            p += 1
-            fp.seek(p,0)
-            self.sstIndex = json.loads(fp.readline())
+        with open(self.fileName, "rb") as fp:
+            size = fp.seek(0,2)
+            if size >= SST_TRAILER_SIZE:
+                fp.seek(size - SST_TRAILER_SIZE)
+                footerOffset, footerLen, magic = struct.unpack(SST_TRAILER_FORMAT, fp.read(SST_TRAILER_SIZE))
+            else:
+                magic = None
+            if magic != SST_MAGIC:
+                self.readLegacyIndexFromDisk(fp, size)
+                return
+            fp.seek(footerOffset)
+            footer = json.loads(fp.read(footerLen))
+        self.legacy = False
+        self.version = footer.get("version", 1)
+        self.blockIndex = footer["index"]
+        self.blockKeys = [b[0] for b in self.blockIndex]
+        self.count = footer["count"]
+        if "bloom" in footer:
+            self.bloom = BloomFilter.deserialize(footer["bloom"])
+        if "maxKey" in footer:
+            self.minKey = footer["minKey"]
+            self.maxKey = footer["maxKey"]
+        elif self.blockIndex:
+            self.minKey = self.blockKeys[0]
+            self.maxKey = self.readBlock(len(self.blockIndex) - 1, False)[-1][0]
+
+    def readLegacyIndexFromDisk(self, fp, size):
+        """Legacy files end with a JSON index (row key -> offset of its line) on the last line. Read the tail of the
+        file in chunks until the new-line that precedes the index is found.
+        """
+        chunk = 4096
+        tail = b""
+        p = size
+        while p > 0:
+            step = min(chunk, p)
+            p -= step
+            fp.seek(p)
+            tail = fp.read(step) + tail
+            nl = tail.rfind(b"\n")
+            if nl != -1:
+                tail = tail[nl+1:]
+                break
+        self.legacy = True
+        self.sstIndex = json.loads(tail)
+        self.count = len(self.sstIndex)
+        if self.sstIndex:
+            self.minKey = min(self.sstIndex)
+            self.maxKey = max(self.sstIndex)
+        if self.tablet.bloomBitsPerKey > 0:
+            self.bloom = BloomFilter(len(self.sstIndex), self.tablet.bloomBitsPerKey)
+            for key in self.sstIndex:
+                self.bloom.add(key)
+
+    def readBlock(self, blockNo, fillCache=True):
+        """Read a single data block and split it into records. Only the keys are decoded, rows are left encoded so a
+        lookup pays for decoding the one row, and the columns of it, it is after.
+
+        Args:
+            blockNo (int): Position of the block in the index
+            fillCache (boolean, optional): Whether to add the block to the block cache on a miss, defaults to True
+
+        Returns:
+            list[(str, bytes)]: (row key, encoded row) pairs of the block in sorted order
+        """
+        self.open()
+        cache = self.tablet.blockCache
+        if cache is not None:
+            block = cache.get((self.fileName, blockNo), self.tablet.tableName)
+            if block is not None:
+                return block
+        _, offset, length = self.blockIndex[blockNo]
+        with open(self.fileName, "rb") as fp:
+            fp.seek(offset)
+            data = fp.read(length)
+        block = decodeBlock(data)
+        if cache is not None and fillCache:
+            cache.put((self.fileName, blockNo), block, length)
+        return block
+
+    def findBlock(self, rowKey):
+        """Index of the only block that may contain rowKey, or -1 if rowKey sorts before the first key.
+        """
+        return bisect.bisect_right(self.blockKeys, rowKey) - 1
+
+    def readLegacyRow(self, fp, offset):
+        fp.seek(offset,0)
+        return json.loads(fp.readline())
+
+    def iterRows(self, fillCache=True, rowKeyStart=None, projection=None):
+        """Yields (row key, row) pairs in sorted order, one block in memory at a time. With rowKeyStart the index is
+        used to start at the block that may hold it, so earlier blocks are never read. With a projection only its
+        cells are decoded and rows holding none of them are skipped.
+        """
+        self.open()
+        if self.keyStart is not None and (rowKeyStart is None or rowKeyStart < self.keyStart):
+            rowKeyStart = self.keyStart
+        if self.legacy:
+            keys = sorted(key for key in self.sstIndex if self.inLimits(key))
+            if rowKeyStart is not None:
+                keys = keys[bisect.bisect_left(keys, rowKeyStart):]
+            with open(self.fileName) as fp:
+                for key in keys:
+                    row = projectColumns(self.readLegacyRow(fp, self.sstIndex[key]), projection)
+                    if row:
+                        yield key, row
+            return
+        columns = encodeProjection(projection)
+        first = 0
+        if rowKeyStart is not None:
+            first = max(self.findBlock(rowKeyStart), 0)
+        for blockNo in range(first, len(self.blockIndex)):
+            for key, row in self.readBlock(blockNo, fillCache):
+                if self.keyEnd is not None and key >= self.keyEnd:
+                    return
+                if rowKeyStart is None or key >= rowKeyStart:
+                    row = decodeRow(row, self.version, columns)
+                    if row:
+                        yield key, row
     
     def readFromDisk(self):
-        """Read value of key from offset in the file
+        """Load the whole table in memory. Only meant for callers that really need every row.
         """
-        with open(self.fileName) as fp:
-            for key,item in self.sstIndex.items():
-                fp.seek(item,0)
-                self.sst[key] = json.loads(fp.readline()[:-1] )
+        for key, row in self.iterRows():
+            self.sst[key] = row
     
     def clearFromMemory(self):
         self.sst = {}
     
     def clearIndexFromMemory(self):
         self.sstIndex = {}
+        self.blockIndex = []
+        self.blockKeys = []
+        self.bloom = None
     
     def delete(self):
+        """Delete the file, or only let go of it if other SSTs still read it.
+        """
         self.clearFromMemory()
         self.clearIndexFromMemory()
+        if self.shared and not SHARED_FILES.release(self.fileName):
+            return
+        if self.tablet.blockCache is not None:
+            self.tablet.blockCache.evictFile(self.fileName)
         os.remove(self.fileName)
 
-    def search(self, rowKey, columnFamily=None, columnKey=None):
-        if self.sstIndex is None:
-            self.readIndexFromDisk()
-        if rowKey not in self.sstIndex:
+    def mayContain(self, rowKey):
+        """False if the Bloom filter rules rowKey out, True if the key may be in this SSTable.
+        """
+        self.open()
+        return self.bloom is None or self.bloom.mayContain(rowKey)
+
+    def getRawRow(self, rowKey, projection=None):
+        """Returns the row, cut down to the cells of the projection if one is given, or None if the key is not in this
+        SST. A row holding none of the projected cells comes back as an empty dict.
+        """
+        if not self.coversKey(rowKey):
             return None
-        self.readFromDisk()
-        
-        if columnFamily and columnKey:
-            if columnFamily in self.sst[rowKey] and columnKey in self.sst[rowKey][columnFamily]:
-                row = self.sst[rowKey][columnFamily][columnKey]
-            else:
-                row = None
-        else:
-            row = self.sst[rowKey]
-        self.clearFromMemory()
+        self.open()
+        if self.legacy:
+            if rowKey not in self.sstIndex:
+                return None
+            with open(self.fileName) as fp:
+                return projectColumns(self.readLegacyRow(fp, self.sstIndex[rowKey]), projection)
+        blockNo = self.findBlock(rowKey)
+        if blockNo < 0:
+            return None
+        for key, row in self.readBlock(blockNo):
+            if key == rowKey:
+                return decodeRow(row, self.version, encodeProjection(projection))
+            if key > rowKey:
+                break
+        return None
+
+    def search(self, rowKey, columnFamily=None, columnKey=None):
+        row = self.getRawRow(rowKey, cellProjection(columnFamily, columnKey))
+        return projectRow(row, columnFamily, columnKey)
+
+
+def cellSize(cellContent):
+    """Approximate memory held by one cell version: its content plus the object header of the content and its slots
+    in the arrays of a CompactRow.
+    """
+    return len(str(cellContent)) + MEMTABLE_CELL_OVERHEAD
+
+
+def cellProjection(columnFamily, columnKey):
+    """Projection of a single cell column, or None (the whole row) unless both names are given.
+    """
+    if columnFamily and columnKey:
+        return {(columnFamily, columnKey)}
+    return None
+
+
+def projectColumns(row, projection):
+    """Cut a decoded row down to the (column family, column key) pairs of the projection. None keeps the whole row.
+    """
+    if row is None or projection is None:
         return row
+    projected = {}
+    for cf, col in projection:
+        if cf in row and col in row[cf]:
+            projected.setdefault(cf, {})[col] = row[cf][col]
+    return projected
+
+
+def projectRow(row, columnFamily=None, columnKey=None):
+    if row is None:
+        return None
+    if columnFamily and columnKey:
+        if columnFamily in row and columnKey in row[columnFamily]:
+            return row[columnFamily][columnKey]
+        return None
+    return row
+
+
+def encodeRecord(key, row):
+    fields = [json.dumps(key)]
+    for cf, cols in row.items():
+        for col, cells in cols.items():
+            fields.append(json.dumps([cf, col]))
+            fields.append(json.dumps(cells))
+    return ("\t".join(fields) + "\n").encode("utf-8")
+
+
+def encodeProjection(projection):
+    """Map the column names of a projection, encoded as they appear in version 2 records, to (column family, column
+    key) pairs.
+    """
+    if projection is None:
+        return None
+    return {json.dumps([cf, col]).encode("utf-8"): (cf, col) for cf, col in projection}
+
+
+def decodeRow(data, version, columns=None):
+    """Decode the row part of a record. With `columns` (see encodeProjection) only those cells are returned, and in
+    version 2 records the cells of every other column are skipped without being parsed. Column names are interned so
+    decoded rows share them instead of holding a copy each.
+    """
+    if version < 2:
+        return projectColumns(json.loads(data), None if columns is None else columns.values())
+    row = {}
+    if not data:
+        return row
+    fields = data.split(b"\t")
+    for i in range(0, len(fields), 2):
+        if columns is None:
+            cf, col = map(sys.intern, json.loads(fields[i]))
+        elif fields[i] in columns:
+            cf, col = columns[fields[i]]
+        else:
+            continue
+        row.setdefault(cf, {})[col] = json.loads(fields[i + 1])
+    return row
+
+
+def decodeBlock(data):
+    rows = []
+    for line in data.split(b"\n"):
+        if not line:
+            continue
+        key, _, row = line.partition(b"\t")
+        rows.append((json.loads(key), row))
+    return rows
 
 
 class Tablet:
-    def __init__(self, id, serverId, tableName, startKey, endKey, ssTablePath, loadFromJson=None, maxCellCopies = 5, tabletCapacity = 100, memTableCapacity = 100):
+    def __init__(self, id, serverId, tableName, startKey, endKey, ssTablePath, loadFromJson=None, maxCellCopies = 5, tabletCapacity = 100, memTableCapacity = 100, bloomBitsPerKey = 10, blockCache = None, compactionStrategy = "tiered", localityGroups = None, memTableMaxBytes = None, memTableBudget = None, columns = None):
         """ A tablet is a way to horizontally shard data in a table (basically a list of rows). Thus each tablet is responsible for a range
         of row keys (lexicographic increasing). It consists of an in memory table which it dumps to disk periodically after it 
         reaches its capacity. The on-disk counterpart of the in-mem table is the SSTable. 
@@ -181,13 +809,24 @@ class Tablet:
             id (str): Unique id for this tablet. Currently using the current size of parent table in terms of tablets
             serverId (str): Tablet server id. Each server might be responsible for multiple tablets
             tableName (str): Name of the table
-            startKey (str): Start key
-            endKey (str): End key
+            startKey (str): Start key, the first key of the tablet
+            endKey (str): End key, the first key past the tablet
             ssTablePath (str): Path to store SSTs for this tablet on disk
             loadFromJson (boolean): If true, load tablet from serialized string
             maxCellCopies (int, optional): Dictates how many versions of a cell's history must be kept,  defaults to 5
             tabletCapacity (int, optional): Max elements in tablet. Beyond this capacity the tablet splits into 2,  defaults to 100
-            memTableCapacity (int, optional): Beyond this capacity the memTable is dumped to disk as an SST, defaults to 100
+            memTableCapacity (int, optional): Beyond this many rows the memTable is dumped to disk as an SST, None for no
+                row limit, defaults to 100
+            bloomBitsPerKey (int, optional): Bloom filter bits per row key in each SST, 0 disables the filters, defaults to 10
+            blockCache (BlockCache, optional): Server-wide cache of SST data blocks, defaults to no caching
+            compactionStrategy (str, optional): "tiered" (size-tiered) or "leveled" compaction, defaults to "tiered"
+            localityGroups (dict, optional): Column family name -> locality group. Families not listed belong to the
+                default group, defaults to every family in the default group
+            memTableMaxBytes (int, optional): Beyond this approximate size in bytes the memTable is dumped to disk as an
+                SST, defaults to no byte limit
+            memTableBudget (MemTableBudget, optional): Server-wide memtable memory budget the memtables are charged
+                to, defaults to none
+            columns (list[(str, str)], optional): Schema columns, used to seed the ColumnIndex of the memtables
         """
         self.id = id
         self.serverId = serverId
@@ -196,19 +835,171 @@ class Tablet:
         self.endKey = endKey
         self.maxCellCopies = maxCellCopies
         self.memTableCapacity = memTableCapacity
+        self.memTableMaxBytes = memTableMaxBytes
+        self.memTableBudget = memTableBudget
+        self.columnIndex = ColumnIndex(columns)
         self.tabletCapacity = tabletCapacity
+        self.bloomBitsPerKey = bloomBitsPerKey
+        self.bloomStats = {"hits": 0, "misses": 0, "false_positives": 0}
+        self.blockCache = blockCache
+        self.compactionStrategy = compactionStrategy
+        self.localityGroups = localityGroups if localityGroups is not None else {}
+        self.compactPointers = {}
         self.ssTables = []
+        self.levelIndex = {}
+        self.nextSSTId = 0
         self.ssTablePath = ssTablePath
+        self.sstFilePrefix = str(tableName) + "_" + str(id)
+        self.lock = threading.RLock()
+        self.compactionLock = threading.Lock()
         self.memTable = None
+        self.immutableMemTables = []
+        self.maxImmutableMemTables = MAX_IMMUTABLE_MEMTABLES
+        self.flushed = threading.Condition(self.lock)
+        self.flushStats = {"flushes": 0, "stalls": 0, "stall_seconds": 0.0}
         self.currentSize = 0
-        self.memTable = MemTable(memTableCapacity, self, maxCellCopies)
+        self.splitRetrySize = 0
+        self.children = None
+        self.memTable = MemTable(memTableCapacity, self, maxCellCopies, memTableMaxBytes)
         if loadFromJson is not None:
             self.loadFromJson(loadFromJson)
 
     def changeMemtableCapacity(self, newVal):
-        self.memTable.changeCapacity(newVal)
+        """Set the row limit of the memtables. Returns True if the active memtable was full under the new limit and got
+        frozen, in which case the caller must have it flushed.
+        """
+        with self.lock:
+            self.memTableCapacity = newVal
+            self.memTable.capacity = newVal
+            return self.freezeIfFull()
+
+    def changeMemtableMaxBytes(self, newVal):
+        """Like changeMemtableCapacity, for the byte limit.
+        """
+        with self.lock:
+            self.memTableMaxBytes = newVal
+            self.memTable.maxBytes = newVal
+            return self.freezeIfFull()
+
+    def freezeIfFull(self):
+        if not self.memTable.isFull():
+            return False
+        self.stallWrites()
+        return self.freezeMemTable()
+
+    def getMemTables(self):
+        """The active memtable followed by the immutable ones waiting for a flush, newest first.
+        """
+        return [self.memTable] + self.immutableMemTables[::-1]
+
+    def freezeMemTable(self, stall=False):
+        """Queue the active memtable for flushing and start a new one. Reads keep seeing the frozen memtable until its
+        SSTs are added by flushMemTable. Returns True if a memtable was frozen, in which case the caller must have it
+        flushed.
+
+        Args:
+            stall (boolean, optional): Wait first while the flush queue is backed up, like a write filling the
+                memtable does (see stallWrites). Used by writers that freeze the memtable for the memtable budget,
+                defaults to False
+        """
+        with self.lock:
+            if stall:
+                self.stallWrites()
+            if self.memTable.getCurrentSize() == 0:
+                return False
+            if self.memTableBudget is not None:
+                self.memTableBudget.freeze(self.memTable.getBytes())
+            self.immutableMemTables.append(self.memTable)
+            self.memTable = MemTable(self.memTableCapacity, self, self.maxCellCopies, self.memTableMaxBytes)
+            return True
+
+    def getActiveMemTableBytes(self):
+        return self.memTable.getBytes()
+
+    def stallWrites(self):
+        """Block a write that is about to freeze the memtable while maxImmutableMemTables are already waiting for the
+        flusher, so memory stays bounded when writes outrun flushes. The caller must hold the tablet lock, which is
+        released while waiting.
+        """
+        if len(self.immutableMemTables) < self.maxImmutableMemTables:
+            return
+        self.flushStats["stalls"] += 1
+        start = time.perf_counter()
+        while len(self.immutableMemTables) >= self.maxImmutableMemTables:
+            self.flushed.wait()
+        self.flushStats["stall_seconds"] += time.perf_counter() - start
+
+    def flushMemTable(self, appliedSeq=None):
+        """Write the oldest immutable memtable to SSTs. The files are written without holding the tablet lock, then the
+        SSTs replace the memtable in a single step so reads see the rows in exactly one of the two. The new SSTs record
+        the tablet's checkpoint at that point as their maxSeq.
+
+        Args:
+            appliedSeq (function, optional): Returns the WAL sequence number up to which every write has been applied
+                to a memtable (WAL.getAppliedSeq), defaults to a tablet without a WAL
+
+        Returns:
+            boolean: True if a memtable was flushed
+        """
+        with self.lock:
+            if not self.immutableMemTables:
+                return False
+            memTable = self.immutableMemTables[0]
+        ssts = memTable.writeSSTables()
+        with self.lock:
+            if not self.immutableMemTables or self.immutableMemTables[0] is not memTable:
+                for sst in ssts:
+                    sst.delete()
+                return False
+            self.immutableMemTables.pop(0)
+            if appliedSeq is not None:
+                maxSeq = self.getCheckpoint(appliedSeq())
+                for sst in ssts:
+                    sst.maxSeq = maxSeq
+            self.ssTables += ssts
+            self.rebuildLevelIndex()
+            self.updateSize()
+            if self.memTableBudget is not None:
+                self.memTableBudget.release(memTable.getBytes())
+            self.flushStats["flushes"] += 1
+            self.flushed.notify_all()
+        return True
+
+    def getCheckpoint(self, appliedSeq):
+        """Sequence number up to which every logged write of this tablet is in its SSTs: writes past it are either in a
+        memtable or not applied yet.
+
+        Args:
+            appliedSeq (int): Sequence number up to which every write has been applied to a memtable
+        """
+        with self.lock:
+            if self.children is not None:
+                return min(child.getCheckpoint(appliedSeq) for child in self.children)
+            return min([m.minSeq - 1 for m in self.getMemTables() if m.minSeq is not None] + [appliedSeq])
+
+    def getPersistedSeq(self):
+        """Highest checkpoint recorded by the SSTs, i.e. every logged write up to it is on disk.
+        """
+        with self.lock:
+            return max([sst.maxSeq for sst in self.ssTables], default=0)
+
+    def getFlushStats(self):
+        with self.lock:
+            stats = dict(self.flushStats)
+            stats["immutable_memtables"] = len(self.immutableMemTables)
+            stats["memtable_bytes"] = sum(m.getBytes() for m in self.getMemTables())
+            return stats
     
     def serialize(self):
+        return json.dumps(self.getState())
+
+    def getState(self):
+        """The tablet's metadata as a dict, the form it takes in the METADATA manifest.
+        """
+        with self.lock:
+            return self.getStateLocked()
+
+    def getStateLocked(self):
         s = {
             "id": self.id,
             "serverId": self.serverId,
@@ -217,27 +1008,200 @@ class Tablet:
             "endKey": self.endKey,
             "maxCellCopies": self.maxCellCopies,
             "memTableCapacity": self.memTableCapacity,
+            "memTableMaxBytes": self.memTableMaxBytes,
             "tabletCapacity": self.tabletCapacity,
+            "bloomBitsPerKey": self.bloomBitsPerKey,
+            "compactionStrategy": self.compactionStrategy,
+            "localityGroups": self.localityGroups,
             "ssTablePath": self.ssTablePath,
+            "sstFilePrefix": self.sstFilePrefix,
         }
-        s["sstIds"] = [sst.id for sst in self.ssTables]
-        return json.dumps(s)
+        s["ssts"] = [sst.getMeta() for sst in self.ssTables]
+        s["nextSSTId"] = self.nextSSTId
+        return s
     
     def loadFromJson(self, JsonStr):
         s_dict = json.loads(JsonStr)
         self.__init__(s_dict["id"], s_dict['serverId'], s_dict['tableName'], s_dict['startKey'], s_dict['endKey'], \
-            s_dict['ssTablePath'], None, s_dict['maxCellCopies'], s_dict['tabletCapacity'], s_dict['memTableCapacity'])
-        for sst_id in s_dict["sstIds"]:
-            self.ssTables.append(SSTable(sst_id, None, self))
+            s_dict['ssTablePath'], None, s_dict['maxCellCopies'], s_dict['tabletCapacity'], s_dict['memTableCapacity'], s_dict.get('bloomBitsPerKey', 10), self.blockCache, \
+            s_dict.get('compactionStrategy', "tiered"), s_dict.get('localityGroups'), s_dict.get('memTableMaxBytes'), \
+            self.memTableBudget)
+        filePrefix = s_dict.get("sstFilePrefix", str(self.id))
+        fileName = lambda sstId: self.ssTablePath + "/" + filePrefix + "_" + str(sstId) + ".sst"
+        if "ssts" in s_dict:
+            for meta in s_dict["ssts"]:
+                keyRange = (meta["minKey"], meta["maxKey"]) if "minKey" in meta else None
+                sstFile = self.ssTablePath + "/" + meta["file"] if "file" in meta else fileName(meta["id"])
+                sst = SSTable(meta["id"], None, self, level=meta["level"], \
+                    localityGroup=meta.get("group", DEFAULT_LOCALITY_GROUP), keyRange=keyRange, fileName=sstFile)
+                sst.maxSeq = meta.get("maxSeq", 0)
+                sst.rows = meta.get("rows")
+                if meta.get("shared"):
+                    sst.keyStart = meta["keyStart"]
+                    sst.keyEnd = meta["keyEnd"]
+                    sst.shared = True
+                    SHARED_FILES.acquire(sst.fileName)
+                self.ssTables.append(sst)
+        else:
+            for sst_id in s_dict["sstIds"]:
+                self.ssTables.append(SSTable(sst_id, None, self, fileName=fileName(sst_id)))
+        self.rebuildLevelIndex()
+        self.updateSize()
+        self.nextSSTId = s_dict.get("nextSSTId", max([sst.id for sst in self.ssTables], default=-1) + 1)
     
+    def getLocalityGroup(self, columnFamily):
+        return self.localityGroups.get(columnFamily, DEFAULT_LOCALITY_GROUP)
+
+    def getLocalityGroupsInUse(self):
+        return sorted(set(sst.localityGroup for sst in self.ssTables))
+
+    def allocateSSTId(self):
+        with self.lock:
+            sstId = self.nextSSTId
+            self.nextSSTId += 1
+            return sstId
+
+    def getSSTFileName(self, sstId):
+        return self.ssTablePath + "/" + self.sstFilePrefix + "_" + str(sstId) + ".sst"
+
     def addSST(self,sst):
-        self.ssTables.append(sst)
+        with self.lock:
+            self.ssTables.append(sst)
+            self.rebuildLevelIndex()
+            self.updateSize()
+
+    def replaceSSTs(self, oldSSTs, newSSTs):
+        """Swap the inputs of a compaction for its outputs. The outputs take the place of the oldest input so the
+        order of the remaining SSTs is kept.
+        """
+        with self.lock:
+            pos = min(self.ssTables.index(sst) for sst in oldSSTs)
+            remaining = [sst for sst in self.ssTables if sst not in oldSSTs]
+            remaining[pos:pos] = newSSTs
+            self.ssTables = remaining
+            self.rebuildLevelIndex()
+            self.updateSize()
+
+    def rebuildLevelIndex(self):
+        """SSTs of level 1 and up never overlap within their level and locality group. Keep them sorted by minKey per
+        (group, level) so a lookup can bisect to the single SST of each level that may hold a key.
+        """
+        levels = {}
+        for sst in self.ssTables:
+            if sst.level > 0 and sst.minKey is not None:
+                levels.setdefault((sst.localityGroup, sst.level), []).append(sst)
+        self.levelIndex = {}
+        for groupLevel, ssts in levels.items():
+            ssts.sort(key=lambda s: s.minKey)
+            self.levelIndex[groupLevel] = ([s.minKey for s in ssts], ssts)
+
+    def getLevels(self, groups=None):
+        """(group, level) pairs of the levels below 0, in level order.
+        """
+        return sorted((gl for gl in self.levelIndex if groups is None or gl[0] in groups), key=lambda gl: (gl[1], gl[0]))
+
+    def getLevel(self, level, group=None):
+        if level == 0:
+            return [sst for sst in self.ssTables if sst.level == 0 and (group is None or sst.localityGroup == group)]
+        ssts = []
+        for groupLevel in self.getLevels(None if group is None else [group]):
+            if groupLevel[1] == level:
+                ssts += self.levelIndex[groupLevel][1]
+        return ssts
+
+    def getCandidateSSTs(self, rowKey, groups=None):
+        """SSTs of the given locality groups (all if None) whose key range covers rowKey: every matching level 0 SST
+        and at most one SST of each deeper level.
+        """
+        candidates = [sst for sst in self.ssTables if sst.level == 0 and sst.coversKey(rowKey) \
+            and (groups is None or sst.localityGroup in groups)]
+        for groupLevel in self.getLevels(groups):
+            minKeys, ssts = self.levelIndex[groupLevel]
+            i = bisect.bisect_right(minKeys, rowKey) - 1
+            if i >= 0 and ssts[i].coversKey(rowKey):
+                candidates.append(ssts[i])
+        return candidates
     
+    def updateSize(self):
+        self.currentSize = sum(sst.getRows() for sst in self.ssTables)
+
     def getCurrentSize(self):
-        return self.currentSize
+        """Approximate number of rows in the tablet: rows of the SSTs and the memtables. A row written again after a
+        flush is counted once per SST and memtable holding it until compaction merges them.
+        """
+        return self.currentSize + sum(m.getCurrentSize() for m in self.getMemTables())
     
     def isFull(self):
-        return self.getCurrentSize() >= self.tabletCapacity
+        return self.getCurrentSize() >= max(self.tabletCapacity, self.splitRetrySize)
+
+    def findSplitKey(self):
+        """Approximate median row key of the tablet by bytes, taken from the block indexes of its SSTs and the keys of
+        its memtables without reading any data block: the key with the closest to half of the bytes below it. None if
+        no key inside the tablet's range would leave both halves with rows. The caller must hold the tablet lock.
+        """
+        samples = []
+        for memTable in self.getMemTables():
+            samples += memTable.getKeySamples()
+        for sst in self.ssTables:
+            samples += sst.getKeySamples()
+        if not samples:
+            return None
+        samples.sort()
+        lowest = max(samples[0][0], str(self.startKey))
+        half = sum(weight for _, weight in samples) / 2
+        seen = 0
+        divider = None
+        for key, weight in samples:
+            if lowest < key < str(self.endKey) and (divider is None or abs(seen - half) < abs(dividerSeen - half)):
+                divider, dividerSeen = key, seen
+            seen += weight
+        return divider
+
+    def split(self, divider, leftId, rightId):
+        """Split the tablet in two at divider: [startKey, divider) and [divider, endKey). The new tablets read the
+        SSTs of this one through references (see SSTable.reference), so no data is copied, and take over its memtables
+        row by row. This tablet is left empty: writes that still reach it raise TabletSplitError and reads are passed
+        on to the new tablets.
+
+        Returns:
+            (Tablet, Tablet): the left and the right tablet
+        """
+        with self.compactionLock, self.lock:
+            left, right = [Tablet(tabletId, self.serverId, self.tableName, startKey, endKey, self.ssTablePath, None, \
+                self.maxCellCopies, self.tabletCapacity, self.memTableCapacity, self.bloomBitsPerKey, self.blockCache, \
+                self.compactionStrategy, self.localityGroups, self.memTableMaxBytes, self.memTableBudget, \
+                self.columnIndex.names) for tabletId, startKey, endKey in \
+                [(leftId, self.startKey, divider), (rightId, divider, self.endKey)]]
+            for child, keyStart, keyEnd in [(left, None, divider), (right, divider, None)]:
+                child.ssTables = [ref for ref in (sst.reference(child, keyStart, keyEnd) for sst in self.ssTables) \
+                    if ref is not None]
+                child.rebuildLevelIndex()
+                child.updateSize()
+            for memTable in self.immutableMemTables:
+                l, r = memTable.split(divider, left, right)
+                left.immutableMemTables.append(l)
+                right.immutableMemTables.append(r)
+                if self.memTableBudget is not None:
+                    self.memTableBudget.charge(l.getBytes() + r.getBytes())
+                    self.memTableBudget.freeze(l.getBytes() + r.getBytes())
+            left.memTable, right.memTable = self.memTable.split(divider, left, right)
+            if self.memTableBudget is not None:
+                self.memTableBudget.charge(left.memTable.getBytes() + right.memTable.getBytes())
+            self.releaseMemTables()
+            for sst in self.ssTables:
+                if sst.shared:
+                    SHARED_FILES.release(sst.fileName)
+            self.ssTables = []
+            self.levelIndex = {}
+            self.currentSize = 0
+            self.children = (left, right)
+            return self.children
+
+    def getSplitChild(self, rowKey):
+        """The tablet that took over rowKey when this tablet was split.
+        """
+        left, right = self.children
+        return left if str(rowKey) < left.endKey else right
     
     def createSSTable(self):
         ssTable = SSTable(len(self.ssTables), self.memTable, self.id)
@@ -245,44 +1209,153 @@ class Tablet:
         ssTable.dumpToDisk(self.ssTablePath)
         self.memTable.clear()
     
-    def getRow(self, rowKey, columnFamily=None, columnKey=None):
-        row = self.memTable.getRow(rowKey, columnFamily, columnKey)
-        if row is None:
-            for sst in self.ssTables:
-                row = sst.search(rowKey,columnFamily,columnKey)
-                if row is not None:
-                    return row
+    def getRow(self, rowKey, columnFamily=None, columnKey=None, projection=None):
+        with self.lock:
+            if self.children is None:
+                return self.searchRow(rowKey, columnFamily, columnKey, projection)
+        return self.getSplitChild(rowKey).getRow(rowKey, columnFamily, columnKey, projection)
+
+    def searchRow(self, rowKey, columnFamily, columnKey, projection=None):
+        """Collects the row from the memtable and from every SST that may hold it, newest first, and merges the
+        versions of each cell. A single cell read is pushed down as a projection, so only that cell is decoded; a
+        projection (set of (column family, column key) pairs) can also be given to read several cells of the row.
+        """
+        rows = []
+        if projection is None:
+            projection = cellProjection(columnFamily, columnKey)
+        for memTable in self.getMemTables():
+            row = memTable.getRow(rowKey, projection=projection)
+            if row is not None:
+                rows.append(row)
+        groups = None
+        if columnFamily:
+            groups = [self.getLocalityGroup(columnFamily)]
+        elif projection is not None:
+            groups = set(self.getLocalityGroup(cf) for cf, _ in projection)
+        for sst in reversed(self.getCandidateSSTs(rowKey, groups)):
+            if not sst.mayContain(rowKey):
+                self.bloomStats["misses"] += 1
+                continue
+            row = sst.getRawRow(rowKey, projection)
+            if sst.bloom is not None:
+                self.bloomStats["hits" if row is not None else "false_positives"] += 1
+            if row is not None:
+                rows.append(row)
+        if columnFamily and columnKey:
+            cells = [projectRow(r, columnFamily, columnKey) for r in rows]
+            cells = [c for c in cells if c is not None]
+            if not cells:
+                return None
+            return mergeCells(cells, self.maxCellCopies)
+        if not rows:
             return None
-        else:
-            return row
+        return mergeRows(rows, self.maxCellCopies)
     
+    def getBloomStats(self):
+        return dict(self.bloomStats)
+
+    def scan(self, rowKeyStart=None, rowKeyEnd=None, groups=None, projection=None):
+        """Ordered scan of [rowKeyStart, rowKeyEnd] (see MergeIterator.pastEnd) over the memtables and the SSTs of the
+        given locality groups (all if None). Every level 0 SST is its own source; the SSTs of a deeper level do not
+        overlap and are chained into a single source. SSTs entirely outside the range are not opened. With a
+        projection (a set of (column family, column key) pairs) the sources only decode and merge those cells, and rows
+        holding none of them are skipped. The caller must hold the tablet lock.
+
+        Returns:
+            MergeIterator: yields (row key, merged row) pairs
+        """
+        def inRange(sst):
+            return sst.minKey is not None and (rowKeyStart is None or sst.maxKey >= rowKeyStart) \
+                and not pastEnd(sst.minKey, rowKeyEnd)
+
+        def chain(ssts):
+            for sst in ssts:
+                for item in sst.iterRows(True, rowKeyStart, projection):
+                    yield item
+
+        sources = [memTable.iterRows(rowKeyStart, projection) for memTable in self.getMemTables()]
+        for sst in reversed(self.getLevel(0)):
+            if inRange(sst) and (groups is None or sst.localityGroup in groups):
+                sources.append(sst.iterRows(True, rowKeyStart, projection))
+        for groupLevel in self.getLevels(groups):
+            ssts = [sst for sst in self.levelIndex[groupLevel][1] if inRange(sst)]
+            if ssts:
+                sources.append(chain(ssts))
+        return MergeIterator(sources, self.maxCellCopies, rowKeyEnd)
+
     def getAllRows(self, columnFamily, columnKey):
-        allEntries = self.memTable.rowEntries
-        resp = {}
-        for entry in allEntries:
-            resp[entry] = allEntries[entry][columnFamily][columnKey]
-        for sst in self.ssTables:
-            sst.readFromDisk()
-            for rowKey in sst.sst:
-                resp[rowKey] = sst.sst[rowKey][columnFamily][columnKey]
-            sst.clearFromMemory()
-        return resp
+        return self.getRowRange(None, None, columnFamily, columnKey)
     
     def getRowRange(self, rowKeyStart, rowKeyEnd, columnFamily, columnKey):
-        rows = self.getAllRows(columnFamily,columnKey)
+        """Returns the cells of one column for the rows in [rowKeyStart, rowKeyEnd], in key order. Rows without the
+        column are left out.
+        """
+        return self.getRowRangePage(rowKeyStart, rowKeyEnd, columnFamily, columnKey)[0]
+
+    def getRowRangePage(self, rowKeyStart, rowKeyEnd, columnFamily, columnKey, limit=None):
+        """Like getRowRange, but returns at most limit rows.
+
+        Returns:
+            (dict, str): the rows, and the key to resume from if the range holds more rows, else None
+        """
         resp = {}
-        for r in rows:
-            if r[:len(rowKeyStart)] >= rowKeyStart and r[:len(rowKeyEnd)] <= rowKeyEnd:
-                resp[r] = rows[r]
-        return resp
+        with self.lock:
+            if self.children is not None:
+                return self.getChildrenRangePage(rowKeyStart, rowKeyEnd, columnFamily, columnKey, limit)
+            groups = [self.getLocalityGroup(columnFamily)]
+            for rowKey, row in self.scan(rowKeyStart, rowKeyEnd, groups, cellProjection(columnFamily, columnKey)):
+                cells = projectRow(row, columnFamily, columnKey)
+                if cells is None:
+                    continue
+                if limit is not None and len(resp) == limit:
+                    return resp, rowKey
+                resp[rowKey] = cells
+        return resp, None
+
+    def getChildrenRangePage(self, rowKeyStart, rowKeyEnd, columnFamily, columnKey, limit=None):
+        resp = {}
+        for child in self.children:
+            remaining = None if limit is None else limit - len(resp)
+            page, nextKey = child.getRowRangePage(rowKeyStart, rowKeyEnd, columnFamily, columnKey, remaining)
+            resp.update(page)
+            if nextKey is not None:
+                return resp, nextKey
+        return resp, None
+
+    def addRow(self, rowKey, columnFamily, columnKey, cellContent, time_val, seq=None):
+        """Returns True if the memtable was full and got frozen, in which case the caller must have it flushed.
 
-    def addRow(self, rowKey, columnFamily, columnKey, cellContent, time_val):
-        return self.memTable.addRow(rowKey, columnFamily, columnKey, cellContent, time_val)
+        Args:
+            seq (int, optional): WAL sequence number of the write, defaults to a write that was not logged
+        """
+        with self.lock:
+            frozen = self.freezeIfFull()
+            if self.children is not None:
+                raise TabletSplitError()
+            self.memTable.addRow(rowKey, columnFamily, columnKey, cellContent, time_val, seq)
+            return frozen
     
     def intersect(self, rowKey):
-        return self.startKey <= str(rowKey)[:len(self.startKey)] and self.endKey >= str(rowKey)[:len(self.endKey)]
+        """True if rowKey falls in the tablet's half-open key range [startKey, endKey).
+        """
+        return str(self.startKey) <= str(rowKey) < str(self.endKey)
     
     def delete(self):
+        with self.compactionLock, self.lock:
+            self.releaseMemTables()
+            for sst in self.ssTables:
+                sst.delete()
+            self.ssTables = []
+            self.levelIndex = {}
+
+    def releaseMemTables(self):
+        """Drop every memtable, giving their memory back to the memtable budget, and wake the writes stalled on them.
+        The caller must hold the tablet lock.
+        """
+        if self.memTableBudget is not None:
+            self.memTableBudget.release(self.memTable.getBytes(), True)
+            for memTable in self.immutableMemTables:
+                self.memTableBudget.release(memTable.getBytes())
         self.memTable.clear()
-        for sst in self.ssTables:
-            sst.delete()
\ No newline at end of file
+        self.immutableMemTables = []
+        self.flushed.notify_all()
\ No newline at end of file
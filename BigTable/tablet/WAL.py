@@ -1,63 +1,432 @@
+import json
 import os
+import struct
+import threading
+import time
+import traceback
+import zlib
+
+MAGIC = b"BTWAL\x02\n"
+HEADER = struct.Struct("<II")
+RECORD_START = struct.Struct("<QB")
+FIELD_LENGTH = struct.Struct("<I")
+TIMESTAMP = struct.Struct("<d")
+MAX_RECORD_LENGTH = 64 * 1024 * 1024
+READ_CHUNK = 64 * 1024
+SEGMENT_SIZE = 4 * 1024 * 1024
+
+INSERT = 1
+DELETE = 2
+TABLET_INSERT = 3
+
+COMMIT_LOG = "commit"
+COMMIT_LOG_SUFFIX = ".log"
+TABLE_LOG_SUFFIX = ".wal"
+
+def encodeRecord(seq, recordType, fields):
+    """Record layout: crc32 (uint32) | payload length (uint32) | payload, where the payload is the sequence number
+    (uint64), the record type (uint8) and every field as a uint32 length followed by its bytes. The CRC covers the
+    length and the payload, so a torn or garbled record is never mistaken for a valid one.
+    """
+    payload = [RECORD_START.pack(seq, recordType)]
+    for field in fields:
+        payload.append(FIELD_LENGTH.pack(len(field)))
+        payload.append(field)
+    payload = b"".join(payload)
+    length = FIELD_LENGTH.pack(len(payload))
+    return HEADER.pack(zlib.crc32(payload, zlib.crc32(length)), len(payload)) + payload
+
+def decodeFields(payload):
+    seq, recordType = RECORD_START.unpack_from(payload)
+    fields = []
+    pos = RECORD_START.size
+    while pos < len(payload):
+        (length,) = FIELD_LENGTH.unpack_from(payload, pos)
+        pos += FIELD_LENGTH.size
+        fields.append(payload[pos:pos + length])
+        pos += length
+    return seq, recordType, fields
+
+def encodeCell(rowKey, colFam, col, content, time_val):
+    return [str(rowKey).encode("utf-8"), str(colFam).encode("utf-8"), str(col).encode("utf-8"),
+        json.dumps(content).encode("utf-8"), TIMESTAMP.pack(float(time_val))]
+
+def decodeCell(fields):
+    """Returns:
+        (str, str, str, object, float): row key, column family, column, content and timestamp of an insert
+    """
+    rowKey, colFam, col, content, timestamp = fields
+    return rowKey.decode("utf-8"), colFam.decode("utf-8"), col.decode("utf-8"), json.loads(content.decode("utf-8")), \
+        TIMESTAMP.unpack(timestamp)[0]
+
+def encodeInsert(seq, tableName, tabletId, rowKey, colFam, col, content, time_val):
+    """A commit log insert: the table name and the JSON encoded tablet id, followed by the cell (see encodeCell).
+    """
+    return encodeRecord(seq, TABLET_INSERT, [str(tableName).encode("utf-8"), json.dumps(tabletId).encode("utf-8")] + \
+        encodeCell(rowKey, colFam, col, content, time_val))
+
+def decodeInsert(fields):
+    """Returns:
+        (str, object, str, str, str, object, float): table name, tablet id and the cell of a commit log insert
+    """
+    return (fields[0].decode("utf-8"), json.loads(fields[1].decode("utf-8"))) + decodeCell(fields[2:])
+
+def readRecords(fileName):
+    """Stream the records of a log file, reading it in chunks of READ_CHUNK bytes. Stops at the first record that is
+    cut short or fails its CRC check, which is where a crash during an append leaves the log.
+
+    Yields:
+        (int, int, list[bytes], int): Sequence number, record type, fields, and the file offset just past the record
+    """
+    with open(fileName, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            return
+        offset = len(MAGIC)
+        buf = b""
+        pos = 0
+        eof = False
+        while True:
+            need = HEADER.size
+            if len(buf) - pos >= HEADER.size:
+                crc, length = HEADER.unpack_from(buf, pos)
+                if length > MAX_RECORD_LENGTH:
+                    return
+                need += length
+            if len(buf) - pos < need:
+                if eof:
+                    return
+                chunk = f.read(max(READ_CHUNK, need))
+                eof = not chunk
+                buf = buf[pos:] + chunk
+                pos = 0
+                continue
+            payload = buf[pos + HEADER.size:pos + need]
+            if zlib.crc32(payload, zlib.crc32(FIELD_LENGTH.pack(length))) != crc:
+                return
+            try:
+                seq, recordType, fields = decodeFields(payload)
+            except struct.error:
+                return
+            pos += need
+            offset += need
+            yield seq, recordType, fields, offset
+
+def listSegments(path, name, suffix=COMMIT_LOG_SUFFIX):
+    """Returns:
+        list[(int, str)]: First sequence number and file name of every segment of a log, oldest first
+    """
+    prefix = name + "."
+    segments = []
+    for fileName in os.listdir(path):
+        if fileName.startswith(prefix) and fileName.endswith(suffix) and fileName[len(prefix):-len(suffix)].isdigit():
+            segments.append((int(fileName[len(prefix):-len(suffix)]), path + "/" + fileName))
+    return sorted(segments)
+
+def segmentName(path, name, firstSeq):
+    return "%s/%s.%020d%s" % (path, name, firstSeq, COMMIT_LOG_SUFFIX)
+
+def tableLogFiles(path, tableName):
+    """Files of the per-table log kept by earlier versions: a single file, in the text or in the binary format, or a
+    series of segments. Oldest first.
+    """
+    files = [fileName for _, fileName in listSegments(path, tableName, TABLE_LOG_SUFFIX)]
+    if os.path.exists(path + "/" + tableName + TABLE_LOG_SUFFIX):
+        files.insert(0, path + "/" + tableName + TABLE_LOG_SUFFIX)
+    return files
+
+def parseLegacyRecord(line):
+    """Parse a record of the old text log, INSERT,{rowKey},{colFam},{col},{content},{time}. Only the content can
+    hold commas, so it is everything between the column and the timestamp.
+    """
+    parts = line.rstrip("\n").split(",")
+    if parts[0] == "INSERT" and len(parts) >= 6:
+        return INSERT, [parts[1], parts[2], parts[3], ",".join(parts[4:-1]), float(parts[-1])]
+    if parts[0] == "DELETE" and len(parts) >= 2:
+        return DELETE, [",".join(parts[1:])]
+    return None
+
+def readTableLog(fileName):
+    """Stream the inserts of a per-table log file of earlier versions. Sequence numbers of the text format are None.
+
+    Yields:
+        (int, str, str, str, object, float): Sequence number, row key, column family, column, content and timestamp
+    """
+    with open(fileName, "rb") as f:
+        binary = f.read(len(MAGIC)) == MAGIC
+    if binary:
+        for seq, recordType, fields, _ in readRecords(fileName):
+            if recordType == INSERT:
+                yield (seq,) + decodeCell(fields)
+        return
+    with open(fileName) as f:
+        for line in f:
+            record = parseLegacyRecord(line)
+            if record is not None and record[0] == INSERT:
+                yield tuple([None] + record[1])
+
 
 class WAL:
-    def __init__(self, path, tableName, loadFromJson=None):
-        """ Write Ahead Log: used for failure recovery
-        Format:
-            {QUERY_TYPE=[INSERT/DELETE]} {row_key1} [{col_fam} {col} {content}]
-            .
-            .
-            .
-            {QUERY_TYPE=[INSERT/DELETE]} {row_keyN} [{col_fam} {col} {content}]
-        
+    def __init__(self, path, name=COMMIT_LOG, segmentSize=SEGMENT_SIZE):
+        """ Commit log shared by every tablet of a tablet server, used for failure recovery. Writes to all tables go
+        to this one log, so concurrent inserts share fsyncs whichever tables they touch, and each record is tagged
+        with its table and tablet. On restart splitByTablet sorts the records out by tablet, so every tablet replays
+        only its own entries.
+
+        The log is a series of segment files, each starting with MAGIC followed by length prefixed, CRC checked records
+        (see encodeRecord). Every record carries a sequence number and a segment is named after the sequence number of
+        its first record. Once the current segment reaches segmentSize bytes a new one is started, and segments whose
+        records are all in SSTs are deleted by truncate().
+
+        The current segment stays open for appends. Appends use group commit: a writer whose record is not durable yet
+        either becomes the leader, which writes every pending record with one write and one fsync, or waits for the
+        running leader to finish. An append may instead return right away with a max delay for its record, in which
+        case a background syncer thread commits the pending records once the earliest of their deadlines is due.
+
         Args:
-            path (str): Path to store WAL
-            table (Table): Table object
-            loadFromJson (str,optional): WAL serialized as JSON
+            path (str): Path to store the log
+            name (str, optional): Name of the segment files, defaults to "commit"
+            segmentSize (int, optional): Size in bytes after which a new segment is started, defaults to 4MB
         """
         self.path = path
-        self.tableName = tableName
-        self.log = ""
-        self.fileName = path + "/" + tableName + ".wal"
-        if loadFromJson:
-            self.loadFromJson(loadFromJson)
-        else:
-            self.save()
-    
-    def loadFromJson(self, s):
-        self.log = s
-    
+        self.name = name
+        self.segmentSize = segmentSize
+        self.lock = threading.Lock()
+        self.synced = threading.Condition(self.lock)
+        self.pending = []
+        self.inFlight = set()
+        self.appendedSeq = 0
+        self.durableSeq = 0
+        self.syncing = False
+        self.syncDeadline = None
+        self.syncRequested = threading.Condition(self.lock)
+        self.truncateHeld = False
+        self.stats = {"records": 0, "syncs": 0, "errors": 0}
+        self.segments = listSegments(path, name)
+        if not self.segments:
+            self.segments = [(1, segmentName(path, name, 1))]
+        self.fileName = self.segments[-1][1]
+        self.fp = None
+        self.openSegment()
+        self.syncer = threading.Thread(target=self.runSyncer, daemon=True)
+        self.syncer.start()
+
+    def openSegment(self):
+        self.fp = open(self.fileName, "ab")
+        if self.fp.tell() == 0:
+            self.fp.write(MAGIC)
+            self.fp.flush()
+            os.fsync(self.fp.fileno())
+
     def save(self):
-        with open(self.fileName,'a') as f:
-            f.write(self.log)
-            self.log = ""
-    
-    def appendAddQuery(self, rowKey, colFam, col, content, time_val):
-        self.log += f"INSERT,{rowKey},{colFam},{col},{content},{time_val}\n"
-        self.save()
-    
-    def appendDeleteQuery(self, rowKey):
-        self.log += f"DELETE,{rowKey},{colFam},{col},{content},{time_val}\n"
-        self.save()
-    
-    def delete(self):
-        os.remove(self.fileName)
-    
-    def replay(self, tableService):
-        queries = self.log.split("\n")
-        queries.reverse()
-
-        for q in queries:
-            parts = q.split(",")
-            if len(parts) == 0:
+        """Make every record appended so far durable.
+        """
+        with self.lock:
+            self.waitDurable(self.appendedSeq)
+
+    def append(self, encode, syncDelay=0):
+        """Append a record and wait until it is durable, or with a syncDelay only make sure it is on disk within that
+        many seconds. The record counts as in flight until the caller reports it as applied to the memtable with
+        applied(), see getAppliedSeq.
+
+        Args:
+            encode (function): Called with the record's sequence number, returns the encoded record
+            syncDelay (float, optional): Seconds the record may wait to be on disk, defaults to 0 (wait for the fsync)
+
+        Returns:
+            int: Sequence number of the record
+        """
+        with self.lock:
+            self.appendedSeq += 1
+            seq = self.appendedSeq
+            self.pending.append(encode(seq))
+            self.inFlight.add(seq)
+            self.stats["records"] += 1
+            if syncDelay > 0:
+                deadline = time.monotonic() + syncDelay
+                if self.syncDeadline is None or deadline < self.syncDeadline:
+                    self.syncDeadline = deadline
+                    self.syncRequested.notify()
+                return seq
+            try:
+                self.waitDurable(seq)
+            except BaseException:
+                self.inFlight.discard(seq)
+                raise
+            return seq
+
+    def applied(self, seq):
+        with self.lock:
+            self.inFlight.discard(seq)
+
+    def getLastSeq(self):
+        """Sequence number of the last record appended so far.
+        """
+        with self.lock:
+            return self.appendedSeq
+
+    def getAppliedSeq(self):
+        """Every record up to the returned sequence number has been applied to a memtable.
+        """
+        with self.lock:
+            return min(self.inFlight) - 1 if self.inFlight else self.appendedSeq
+
+    def waitDurable(self, seq):
+        """Block until record seq is on disk, leading a group commit if no other writer is. Called with the lock held;
+        the lock is released while writing and while waiting.
+        """
+        while self.durableSeq < seq:
+            if self.syncing:
+                self.synced.wait()
                 continue
-            if parts[0] == "INSERT":
-                cells = tableService.getEntry(self.tableName, parts[1], parts[2], parts[3])
-                found = False
-                if cells is not None:
-                    for c in cells:
-                        if c[0] == parts[4] and c[1] == float(parts[5]):
-                            found = True
-                            break
-                if found is False:
-                    tableService.addNewEntry(self.tableName, parts[1], parts[2], parts[3], parts[4], parts[5],False)
\ No newline at end of file
+            self.syncing = True
+            batch = b"".join(self.pending)
+            lastSeq = self.appendedSeq
+            self.pending = []
+            self.syncDeadline = None
+            self.lock.release()
+            try:
+                self.fp.write(batch)
+                self.fp.flush()
+                os.fsync(self.fp.fileno())
+            except BaseException:
+                self.lock.acquire()
+                self.pending.insert(0, batch)
+                self.syncing = False
+                self.synced.notify_all()
+                raise
+            self.lock.acquire()
+            self.durableSeq = lastSeq
+            self.stats["syncs"] += 1
+            if self.fp.tell() >= self.segmentSize:
+                self.rotate()
+            self.syncing = False
+            self.synced.notify_all()
+
+    def runSyncer(self):
+        """Commit the pending records of delayed appends once the earliest of their deadlines is due.
+        """
+        with self.lock:
+            while True:
+                if self.syncDeadline is None:
+                    self.syncRequested.wait()
+                    continue
+                delay = self.syncDeadline - time.monotonic()
+                if delay > 0:
+                    self.syncRequested.wait(delay)
+                    continue
+                try:
+                    self.waitDurable(self.appendedSeq)
+                except Exception:
+                    self.stats["errors"] += 1
+                    traceback.print_exc()
+                    self.syncDeadline = time.monotonic() + 1
+
+    def rotate(self):
+        """Start a new segment for the records after durableSeq. Called by the group commit leader.
+        """
+        self.fp.close()
+        firstSeq = self.durableSeq + 1
+        self.fileName = segmentName(self.path, self.name, firstSeq)
+        self.segments.append((firstSeq, self.fileName))
+        self.openSegment()
+
+    def truncate(self, checkpoint):
+        """Delete the segments holding only records up to checkpoint, i.e. records that are all in SSTs. The current
+        segment is always kept, and so is every segment while truncation is held (see holdTruncation).
+
+        Args:
+            checkpoint (int): Sequence number up to which every record is persisted elsewhere
+        """
+        with self.lock:
+            if self.truncateHeld:
+                return
+            while len(self.segments) > 1 and self.segments[1][0] - 1 <= checkpoint:
+                os.remove(self.segments.pop(0)[1])
+
+    def holdTruncation(self, held=True):
+        """Keep every segment until called again with held=False. Used by recovery: a tablet whose records are not
+        replayed yet has them in neither a memtable nor an SST, so the checkpoints of the tablets do not cover them.
+        """
+        with self.lock:
+            self.truncateHeld = held
+
+    def appendAddQuery(self, tableName, tabletId, rowKey, colFam, col, content, time_val, syncDelay=0):
+        return self.append(lambda seq: encodeInsert(seq, tableName, tabletId, rowKey, colFam, col, content, time_val), \
+            syncDelay)
+
+    def appendDeleteQuery(self, tableName, rowKey):
+        return self.append(lambda seq: encodeRecord(seq, DELETE, [str(tableName).encode("utf-8"), \
+            str(rowKey).encode("utf-8")]))
+
+    def getStats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats["segments"] = len(self.segments)
+            return stats
+
+    def delete(self):
+        with self.lock:
+            self.fp.close()
+            for _, fileName in self.segments:
+                os.remove(fileName)
+            self.segments = []
+
+    def splitByTablet(self, route, outputPath):
+        """Recovery step: stream the log and sort its inserts out by tablet, writing the records each tablet still
+        needs to a split file of its own, in sequence order. A tablet (or a server taking it over) then replays its
+        split file with replaySplit, reading nothing that belongs to other tablets. Also cuts off a torn record at
+        the end of the log and moves the sequence numbers past every logged record.
+
+        Args:
+            route (function): Called with the table name, tablet id, row key and sequence number of an insert. Returns
+                the key of the tablet that needs the record, or None if it is in SSTs already or its table is gone
+            outputPath (str): Directory for the split files
+
+        Returns:
+            dict: Tablet key -> split file name
+        """
+        splits = {}
+        files = {}
+        end = len(MAGIC)
+        try:
+            for _, fileName in self.segments:
+                end = len(MAGIC)
+                for seq, recordType, fields, end in readRecords(fileName):
+                    self.appendedSeq = self.durableSeq = seq
+                    if recordType != TABLET_INSERT:
+                        continue
+                    tableName = fields[0].decode("utf-8")
+                    tabletId = json.loads(fields[1].decode("utf-8"))
+                    rowKey = fields[2].decode("utf-8")
+                    key = route(tableName, tabletId, rowKey, seq)
+                    if key is None:
+                        continue
+                    if key not in files:
+                        splits[key] = "%s/%s.split%d%s" % (outputPath, self.name, len(splits), COMMIT_LOG_SUFFIX)
+                        files[key] = open(splits[key], "wb")
+                        files[key].write(MAGIC)
+                    files[key].write(encodeRecord(seq, recordType, fields))
+        finally:
+            for f in files.values():
+                f.close()
+        self.appendedSeq = self.durableSeq = max(self.appendedSeq, self.segments[-1][0] - 1)
+        if end < os.path.getsize(self.fileName):
+            self.fp.truncate(end)
+        return splits
+
+    def skipTo(self, seq):
+        """Continue the sequence numbers after seq at least, so new records sort after everything already persisted.
+        """
+        with self.lock:
+            if seq > self.appendedSeq:
+                self.appendedSeq = self.durableSeq = seq
+
+
+def replaySplit(fileName):
+    """Stream the inserts of a split file written by WAL.splitByTablet.
+
+    Yields:
+        (int, str, str, str, object, float): Sequence number, row key, column family, column, content and timestamp
+    """
+    for seq, recordType, fields, _ in readRecords(fileName):
+        yield (seq,) + decodeInsert(fields)[2:]
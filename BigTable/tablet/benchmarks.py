@@ -0,0 +1,306 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import Table
+import WAL
+from TableService import TableService
+from Tablet import Tablet
+
+def makeTablet(path, memTableCapacity):
+    return Tablet(0, 0, "benchTable", '0', 'z', path, None, 5, 100, memTableCapacity)
+
+def fillMemTable(tablet, numRows, valueSize=100):
+    value = "x" * valueSize
+    for i in range(numRows):
+        tablet.memTable.addRow("row%08d" % ((i * 7919) % numRows), "cf1", "c1", value, float(i))
+
+def bench_flush(sizes=(1000, 2000, 4000, 8000, 16000, 32000)):
+    """Time a single memtable flush for growing memtable sizes. With the streaming writer, time per row and peak
+    memory per row should stay flat as the memtable grows.
+    """
+    print("%10s %12s %14s %16s" % ("rows", "flush (ms)", "us per row", "peak KB"))
+    for numRows in sizes:
+        path = tempfile.mkdtemp()
+        try:
+            tablet = makeTablet(path, numRows + 1)
+            fillMemTable(tablet, numRows)
+            tracemalloc.start()
+            start = time.perf_counter()
+            tablet.memTable.createSSTable()
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print("%10d %12.1f %14.2f %16.1f" % (numRows, elapsed * 1000, elapsed * 1e6 / numRows, peak / 1024))
+        finally:
+            shutil.rmtree(path)
+
+def bench_projection(numRows=2000, numColumns=(1, 10, 50, 200), reads=2000):
+    """Time single cell reads from an SST of rows with growing numbers of columns, decoding the whole row and then
+    picking the cell versus pushing the cell down as a projection. The projected read should stay about flat as rows
+    get wider.
+    """
+    print("%10s %18s %18s %10s" % ("columns", "full row (us)", "projected (us)", "speedup"))
+    for cols in numColumns:
+        path = tempfile.mkdtemp()
+        try:
+            tablet = makeTablet(path, numRows + 1)
+            for i in range(numRows):
+                for c in range(cols):
+                    tablet.memTable.addRow("row%08d" % i, "cf1", "c%d" % c, "x" * 20, float(i))
+            tablet.memTable.createSSTable()
+            sst = tablet.ssTables[0]
+            keys = ["row%08d" % ((i * 7919) % numRows) for i in range(reads)]
+            for key in keys:
+                sst.getRawRow(key)
+            start = time.perf_counter()
+            for key in keys:
+                sst.getRawRow(key)["cf1"]["c0"]
+            full = time.perf_counter() - start
+            start = time.perf_counter()
+            for key in keys:
+                sst.search(key, "cf1", "c0")
+            projected = time.perf_counter() - start
+            print("%10d %18.1f %18.1f %9.1fx" % (cols, full * 1e6 / reads, projected * 1e6 / reads, full / projected))
+        finally:
+            shutil.rmtree(path)
+
+def bench_versions(inserts=100000, copies=(1, 5, 20, 100)):
+    """Time inserts into a single hot cell that is already holding maxCellCopies versions, so every insert also evicts
+    the oldest version. Time per insert should barely depend on maxCellCopies.
+    """
+    print("%10s %14s" % ("copies", "us per insert"))
+    for maxCellCopies in copies:
+        path = tempfile.mkdtemp()
+        try:
+            tablet = Tablet(0, 0, "benchTable", '0', 'z', path, None, maxCellCopies, 100, inserts + 1)
+            start = time.perf_counter()
+            for i in range(inserts):
+                tablet.memTable.addRow("row", "cf1", "c1", "x", float(i))
+            elapsed = time.perf_counter() - start
+            print("%10d %14.2f" % (maxCellCopies, elapsed * 1e6 / inserts))
+        finally:
+            shutil.rmtree(path)
+
+def bench_memory(numRows=2000, numColumns=10, versions=3):
+    """Bytes per cell version held by the memtable, against the nested dict/list/tuple layout it replaced
+    (row -> family -> column -> list of (content, timestamp)), with the family and column names of every row parsed
+    from its own request as before.
+    """
+    value = "x" * 20
+
+    def fill(add):
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        for i in range(numRows):
+            for c in range(numColumns):
+                for v in range(versions):
+                    add("row%08d" % i, "".join(["cf", "1"]), "".join(["c", str(c)]), value, float(v))
+        used = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        return used
+
+    nested = {}
+    def addNested(rowKey, columnFamily, columnKey, content, timestamp):
+        nested.setdefault(rowKey, {}).setdefault(columnFamily, {}).setdefault(columnKey, []).append((content, timestamp))
+
+    path = tempfile.mkdtemp()
+    try:
+        tablet = Tablet(0, 0, "benchTable", '0', 'z', path, None, versions, 100, numRows + 1)
+        cells = numRows * numColumns * versions
+        print("%20s %16s" % ("layout", "bytes per cell"))
+        print("%20s %16.1f" % ("nested dicts", fill(addNested) / cells))
+        print("%20s %16.1f" % ("compact rows", fill(tablet.memTable.addRow) / cells))
+    finally:
+        shutil.rmtree(path)
+
+def makeService(path):
+    paths = [path + "/metadata", path + "/sst", path + "/wal"]
+    for p in paths:
+        os.makedirs(p)
+    return TableService(*paths)
+
+def makeBenchTable(name):
+    return Table.Table(name, [Table.ColumnFamily("cf1", ["c1"])])
+
+def bench_wal(threads=(1, 4, 16, 64), inserts=2000):
+    """Durable inserts per second for a growing number of concurrent writers, each writing to a table of its own. All
+    tables share the server's commit log, so with group commit the writers share fsyncs and throughput should grow
+    with the writer count.
+    """
+    print("%10s %16s %18s" % ("writers", "inserts per s", "records per sync"))
+    for numThreads in threads:
+        path = tempfile.mkdtemp()
+        try:
+            service = makeService(path)
+            for t in range(numThreads):
+                service.createTable(makeBenchTable("benchTable%d" % t), 5, inserts * 2, inserts + 1, memTableMaxBytes=None)
+            perThread = inserts // numThreads
+            def write(tableName):
+                for i in range(perThread):
+                    service.addNewEntry(tableName, "row%08d" % i, "cf1", "c1", "x" * 100, float(i))
+            writers = [threading.Thread(target=write, args=("benchTable%d" % t,)) for t in range(numThreads)]
+            before = service.getWALStats()
+            start = time.perf_counter()
+            for w in writers:
+                w.start()
+            for w in writers:
+                w.join()
+            elapsed = time.perf_counter() - start
+            stats = service.getWALStats()
+            records = stats["records"] - before["records"]
+            print("%10d %16.0f %18.1f" % (numThreads, records / elapsed, records / (stats["syncs"] - before["syncs"])))
+        finally:
+            shutil.rmtree(path)
+
+def bench_recovery(sizes=(1000, 10000, 50000), valueSize=100):
+    """Time the commit log recovery of a restarting TableService for growing logs. The log is written straight to
+    disk, then split by tablet and replayed, so recovery time per record should stay flat as the log grows.
+    """
+    print("%10s %10s %14s %16s" % ("records", "log KB", "replay (ms)", "us per record"))
+    for numRecords in sizes:
+        path = tempfile.mkdtemp()
+        try:
+            service = makeService(path)
+            service.createTable(makeBenchTable("benchTable"), 5, numRecords * 2, numRecords + 1, memTableMaxBytes=None)
+            logFile = service.commitLog.fileName
+            with open(logFile, "ab") as f:
+                for i in range(numRecords):
+                    f.write(WAL.encodeInsert(i + 1, "benchTable", 0, "row%08d" % ((i * 7919) % numRecords), "cf1", \
+                        "c1", "x" * valueSize, float(i)))
+            start = time.perf_counter()
+            TableService(path + "/metadata", path + "/sst", path + "/wal")
+            elapsed = time.perf_counter() - start
+            print("%10d %10.1f %14.1f %16.2f" % (numRecords, os.path.getsize(logFile) / 1024, elapsed * 1000, \
+                elapsed * 1e6 / numRecords))
+        finally:
+            shutil.rmtree(path)
+
+def bench_durability(inserts=2000, threads=4):
+    """Insert throughput of tables with each durability mode, with a few concurrent writers per table: "sync" waits
+    for the fsync of every commit (shared by concurrent writers), "interval" lets the log syncer fsync every 100ms and
+    "none" skips the log.
+    """
+    print("%10s %16s %10s" % ("mode", "inserts per s", "fsyncs"))
+    for mode in Table.DURABILITY_MODES:
+        path = tempfile.mkdtemp()
+        try:
+            service = makeService(path)
+            service.createTable(makeBenchTable("benchTable"), 5, inserts * 2, inserts + 1, memTableMaxBytes=None, \
+                durability=mode)
+            perThread = inserts // threads
+            def write(t):
+                for i in range(perThread):
+                    service.addNewEntry("benchTable", "row%02d%08d" % (t, i), "cf1", "c1", "x" * 100, float(i))
+            writers = [threading.Thread(target=write, args=(t,)) for t in range(threads)]
+            before = service.getWALStats()
+            start = time.perf_counter()
+            for w in writers:
+                w.start()
+            for w in writers:
+                w.join()
+            elapsed = time.perf_counter() - start
+            print("%10s %16.0f %10d" % (mode, perThread * threads / elapsed, service.getWALStats()["syncs"] - before["syncs"]))
+        finally:
+            shutil.rmtree(path)
+
+def bench_manifest(tables=(10, 100, 1000), edits=200):
+    """Time the METADATA write done after every flush for growing numbers of tables: a full snapshot of all tables,
+    which every flush used to write, versus the edit appended to the manifest log for the flushed tablet. The logged
+    edit should cost the same whatever the number of tables.
+    """
+    print("%10s %16s %16s" % ("tables", "snapshot (ms)", "edit (ms)"))
+    for numTables in tables:
+        path = tempfile.mkdtemp()
+        try:
+            service = makeService(path)
+            service.metaMgr.snapshotEvery = edits + 1
+            for t in range(numTables):
+                service.createTable(makeBenchTable("benchTable%d" % t), 5, 100, 100, memTableMaxBytes=None)
+            tablet = service.getTablets("benchTable0")[0]
+            start = time.perf_counter()
+            service.metaMgr.dumpToDisk()
+            snapshot = time.perf_counter() - start
+            start = time.perf_counter()
+            for i in range(edits):
+                service.metaMgr.logTablet(tablet)
+            edit = (time.perf_counter() - start) / edits
+            print("%10d %16.2f %16.2f" % (numTables, snapshot * 1000, edit * 1000))
+        finally:
+            shutil.rmtree(path)
+
+def bench_startup(sizes=(10000, 50000, 200000), valueSize=100):
+    """Time the restart of a TableService against the amount of data it serves, and the first read after it. SSTs are
+    opened on first use, so startup time should stay flat as the data grows.
+    """
+    print("%10s %10s %8s %14s %16s" % ("rows", "data KB", "SSTs", "startup (ms)", "first read (ms)"))
+    for numRows in sizes:
+        path = tempfile.mkdtemp()
+        try:
+            service = makeService(path)
+            service.createTable(makeBenchTable("benchTable"), 5, numRows * 2, numRows // 20, memTableMaxBytes=None)
+            for i in range(numRows):
+                service.addNewEntry("benchTable", "row%08d" % i, "cf1", "c1", "x" * valueSize, float(i), walWrite=False)
+            service.waitForCompactions()
+            ssts = service.getTablets("benchTable")[0].ssTables
+            dataSize = sum(sst.getSize() for sst in ssts)
+            start = time.perf_counter()
+            restarted = TableService(path + "/metadata", path + "/sst", path + "/wal")
+            startup = time.perf_counter() - start
+            start = time.perf_counter()
+            restarted.getEntry("benchTable", "row%08d" % (numRows // 2), "cf1", "c1")
+            firstRead = time.perf_counter() - start
+            restarted.waitForCompactions()
+            print("%10d %10.0f %8d %14.1f %16.2f" % (numRows, dataSize / 1024, len(ssts), startup * 1000, firstRead * 1000))
+        finally:
+            shutil.rmtree(path)
+
+def bench_split(sizes=(10000, 50000, 200000), valueSize=100):
+    """Time the split of a tablet against the amount of data it holds. The new tablets share the SST files of the old
+    one, so a split only reads block indexes and memtable keys and its time should stay in milliseconds as the data
+    grows.
+    """
+    print("%10s %10s %12s %14s %14s" % ("rows", "data KB", "split (ms)", "left rows", "right rows"))
+    for numRows in sizes:
+        path = tempfile.mkdtemp()
+        try:
+            service = makeService(path)
+            service.createTable(makeBenchTable("benchTable"), 5, numRows * 2, 2000, memTableMaxBytes=None)
+            for i in range(numRows):
+                service.addNewEntry("benchTable", "row%08d" % i, "cf1", "c1", "x" * valueSize, float(i), walWrite=False)
+            service.waitForCompactions()
+            tablet = service.getTablets("benchTable")[0]
+            dataSize = sum(sst.getSize() for sst in tablet.ssTables)
+            tablet.tabletCapacity = numRows // 2
+            start = time.perf_counter()
+            service.splitTablet(tablet)
+            elapsed = time.perf_counter() - start
+            left, right = service.getTablets("benchTable")
+            print("%10d %10.0f %12.2f %14d %14d" % (numRows, dataSize / 1024, elapsed * 1000, left.getCurrentSize(), \
+                right.getCurrentSize()))
+            service.waitForCompactions()
+        finally:
+            shutil.rmtree(path)
+
+
+BENCHMARKS = {
+    "flush": bench_flush,
+    "projection": bench_projection,
+    "versions": bench_versions,
+    "memory": bench_memory,
+    "wal": bench_wal,
+    "recovery": bench_recovery,
+    "durability": bench_durability,
+    "manifest": bench_manifest,
+    "startup": bench_startup,
+    "split": bench_split,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print("== " + name)
+        BENCHMARKS[name]()
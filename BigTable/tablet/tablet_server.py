@@ -1,3 +1,4 @@
+import base64
 import json
 import sys
 import os
@@ -5,7 +6,8 @@ import requests
 from flask import Flask, request
 from flask import Response
 from TableService import TableService
-from Table import Table, ColumnFamily
+from Table import Table, ColumnFamily, DEFAULT_LOCALITY_GROUP, DURABILITY_SYNC, DURABILITY_MODES, DEFAULT_SYNC_INTERVAL_MS
+from Compaction import POLICIES
 
 app = Flask(__name__)
 
@@ -41,10 +43,24 @@ def create_table():
         cols = []
         for c in cf["columns"]:
             cols.append(c)
-        colFamObj.append(ColumnFamily(cf_name,cols))
+        colFamObj.append(ColumnFamily(cf_name,cols,cf.get("locality_group",DEFAULT_LOCALITY_GROUP)))
     
     table = Table(tableName,colFamObj)
-    created = tableService.createTable(table)
+    bloomBitsPerKey = int(req.get("bloom_bits_per_key", 10))
+    compactionStrategy = req.get("compaction", "tiered")
+    if compactionStrategy not in POLICIES:
+        return Response(None,400)
+    durability = req.get("durability", DURABILITY_SYNC)
+    if durability not in DURABILITY_MODES:
+        return Response(None,400)
+    try:
+        syncIntervalMs = int(req.get("sync_interval_ms", DEFAULT_SYNC_INTERVAL_MS))
+    except (TypeError, ValueError):
+        return Response(None,400)
+    if syncIntervalMs <= 0:
+        return Response(None,400)
+    created = tableService.createTable(table, bloomBitsPerKey=bloomBitsPerKey, compactionStrategy=compactionStrategy, \
+        durability=durability, syncIntervalMs=syncIntervalMs)
     if created is True:
         resp = Response(None, status=200)
     else:
@@ -121,6 +137,39 @@ def retrieve_cell(pk):
     return Response(json.dumps(resp),200)
 
 
+SCAN_PAGE_SIZE = 100
+
+def encode_page_token(rowKey):
+    return base64.urlsafe_b64encode(rowKey.encode("utf-8")).decode("ascii")
+
+def decode_page_token(token):
+    return base64.urlsafe_b64decode(token.encode("ascii")).decode("utf-8")
+
+def format_range_row(rowName, vals):
+    inner = {}
+    inner["row"] = rowName
+    inner["data"] = []
+    for v in vals:
+        inner["data"].append({"value":v[0],"time":v[1]})
+    return inner
+
+def stream_range(tableName, rowStart, rowEnd, cf, col, limit):
+    """Emits the JSON response row by row. Rows are fetched SCAN_PAGE_SIZE at a time so the tablet lock is never held
+    while the client reads.
+    """
+    yield '{"rows": ['
+    count = 0
+    while rowStart is not None and (limit is None or count < limit):
+        pageSize = SCAN_PAGE_SIZE if limit is None else min(SCAN_PAGE_SIZE, limit - count)
+        rows, rowStart = tableService.getEntryRangePage(tableName,rowStart,rowEnd,cf,col,pageSize)
+        for rowName,vals in rows.items():
+            yield ("," if count > 0 else "") + json.dumps(format_range_row(rowName,vals))
+            count += 1
+    yield "]"
+    if rowStart is not None:
+        yield ', "next_page_token": ' + json.dumps(encode_page_token(rowStart))
+    yield "}"
+
 @app.route('/api/table/<pk>/cells', methods=['GET'])
 def retrieve_cells(pk):
     req = json.loads(request.data)
@@ -139,17 +188,26 @@ def retrieve_cells(pk):
         return Response(None,400)
     rowStart = str(req["row_from"])
     rowEnd = str(req["row_to"])
-    rows = tableService.getEntryRange(tableName,rowStart,rowEnd,cf,col)
+    try:
+        limit = req.get("limit", request.args.get("limit"))
+        limit = int(limit) if limit is not None else None
+        token = req.get("page_token", request.args.get("page_token"))
+        if token is not None:
+            rowStart = decode_page_token(token)
+    except:
+        return Response(None,400)
+    if limit is not None and limit <= 0:
+        return Response(None,400)
+    stream = req.get("stream", request.args.get("stream")) in (True, "true", "1")
+    if stream:
+        return Response(stream_range(tableName,rowStart,rowEnd,cf,col,limit),200,content_type="application/json")
+    rows, nextKey = tableService.getEntryRangePage(tableName,rowStart,rowEnd,cf,col,limit)
     resp = {}
     resp["rows"] = []
-    if rows is not None:
-        for rowName,vals in rows.items():
-            inner = {}
-            inner["row"] = rowName
-            inner["data"] = []
-            for v in vals:
-                inner["data"].append({"value":v[0],"time":v[1]})
-            resp["rows"].append(inner)
+    for rowName,vals in rows.items():
+        resp["rows"].append(format_range_row(rowName,vals))
+    if nextKey is not None:
+        resp["next_page_token"] = encode_page_token(nextKey)
     return Response(json.dumps(resp),200)
 
 
@@ -183,13 +241,58 @@ def retrieve_row(pk):
 def set_memtable_max():
     try:
         newVal = json.loads(request.data)
+        maxRows = newVal.get("memtable_max")
+        maxBytes = newVal.get("memtable_max_bytes")
+        budget = newVal.get("memtable_budget")
+        maxRows = None if maxRows is None else int(maxRows)
+        maxBytes = None if maxBytes is None else int(maxBytes)
+        budget = None if budget is None else int(budget)
     except:
         return Response(None,400)
+    if maxRows is None and maxBytes is None and budget is None:
+        return Response(None,400)
+    if any(v is not None and v <= 0 for v in (maxRows, maxBytes)) or (budget is not None and budget < 0):
+        return Response(None,400)
     tables = tableService.listTables()
     for t in tables:
-        tableService.changeMemtableCapacity(t,int(newVal["memtable_max"]))
+        if maxRows is not None:
+            tableService.changeMemtableCapacity(t,maxRows)
+        if maxBytes is not None:
+            tableService.changeMemtableMaxBytes(t,maxBytes)
+    if budget is not None:
+        tableService.changeMemtableBudget(budget)
     return Response(None,200)
 
+@app.route('/api/memtable', methods=['GET'])
+def get_memtable_usage():
+    return Response(json.dumps(tableService.memTableBudget.getUsage()),200,content_type="application/json")
+
+@app.route('/api/blockcache', methods=['POST'])
+def set_blockcache_max():
+    try:
+        newVal = int(json.loads(request.data)["blockcache_max"])
+    except:
+        return Response(None,400)
+    if newVal < 0:
+        return Response(None,400)
+    tableService.changeBlockCacheSize(newVal)
+    return Response(None,200)
+
+@app.route('/api/blockcache', methods=['GET'])
+def get_blockcache_usage():
+    return Response(json.dumps(tableService.blockCache.getUsage()),200,content_type="application/json")
+
+@app.route('/api/stats/<pk>', methods=['GET'])
+def get_table_stats(pk):
+    if tableService.tableExists(pk) is False:
+        return Response(None,404)
+    resp = {}
+    resp["bloom_filter"] = tableService.getBloomStats(pk)
+    resp["block_cache"] = tableService.getBlockCacheStats(pk)
+    resp["memtable_flush"] = tableService.getFlushStats(pk)
+    resp["wal"] = tableService.getWALStats()
+    return Response(json.dumps(resp),200,content_type="application/json")
+
 @app.route('/api/heartbeat/<pk>',methods=['GET'])
 def get_tablets():
     tableName = pk
@@ -1,5 +1,18 @@
 from TableService import TableService
+from Tablet import SSTable, Tablet, TabletSplitError
+from MergeIterator import pastEnd
+from Compaction import LeveledPolicy
+import MetadataManager
 import Table
+import WAL
+import contextlib
+import json
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
 
 tableService = None 
 
@@ -7,6 +20,20 @@ def init_service(metadataPath, ssTablePath, walPath):
     global tableService
     tableService = TableService(metadataPath, ssTablePath, walPath)
 
+@contextlib.contextmanager
+def serviceDirs():
+    """Yields the metadata, SST and commit log paths for a TableService of its own, in a new temporary directory that
+    is removed afterwards. Restarts are tested by creating another TableService on the same paths.
+    """
+    path = tempfile.mkdtemp()
+    paths = [path + "/metadata", path + "/sst", path + "/wal"]
+    for p in paths:
+        os.makedirs(p)
+    try:
+        yield paths
+    finally:
+        shutil.rmtree(path)
+
 def createTable(tableName):
     colFams = ["cf1","cf2"]
     cols = [["c1","c2"],["c1","c2"]]
@@ -134,6 +161,7 @@ def test_memTableCapacity():
     tableService.addNewEntry(tableName,"ab","cf1","c1","Hello!",124.0)
     tableService.addNewEntry(tableName,"cd","cf1","c1","Hello!",124.0)
     tableService.addNewEntry(tableName,"dd","cf1","c1","Hello!",124.0)
+    tableService.waitForFlushes()
     resp = tableService.getEntryRange(tableName,"aaa","d","cf1","c1")
     print(resp)
     if len(tableService.metaMgr.getRelevantTablet(tableName,"ab").ssTables) != 2:
@@ -167,6 +195,796 @@ def test_changeMemtableCapacity():
     
     tableService.deleteTable(tableName)
 
+def test_sstBlockLookup():
+    tableName = "testTable"
+    table = createTable(tableName)
+    tableService.createTable(table,5,1000,500)
+    for i in range(600):
+        tableService.addNewEntry(tableName,"row%04d" % i,"cf1","c1","Hello%d!" % i,float(i))
+    tableService.waitForFlushes()
+    sst = tableService.metaMgr.getRelevantTablet(tableName,"row0000").ssTables[0]
+    if len(sst.blockIndex) < 2:
+        raise Exception("Error: SSTable not split into blocks!")
+    for i in [0, 1, 250, 499]:
+        cells = tableService.getEntry(tableName,"row%04d" % i,"cf1","c1")
+        if cells is None or cells[0][0] != "Hello%d!" % i:
+            raise Exception("Error: Block lookup returned wrong cell!")
+    if sst.search("row0499a") is not None or sst.search("a") is not None:
+        raise Exception("Error: Block lookup found a missing key!")
+    tableService.deleteTable(tableName)
+
+def test_legacySSTable():
+    tableName = "testTable"
+    table = createTable(tableName)
+    tableService.createTable(table)
+    tablet = tableService.metaMgr.getRelevantTablet(tableName,"aaa")
+    rows = {"aaa": {"cf1": {"c1": [["Hello!", 123.0]]}}, "ab": {"cf1": {"c1": [["Hello2!", 124.0]]}}}
+    fileName = tablet.ssTablePath + "/" + tablet.sstFilePrefix + "_0.sst"
+    index = {}
+    serialized = ""
+    for key in sorted(rows):
+        index[key] = len(serialized)
+        serialized += json.dumps(rows[key]) + "\n"
+    with open(fileName,"w") as f:
+        f.write(serialized + json.dumps(index))
+    tablet.addSST(SSTable(0, None, tablet))
+    cells = tableService.getEntry(tableName,"ab","cf1","c1")
+    if cells is None or cells[0][0] != "Hello2!":
+        raise Exception("Error: Legacy SSTable not readable!")
+    tableService.deleteTable(tableName)
+
+def test_legacyFileNames():
+    with serviceDirs() as paths:
+        tablets = {}
+        for tableName, sstIds in [("a", [0]), ("b", [])]:
+            tablets[tableName] = [json.dumps({"id": 0, "serverId": 0, "tableName": tableName, "startKey": "0", "endKey": "z", \
+                "maxCellCopies": 5, "memTableCapacity": 2, "tabletCapacity": 100, "ssTablePath": paths[1], "sstIds": sstIds})]
+        with open(paths[0] + "/meta.tablet", "w") as f:
+            f.write(json.dumps(tablets))
+        with open(paths[0] + "/meta.table", "w") as f:
+            f.write(json.dumps({tableName: createTable(tableName).getAsJson() for tableName in tablets}))
+        with open(paths[1] + "/0_0.sst", "w") as f:
+            f.write(json.dumps({"cf1": {"c1": [["Hello!", 1.0]]}}) + "\n" + json.dumps({"a00": 0}))
+        service = TableService(*paths)
+        for i in range(3):
+            service.addNewEntry("b","b%02d" % i,"cf1","c1","Hello%d!" % i,float(i))
+        service.waitForCompactions()
+        if service.getEntry("a","a00","cf1","c1") != [["Hello!", 1.0]]:
+            raise Exception("Error: Legacy SSTable overwritten by another table!")
+        recovered = TableService(*paths)
+        if recovered.getEntry("a","a00","cf1","c1") != [["Hello!", 1.0]] or \
+                len(recovered.getEntryRange("b","b00","b99","cf1","c1")) != 3:
+            raise Exception("Error: Legacy SSTable file names not kept in METADATA!")
+        recovered.waitForCompactions()
+
+def test_bloomFilter():
+    tableName = "testTable"
+    table = createTable(tableName)
+    tableService.createTable(table,5,100,10)
+    for i in range(50):
+        tableService.addNewEntry(tableName,"row%04d" % i,"cf1","c1","Hello!",float(i))
+    tableService.waitForFlushes()
+    for i in range(50):
+        if tableService.getEntry(tableName,"row%04dx" % i,"cf1","c1") is not None:
+            raise Exception("Error: Found a row that was never inserted!")
+    stats = tableService.getBloomStats(tableName)
+    print(stats)
+    if stats["misses"] == 0 or stats["false_positives"] > stats["misses"]:
+        raise Exception("Error: Bloom filters not skipping SSTables!")
+    if tableService.getEntry(tableName,"row0003","cf1","c1") is None:
+        raise Exception("Error: Bloom filter dropped an existing row!")
+    if tableService.getBloomStats(tableName)["hits"] != 1:
+        raise Exception("Error: Bloom filter hit not counted!")
+    tableService.deleteTable(tableName)
+
+def test_blockCache():
+    tableName = "testTable"
+    table = createTable(tableName)
+    tableService.createTable(table,5,100,10)
+    for i in range(20):
+        tableService.addNewEntry(tableName,"row%04d" % i,"cf1","c1","Hello!",float(i))
+    tableService.waitForFlushes()
+    for _ in range(5):
+        tableService.getEntry(tableName,"row0001","cf1","c1")
+    stats = tableService.getBlockCacheStats(tableName)
+    print(stats)
+    if stats["misses"] != 1 or stats["hits"] != 4:
+        raise Exception("Error: Hot block not served from the cache!")
+    tableService.changeBlockCacheSize(0)
+    if tableService.blockCache.getUsage()["usage"] != 0:
+        raise Exception("Error: Shrinking the cache did not evict blocks!")
+    tableService.changeBlockCacheSize(8 * 1024 * 1024)
+    tableService.deleteTable(tableName)
+
+def test_sizeTieredCompaction():
+    tableName = "testTable"
+    table = createTable(tableName)
+    tableService.createTable(table,2,100,1)
+    for i in range(5):
+        tableService.addNewEntry(tableName,"row00","cf1","c1","Hello%d!" % i,float(i))
+    tableService.waitForCompactions()
+    tablet = tableService.metaMgr.getRelevantTablet(tableName,"row00")
+    if len(tablet.ssTables) != 1:
+        raise Exception("Error: SSTables not compacted!")
+    cells = tablet.ssTables[0].search("row00","cf1","c1")
+    print(cells)
+    if [c[1] for c in cells] != [3.0, 2.0]:
+        raise Exception("Error: Compaction did not keep the newest maxCellCopies versions!")
+    tableService.deleteTable(tableName)
+
+def test_leveledCompaction():
+    tableName = "testTable"
+    table = createTable(tableName)
+    tableService.createTable(table,5,100,10,10,"leveled")
+    tableService.compactor.policies["leveled"] = LeveledPolicy(4, 4096, 4, 1024)
+    for i in range(300):
+        tableService.addNewEntry(tableName,"row%04d" % ((i * 37) % 300),"cf1","c1","Hello%d!" % i,float(i))
+    tableService.waitForCompactions()
+    tablets = tableService.getTablets(tableName)
+    levels = sorted(set(sst.level for tablet in tablets for sst in tablet.ssTables))
+    print(levels, [len(tablet.ssTables) for tablet in tablets])
+    if max(levels) < 2:
+        raise Exception("Error: Leveled compaction did not push data down!")
+    for tablet in tablets:
+        for level in levels[1:]:
+            ssts = sorted(tablet.getLevel(level), key=lambda s: s.minKey)
+            for prev, curr in zip(ssts, ssts[1:]):
+                if prev.maxKey >= curr.minKey:
+                    raise Exception("Error: Overlapping SSTables within a level!")
+    for i in range(300):
+        tablet = tableService.metaMgr.getRelevantTablet(tableName,"row%04d" % i)
+        candidateLevels = [s.level for s in tablet.getCandidateSSTs("row%04d" % i) if s.level > 0]
+        if len(candidateLevels) != len(set(candidateLevels)):
+            raise Exception("Error: Lookup touches more than one SSTable per level!")
+        cells = tableService.getEntry(tableName,"row%04d" % i,"cf1","c1")
+        if cells is None:
+            raise Exception("Error: Row lost by leveled compaction!")
+    meta = json.loads(max(tablets, key=lambda t: len(t.ssTables)).serialize())
+    if meta["compactionStrategy"] != "leveled" or "minKey" not in meta["ssts"][0]:
+        raise Exception("Error: SSTable levels not recorded in tablet metadata!")
+    tableService.compactor.policies["leveled"] = LeveledPolicy()
+    tableService.deleteTable(tableName)
+
+def test_mergedRowRange():
+    tableName = "testTable"
+    table = createTable(tableName)
+    tableService.createTable(table,3,100,4)
+    for i in range(20):
+        tableService.addNewEntry(tableName,"row%02d" % (i % 10),"cf1","c1","Hello%d!" % i,float(i))
+    tableService.addNewEntry(tableName,"row05a","cf2","c2","Other!",100.0)
+    resp = tableService.getEntryRange(tableName,"row03","row06","cf1","c1")
+    print(resp)
+    if list(resp.keys()) != ["row03","row04","row05","row06"]:
+        raise Exception("Error: Range scan returned wrong rows or order!")
+    if [c[1] for c in resp["row05"]] != [15.0, 5.0]:
+        raise Exception("Error: Range scan did not merge versions newest first!")
+    if tableService.getEntry(tableName,"row05","cf1","c1") != resp["row05"]:
+        raise Exception("Error: Point read and range scan disagree!")
+    tableService.deleteTable(tableName)
+
+def test_rowRangePages():
+    tableName = "testTable"
+    table = createTable(tableName)
+    tableService.createTable(table,5,100,7)
+    for i in range(25):
+        tableService.addNewEntry(tableName,"row%02d" % i,"cf1","c1","Hello%d!" % i,float(i))
+    rows = []
+    rowStart = "row03"
+    pages = 0
+    while rowStart is not None:
+        page, rowStart = tableService.getEntryRangePage(tableName,rowStart,"row21","cf1","c1",5)
+        if len(page) > 5:
+            raise Exception("Error: Page larger than limit!")
+        rows += list(page.keys())
+        pages += 1
+    print(pages, rows)
+    if rows != ["row%02d" % i for i in range(3, 22)] or pages != 4:
+        raise Exception("Error: Paged scan returned wrong rows!")
+    tableService.deleteTable(tableName)
+
+def test_localityGroups():
+    tableName = "testTable"
+    colFam1 = Table.ColumnFamily("cf1",["c1","c2"],"hot")
+    colFam2 = Table.ColumnFamily("cf2",["c1","c2"],"cold")
+    table = Table.Table(tableName,[colFam1,colFam2])
+    tableService.createTable(table,5,100,10)
+    for i in range(20):
+        tableService.addNewEntry(tableName,"row%02d" % i,"cf1","c1","Hot%d!" % i,float(i))
+        tableService.addNewEntry(tableName,"row%02d" % i,"cf2","c2","Cold%d!" % i,float(i))
+    tableService.waitForFlushes()
+    tablet = tableService.metaMgr.getAllTablets(tableName)[0]
+    if tablet.getLocalityGroupsInUse() != ["cold","hot"]:
+        raise Exception("Error: Memtable flush did not split locality groups!")
+    for sst in tablet.ssTables:
+        families = set(cf for _, row in sst.iterRows() for cf in row)
+        if families != {"cf1" if sst.localityGroup == "hot" else "cf2"}:
+            raise Exception("Error: SSTable holds column families of another locality group!")
+    if tableService.getEntry(tableName,"row07","cf2","c2")[0][0] != "Cold7!":
+        raise Exception("Error: Read from locality group failed!")
+    resp = tableService.getEntryRange(tableName,"row03","row05","cf1","c1")
+    if list(resp.keys()) != ["row03","row04","row05"] or resp["row04"][0][0] != "Hot4!":
+        raise Exception("Error: Range scan over locality group failed!")
+    tableService.deleteTable(tableName)
+
+def test_projection():
+    tableName = "testTable"
+    table = createTable(tableName)
+    tableService.createTable(table,5,100,10)
+    for i in range(10):
+        for cf, col in [("cf1","c1"),("cf1","c2"),("cf2","c1")]:
+            tableService.addNewEntry(tableName,"row%02d" % i,cf,col,"%s:%s:%d" % (cf,col,i),float(i))
+    tableService.addNewEntry(tableName,"row10","cf1","c1","x",10.0)
+    tableService.waitForFlushes()
+    tablet = tableService.metaMgr.getAllTablets(tableName)[0]
+    sst = tablet.ssTables[0]
+    row = sst.getRawRow("row03",{("cf1","c2")})
+    if row != {"cf1": {"c2": [["cf1:c2:3", 3.0]]}}:
+        raise Exception("Error: Projected SSTable read decoded the wrong cells!")
+    if sst.getRawRow("row03",{("cf2","c2")}) != {} or sst.getRawRow("row03a",{("cf2","c2")}) is not None:
+        raise Exception("Error: Projected SSTable read cannot tell a missing cell from a missing row!")
+    if len(sst.getRawRow("row03")) != 2:
+        raise Exception("Error: SSTable read without projection lost column families!")
+    row = tablet.getRow("row04",projection={("cf1","c1"),("cf2","c1")})
+    if row != {"cf1": {"c1": [["cf1:c1:4", 4.0]]}, "cf2": {"c1": [["cf2:c1:4", 4.0]]}}:
+        raise Exception("Error: Tablet read with a projection failed!")
+    resp = tableService.getEntryRange(tableName,"row08","row10","cf2","c1")
+    if list(resp.keys()) != ["row08","row09"]:
+        raise Exception("Error: Projected range scan returned rows without the column!")
+    records = b"".join((json.dumps("row%02d" % i) + "\t" + json.dumps({"cf1": {"c1": [["v1:%d" % i, float(i)]]}}) \
+        + "\n").encode("utf-8") for i in range(3))
+    footer = json.dumps({"version": 1, "index": [["row00", 0, len(records)]], "count": 3, "minKey": "row00", \
+        "maxKey": "row02"}).encode("utf-8")
+    fileName = tablet.ssTablePath + "/" + tablet.sstFilePrefix + "_99.sst"
+    with open(fileName, "wb") as fp:
+        fp.write(records + footer + struct.pack(">QI8s", len(records), len(footer), b"BTSSTBLK"))
+    old = SSTable(99, None, tablet)
+    if old.version != 1 or old.search("row01","cf1","c1") != [["v1:1", 1.0]] or len(list(old.iterRows())) != 3:
+        raise Exception("Error: Version 1 SSTable not readable!")
+    old.delete()
+    tableService.deleteTable(tableName)
+
+def test_sortedMemTable():
+    tableName = "testTable"
+    table = createTable(tableName)
+    tableService.createTable(table,5,100,100)
+    keys = ["row%02d" % ((i * 37) % 50) for i in range(50)]
+    for key in keys:
+        tableService.addNewEntry(tableName,key,"cf1","c1","Hello!",1.0)
+    tablet = tableService.metaMgr.getAllTablets(tableName)[0]
+    memTable = tablet.memTable
+    if memTable.rowKeys != sorted(keys):
+        raise Exception("Error: Memtable keys not kept in order!")
+    if [k for k, _ in memTable.iterRows("row17")][:3] != ["row17","row18","row19"]:
+        raise Exception("Error: Memtable seek returned wrong rows!")
+    memTable.deleteRow("row18")
+    if "row18" in memTable.rowKeys or [k for k, _ in memTable.iterRows("row18")][0] != "row19":
+        raise Exception("Error: Memtable delete left the key behind!")
+    resp = tableService.getEntryRange(tableName,"row45","row47","cf1","c1")
+    if list(resp.keys()) != ["row45","row46","row47"]:
+        raise Exception("Error: Range scan over memtable returned wrong rows!")
+    tableService.deleteTable(tableName)
+
+def test_backgroundFlush():
+    tableName = "testTable"
+    table = createTable(tableName)
+    tableService.createTable(table,5,100,5)
+    tablet = tableService.metaMgr.getAllTablets(tableName)[0]
+    flushMemTable = tablet.flushMemTable
+    tablet.flushMemTable = lambda appliedSeq=None: False
+    for i in range(15):
+        tableService.addNewEntry(tableName,"row%02d" % i,"cf1","c1","Hello%d!" % i,float(i))
+    if len(tablet.immutableMemTables) != 2 or tablet.ssTables:
+        raise Exception("Error: Full memtables not frozen for the background flusher!")
+    if tableService.getEntry(tableName,"row03","cf1","c1")[0][0] != "Hello3!":
+        raise Exception("Error: Immutable memtable not readable!")
+    if list(tableService.getEntryRange(tableName,"row04","row06","cf1","c1").keys()) != ["row04","row05","row06"]:
+        raise Exception("Error: Range scan missed the immutable memtables!")
+    writer = threading.Thread(target=tableService.addNewEntry, args=(tableName,"row15","cf1","c1","Hello15!",15.0))
+    writer.start()
+    writer.join(0.2)
+    if not writer.is_alive():
+        raise Exception("Error: Backed up flush queue did not stall the writer!")
+    tablet.flushMemTable = flushMemTable
+    tableService.flusher.schedule(tablet)
+    writer.join()
+    tableService.waitForFlushes()
+    stats = tableService.getFlushStats(tableName)
+    print(stats)
+    if stats["stalls"] != 1 or stats["flushes"] != 3 or stats["immutable_memtables"] != 0 or len(tablet.ssTables) != 3:
+        raise Exception("Error: Flush stats do not match the flushes done!")
+    resp = tableService.getEntryRange(tableName,"row00","row15","cf1","c1")
+    if len(resp) != 16:
+        raise Exception("Error: Rows lost by background flushes!")
+    tableService.deleteTable(tableName)
+
+def test_memTableBytes():
+    tableName = "testTable"
+    table = createTable(tableName)
+    tableService.createTable(table,5,100,None,memTableMaxBytes=2000)
+    tablet = tableService.metaMgr.getAllTablets(tableName)[0]
+    for i in range(10):
+        tableService.addNewEntry(tableName,"row%02d" % i,"cf1","c1","x" * 500,float(i))
+    tableService.waitForFlushes()
+    if len(tablet.ssTables) != 3 or tablet.memTable.getCurrentSize() != 1:
+        raise Exception("Error: Memtable not flushed on its byte limit!")
+    if not 500 <= tablet.memTable.getBytes() < 2000:
+        raise Exception("Error: Memtable byte accounting is off!")
+    tableService.changeMemtableMaxBytes(tableName,100)
+    tableService.waitForFlushes()
+    if len(tablet.ssTables) != 4 or tablet.memTable.getCurrentSize() != 0:
+        raise Exception("Error: Lowering the byte limit did not flush the memtable!")
+    table2 = createTable("testTable2")
+    tableService.createTable(table2,5,100,None,memTableMaxBytes=None)
+    tablet2 = tableService.metaMgr.getAllTablets("testTable2")[0]
+    tableService.changeMemtableBudget(3000)
+    for i in range(3):
+        tableService.addNewEntry("testTable2","row%02d" % i,"cf1","c1","x" * 500,float(i))
+    tableService.waitForFlushes()
+    usage = tableService.memTableBudget.getUsage()
+    print(usage)
+    if len(tablet2.ssTables) != 1 or usage["usage"] != 0:
+        raise Exception("Error: Memtable budget did not flush the largest memtable!")
+    flushMemTable = tablet2.flushMemTable
+    tablet2.flushMemTable = lambda appliedSeq=None: False
+    writer = threading.Thread(target=lambda: [tableService.addNewEntry("testTable2","row%02d" % i,"cf1","c1","x" * 500, \
+        float(i)) for i in range(3, 20)])
+    writer.start()
+    writer.join(0.5)
+    if not writer.is_alive() or len(tablet2.immutableMemTables) != tablet2.maxImmutableMemTables:
+        raise Exception("Error: Memtable budget froze memtables past the flush backlog!")
+    tablet2.flushMemTable = flushMemTable
+    tableService.flusher.schedule(tablet2)
+    writer.join()
+    tableService.waitForFlushes()
+    if tableService.getFlushStats("testTable2")["stalls"] == 0 or len(tableService.getEntryRange("testTable2","row00", \
+            "row99","cf1","c1")) != 20:
+        raise Exception("Error: Writer over the memtable budget not stalled!")
+    tableService.changeMemtableBudget(64 * 1024 * 1024)
+    tableService.deleteTable(tableName)
+    tableService.deleteTable("testTable2")
+    if tableService.memTableBudget.getUsage()["usage"] != 0:
+        raise Exception("Error: Memtable memory not released!")
+
+def test_cellVersionOrder():
+    tableName = "testTable"
+    table = createTable(tableName)
+    tableService.createTable(table,3)
+    for t in [5.0, 2.0, 9.0, 7.0, 1.0, 8.0]:
+        tableService.addNewEntry(tableName,"first","cf1","c1","v%d" % t,t)
+    tablet = tableService.metaMgr.getAllTablets(tableName)[0]
+    if [c[1] for c in tablet.memTable.getRow("first","cf1","c1")] != [9.0, 8.0, 7.0]:
+        raise Exception("Error: Memtable versions not kept newest first!")
+    if tableService.getEntry(tableName,"first","cf1","c1") != [["v9", 9.0], ["v8", 8.0], ["v7", 7.0]]:
+        raise Exception("Error: Read did not return the newest versions!")
+    tableService.deleteTable(tableName)
+
+def test_compactRow():
+    tableName = "testTable"
+    table = createTable(tableName)
+    tableService.createTable(table,2)
+    for t in range(4):
+        tableService.addNewEntry(tableName,"first","cf2","c2","b%d" % t,float(t))
+        tableService.addNewEntry(tableName,"first","cf1","c1","a%d" % t,float(10 - t))
+    tableService.addNewEntry(tableName,"first","cf9","c9","z",1.0)
+    tablet = tableService.metaMgr.getAllTablets(tableName)[0]
+    row = tablet.memTable.rowEntries["first"]
+    if len(row.values) != 5 or list(row.columnIds) != sorted(row.columnIds):
+        raise Exception("Error: Compact row kept too many versions!")
+    if tablet.memTable.getRow("first","cf1","c1") != [("a0", 10.0), ("a1", 9.0)]:
+        raise Exception("Error: Compact row evicted the wrong version!")
+    if tablet.memTable.getRow("first") != {"cf1": {"c1": [("a0", 10.0), ("a1", 9.0)]}, \
+            "cf2": {"c2": [("b3", 3.0), ("b2", 2.0)]}, "cf9": {"c9": [("z", 1.0)]}}:
+        raise Exception("Error: Compact row not expanded correctly!")
+    if tablet.columnIndex.findId("cf1","c2") is None or tablet.columnIndex.findId("cf9","c9") is None:
+        raise Exception("Error: Column ids not taken from the schema!")
+    tableService.deleteTable(tableName)
+
+def test_groupCommit():
+    tableName = "testTable"
+    table = createTable(tableName)
+    tableService.createTable(table)
+    before = tableService.getWALStats()
+    fsync = os.fsync
+    def slowFsync(fd):
+        time.sleep(0.01)
+        fsync(fd)
+    os.fsync = slowFsync
+    try:
+        writers = [threading.Thread(target=lambda w=w: [tableService.addNewEntry(tableName,"row%d_%02d" % (w, i), \
+            "cf1","c1","Hello!",float(i)) for i in range(20)]) for w in range(8)]
+        for w in writers:
+            w.start()
+        for w in writers:
+            w.join()
+    finally:
+        os.fsync = fsync
+    stats = tableService.getWALStats()
+    print(stats)
+    if stats["records"] - before["records"] != 160 or stats["syncs"] - before["syncs"] >= 160:
+        raise Exception("Error: Concurrent WAL appends not group committed!")
+    records = [WAL.decodeInsert(r[2]) for _, segment in WAL.listSegments("wal", WAL.COMMIT_LOG) \
+        for r in WAL.readRecords(segment)]
+    if len([r for r in records if r[0] == tableName and r[2].startswith("row")]) < 160:
+        raise Exception("Error: WAL records lost!")
+    tableService.deleteTable(tableName)
+
+def test_walRecovery():
+    tableName = "testTable"
+    with serviceDirs() as paths:
+        service = TableService(*paths)
+        service.createTable(createTable(tableName), 5, 100, 1000)
+        service.addNewEntry(tableName,"movie1","cf1","c1","('comedy', 'romance')",1.0)
+        service.addNewEntry(tableName,"movie2","cf1","c1","two\nlines",2.0)
+        service.addNewEntry(tableName,"movie3","cf1","c1",{"genres": ["drama"]},3.0)
+        walFile = service.commitLog.fileName
+        size = os.path.getsize(walFile)
+        with open(walFile, "ab") as f:
+            f.write(WAL.encodeInsert(4, tableName, 0, "movie4", "cf1", "c1", "torn", 4.0)[:-3])
+        service.waitForCompactions()
+        recovered = TableService(*paths)
+        print(recovered.getEntryRange(tableName,"movie1","movie9","cf1","c1"))
+        if recovered.getEntry(tableName,"movie1","cf1","c1") != [["('comedy', 'romance')", 1.0]] or \
+                recovered.getEntry(tableName,"movie2","cf1","c1") != [["two\nlines", 2.0]] or \
+                recovered.getEntry(tableName,"movie3","cf1","c1") != [[{"genres": ["drama"]}, 3.0]] or \
+                recovered.getEntry(tableName,"movie4","cf1","c1") is not None:
+            raise Exception("Error: WAL replay lost or garbled entries!")
+        if os.path.getsize(walFile) != size:
+            raise Exception("Error: Torn WAL record not cut off!")
+        recovered.addNewEntry(tableName,"movie4","cf1","c1","four",4.0)
+        if [r[0] for r in WAL.readRecords(walFile)] != [1, 2, 3, 4]:
+            raise Exception("Error: WAL sequence numbers not continued after replay!")
+        recovered.waitForCompactions()
+
+        with open(paths[2] + "/" + tableName + ".wal", "w") as f:
+            f.write("INSERT,movie5,cf1,c1,('comedy', 'romance'),5.0\n")
+        legacy = TableService(*paths)
+        if legacy.getEntry(tableName,"movie5","cf1","c1") != [["('comedy', 'romance')", 5.0]]:
+            raise Exception("Error: Text WAL not replayed!")
+        if WAL.tableLogFiles(paths[2], tableName) or \
+                legacy.metaMgr.getRelevantTablet(tableName,"movie5").memTable.getRow("movie5") is not None:
+            raise Exception("Error: Per-table WAL not flushed and removed!")
+        legacy.waitForCompactions()
+
+def test_walCheckpoint():
+    tableName = "testTable"
+    with serviceDirs() as paths:
+        service = TableService(*paths)
+        service.createTable(createTable(tableName), 5, 100, 5, memTableMaxBytes=None)
+        service.commitLog.segmentSize = 300
+        for i in range(22):
+            service.addNewEntry(tableName,"row%02d" % i,"cf1","c1","Hello%d!" % i,float(i))
+        service.waitForCompactions()
+        tablet = service.metaMgr.getRelevantTablet(tableName,"row00")
+        stats = service.getWALStats()
+        print(stats, tablet.getPersistedSeq(), WAL.listSegments(paths[2], WAL.COMMIT_LOG))
+        if tablet.getPersistedSeq() != 20:
+            raise Exception("Error: Flushed SSTs do not record their WAL sequence number!")
+        firstSeq = WAL.listSegments(paths[2], WAL.COMMIT_LOG)[0][0]
+        if stats["segments"] >= 10 or firstSeq > 21 or firstSeq < 10:
+            raise Exception("Error: Flushed WAL segments not deleted!")
+        recovered = TableService(*paths)
+        rows = recovered.getEntryRange(tableName,"row00","row99","cf1","c1")
+        if len(rows) != 22 or rows["row21"] != [["Hello21!", 21.0]]:
+            raise Exception("Error: Rows lost after WAL truncation!")
+        if recovered.metaMgr.getRelevantTablet(tableName,"row00").memTable.getCurrentSize() != 2:
+            raise Exception("Error: Flushed WAL records replayed!")
+        recovered.waitForCompactions()
+
+def test_sequenceReplay():
+    tableName = "testTable"
+    getEntry = TableService.getEntry
+    with serviceDirs() as paths:
+        try:
+            service = TableService(*paths)
+            service.createTable(createTable(tableName), 5, 100, 5, memTableMaxBytes=None)
+            for i in range(12):
+                service.addNewEntry(tableName,"row%02d" % i,"cf1","c1","Hello%d!" % i,float(i))
+            service.waitForCompactions()
+            tablet = service.metaMgr.getRelevantTablet(tableName,"row00")
+            for sst in tablet.ssTables:
+                sst.maxSeq = 0
+            service.changeMemtableCapacity(tableName, 100)
+            service.metaMgr.dumpToDisk()
+            def noReads(*args):
+                raise Exception("Error: WAL replay reads the table!")
+            TableService.getEntry = noReads
+            recovered = TableService(*paths)
+            TableService.getEntry = getEntry
+            memTable = recovered.metaMgr.getRelevantTablet(tableName,"row00").memTable
+            if memTable.getCurrentSize() != 12:
+                raise Exception("Error: WAL records past the checkpoint not replayed!")
+            size = memTable.getBytes()
+            memTable.addRow("row00","cf1","c1","Hello0!",0.0)
+            if memTable.getBytes() != size or memTable.getRow("row00","cf1","c1") != [("Hello0!", 0.0)]:
+                raise Exception("Error: Duplicate cell version kept in the memtable!")
+            rows = recovered.getEntryRange(tableName,"row00","row99","cf1","c1")
+            print(rows)
+            if len(rows) != 12 or any(len(cells) != 1 for cells in rows.values()):
+                raise Exception("Error: Replayed records duplicated!")
+            recovered.waitForCompactions()
+        finally:
+            TableService.getEntry = getEntry
+
+def test_commitLogSplit():
+    with serviceDirs() as paths:
+        service = TableService(*paths)
+        for tableName in ["movies", "ratings"]:
+            service.createTable(createTable(tableName), 5, 100, 1000)
+        for i in range(10):
+            service.addNewEntry("movies","m%02d" % i,"cf1","c1","movie%d" % i,float(i))
+            service.addNewEntry("ratings","m%02d" % i,"cf1","c1",i,float(i))
+        if [f for f in os.listdir(paths[2]) if f != "recovery"] != [os.path.basename(service.commitLog.fileName)]:
+            raise Exception("Error: Tables not sharing the commit log!")
+        recoveryPath = os.path.dirname(paths[2]) + "/recovery"
+        os.makedirs(recoveryPath)
+        splits = service.commitLog.splitByTablet(lambda tableName, tabletId, rowKey, seq: \
+            service.findLogTablet(tableName, rowKey), recoveryPath)
+        movies = service.metaMgr.getRelevantTablet("movies","m00")
+        ratings = service.metaMgr.getRelevantTablet("ratings","m00")
+        print(splits)
+        if [r[4] for r in WAL.replaySplit(splits[movies])] != ["movie%d" % i for i in range(10)] or \
+                [r[4] for r in WAL.replaySplit(splits[ratings])] != list(range(10)):
+            raise Exception("Error: Commit log not split by tablet!")
+        service.waitForCompactions()
+        recovered = TableService(*paths)
+        if recovered.getEntry("movies","m03","cf1","c1") != [["movie3", 3.0]] or \
+                recovered.getEntry("ratings","m03","cf1","c1") != [[3, 3.0]] or \
+                len(recovered.getEntryRange("ratings","m00","m99","cf1","c1")) != 10:
+            raise Exception("Error: Tablets not recovered from the commit log!")
+        if os.listdir(paths[2] + "/recovery"):
+            raise Exception("Error: Commit log splits not cleaned up!")
+        recovered.waitForCompactions()
+
+def test_recreatedTable():
+    with serviceDirs() as paths:
+        service = TableService(*paths)
+        service.createTable(createTable("recreated"), 5, 100, 1000)
+        service.addNewEntry("recreated","row00","cf1","c1","old-data",1.0)
+        service.deleteTable("recreated")
+        service.createTable(createTable("recreated"), 5, 100, 1000)
+        service.addNewEntry("recreated","row01","cf1","c1","new-data",2.0)
+        recovered = TableService(*paths)
+        if recovered.getEntry("recreated","row00","cf1","c1") is not None or \
+                recovered.getEntry("recreated","row01","cf1","c1") != [["new-data", 2.0]]:
+            raise Exception("Error: Commit log of a dropped table replayed into a new table of the same name!")
+        recovered.metaMgr.writeSnapshot()
+        if TableService(*paths).getEntry("recreated","row00","cf1","c1") is not None:
+            raise Exception("Error: Table creation point not kept in the METADATA snapshot!")
+        recovered.waitForCompactions()
+
+def test_recoveryTruncation():
+    with serviceDirs() as paths:
+        service = TableService(*paths)
+        service.createTable(createTable("early"), 5, 1000, 1000, memTableMaxBytes=None)
+        service.createTable(createTable("late"), 5, 1000, 1000, memTableMaxBytes=None)
+        service.commitLog.segmentSize = 4096
+        service.addNewEntry("late","row000","cf1","c1","Hello0!".ljust(200),0.0)
+        for i in range(10):
+            service.addNewEntry("early","row%02d" % i,"cf1","c1","Hello%d!" % i,float(i))
+        for i in range(1, 1000):
+            service.addNewEntry("late","row%03d" % i,"cf1","c1",("Hello%d!" % i).ljust(200),float(i))
+        service.waitForCompactions()
+        replayTablet = TableService.replayTablet
+        def slowReplay(self, tablet, fileName):
+            self.flusher.wait()
+            replayTablet(self, tablet, fileName)
+        TableService.replayTablet = slowReplay
+        try:
+            recovered = TableService(*paths, memTableBudget=20000)
+        finally:
+            TableService.replayTablet = replayTablet
+        recovered.waitForCompactions()
+        print(recovered.getWALStats(), recovered.getFlushStats("late"))
+        if recovered.getFlushStats("late")["flushes"] == 0:
+            raise Exception("Error: Replayed tablet not flushed during recovery!")
+        restarted = TableService(*paths)
+        if len(restarted.getEntryRange("early","row00","row99","cf1","c1")) != 10 or \
+                len(restarted.getEntryRange("late","row000","row999","cf1","c1")) != 1000:
+            raise Exception("Error: Commit log truncated before every tablet was replayed!")
+        restarted.waitForCompactions()
+
+def test_durabilityModes():
+    with serviceDirs() as paths:
+        service = TableService(*paths)
+        service.createTable(createTable("ledger"), 5, 100, 1000)
+        service.createTable(createTable("events"), 5, 100, 1000, durability=Table.DURABILITY_INTERVAL, syncIntervalMs=50)
+        service.createTable(createTable("cache"), 5, 100, 1000, durability=Table.DURABILITY_NONE)
+        for tableName in ["ledger", "events", "cache"]:
+            before = service.getWALStats()
+            for i in range(20):
+                service.addNewEntry(tableName,"row%02d" % i,"cf1","c1","Hello%d!" % i,float(i))
+            stats = service.getWALStats()
+            print(tableName, stats)
+            records = stats["records"] - before["records"]
+            syncs = stats["syncs"] - before["syncs"]
+            if tableName == "ledger" and (records != 20 or syncs != 20) or \
+                    tableName == "events" and (records != 20 or syncs > 1) or \
+                    tableName == "cache" and records != 0:
+                raise Exception("Error: Inserts not logged according to the table's durability!")
+        time.sleep(0.2)
+        logged = [WAL.decodeInsert(r[2])[0] for r in WAL.readRecords(service.commitLog.fileName)]
+        if logged.count("ledger") != 20 or logged.count("events") != 20 or "cache" in logged:
+            raise Exception("Error: Interval durability did not sync the log!")
+        service.waitForCompactions()
+        recovered = TableService(*paths)
+        if recovered.getTableInfo("events").durability != Table.DURABILITY_INTERVAL or \
+                recovered.getTableInfo("events").syncIntervalMs != 50:
+            raise Exception("Error: Durability not stored with the table!")
+        if len(recovered.getEntryRange("ledger","row00","row99","cf1","c1")) != 20 or \
+                len(recovered.getEntryRange("events","row00","row99","cf1","c1")) != 20 or \
+                recovered.getEntryRange("cache","row00","row99","cf1","c1"):
+            raise Exception("Error: Tables not recovered according to their durability!")
+        recovered.waitForCompactions()
+
+def test_tabletRouting():
+    with serviceDirs() as paths:
+        service = TableService(*paths)
+        service.createTable(createTable("routed"), 5, 100, 1000)
+        original = service.metaMgr.getRelevantTablet("routed","m1")
+        tablets = [Tablet(i, 0, "routed", start, end, paths[1], None, 5, 100, 1000, blockCache=service.blockCache, \
+            memTableBudget=service.memTableBudget) for i, (start, end) in enumerate([("m2", "z"), ("0", "m1"), ("m1", "m2")])]
+        service.metaMgr.replaceTablets("routed", [original], tablets)
+        expected = {"m0z": 1, "m1": 2, "m10": 2, "m1z": 2, "m2": 0, "zz": 0, "!": 1}
+        for rowKey, tabletId in expected.items():
+            tablet = service.metaMgr.getRelevantTablet("routed", rowKey)
+            if tablet.id != tabletId or rowKey not in ("zz", "!") and not tablet.intersect(rowKey):
+                raise Exception("Error: Row %s routed to the wrong tablet!" % rowKey)
+        for i, rowKey in enumerate(sorted(expected)):
+            service.addNewEntry("routed",rowKey,"cf1","c1","Hello%d!" % i,float(i))
+        if list(service.getEntryRange("routed","m0","m1","cf1","c1")) != ["m0z", "m1", "m10", "m1z"] or \
+                len(service.getEntryRange("routed","!","zz","cf1","c1")) != len(expected):
+            raise Exception("Error: Row range not read across tablets!")
+        if [t.id for t in service.metaMgr.getTabletsInRange("routed", "m10", "m1", pastEnd)] != [2]:
+            raise Exception("Error: Row range not limited to its tablets!")
+        service.waitForCompactions()
+        recovered = TableService(*paths)
+        if [t.startKey for t in recovered.getTablets("routed")] != ["0", "m1", "m2"] or \
+                recovered.getEntry("routed","m10","cf1","c1") != [["Hello%d!" % sorted(expected).index("m10"), \
+                float(sorted(expected).index("m10"))]]:
+            raise Exception("Error: Tablet routing not restored!")
+        recovered.waitForCompactions()
+
+def test_metadataManifest():
+    with serviceDirs() as paths:
+        service = TableService(*paths)
+        tableName = "manifested"
+        service.createTable(createTable(tableName), 5, 100, 5, memTableMaxBytes=None)
+        for i in range(30):
+            service.addNewEntry(tableName,"row%02d" % i,"cf1","c1","Hello%d!" % i,float(i))
+        service.waitForCompactions()
+        if sorted(os.listdir(paths[0])) != [MetadataManager.MANIFEST_LOG]:
+            raise Exception("Error: METADATA rewritten instead of logged!")
+        with open(paths[0] + "/" + MetadataManager.MANIFEST_LOG, "a") as f:
+            f.write('{"op": "tablet", "tab')
+        sstIds = sorted(sst.id for sst in service.getTablets(tableName)[0].ssTables)
+        recovered = TableService(*paths)
+        if sorted(sst.id for sst in recovered.getTablets(tableName)[0].ssTables) != sstIds or \
+                len(recovered.getEntryRange(tableName,"row00","row99","cf1","c1")) != 30:
+            raise Exception("Error: METADATA not rebuilt from the manifest!")
+        with open(paths[0] + "/" + MetadataManager.MANIFEST_LOG, "rb") as f:
+            if not f.read().endswith(b"\n"):
+                raise Exception("Error: Torn manifest edit not cut off!")
+        recovered.metaMgr.snapshotEvery = 1
+        for i in range(30, 40):
+            recovered.addNewEntry(tableName,"row%02d" % i,"cf1","c1","Hello%d!" % i,float(i))
+        recovered.waitForCompactions()
+        if os.path.getsize(paths[0] + "/" + MetadataManager.MANIFEST_LOG) != 0:
+            raise Exception("Error: Manifest log not emptied by the snapshot!")
+        with open(paths[0] + "/meta.tablet", "w") as f:
+            f.write(json.dumps({tableName: [t.serialize() for t in recovered.getTablets(tableName)]}))
+        with open(paths[0] + "/meta.table", "w") as f:
+            f.write(json.dumps({tableName: recovered.getTableInfo(tableName).getAsJson()}))
+        os.remove(paths[0] + "/" + MetadataManager.MANIFEST_LOG)
+        os.remove(paths[0] + "/" + MetadataManager.MANIFEST_SNAPSHOT)
+        migrated = TableService(*paths)
+        if sorted(os.listdir(paths[0])) != [MetadataManager.MANIFEST_LOG, MetadataManager.MANIFEST_SNAPSHOT] or \
+                len(migrated.getEntryRange(tableName,"row00","row99","cf1","c1")) != 40:
+            raise Exception("Error: Full METADATA files not migrated to the manifest!")
+        delete = Tablet.delete
+        def crash(self):
+            raise Exception("crash")
+        Tablet.delete = crash
+        try:
+            migrated.deleteTable(tableName)
+        except Exception:
+            pass
+        finally:
+            Tablet.delete = delete
+        if TableService(*paths).listTables():
+            raise Exception("Error: Table files deleted before the drop was logged!")
+
+def test_lazyOpen():
+    with serviceDirs() as paths:
+        service = TableService(*paths)
+        tableName = "lazy"
+        service.createTable(createTable(tableName), 5, 100, 10, memTableMaxBytes=None, compactionStrategy="leveled")
+        for i in range(100):
+            service.addNewEntry(tableName,"row%03d" % i,"cf1","c1","Hello%d!" % i,float(i))
+        service.waitForCompactions()
+        recovered = TableService(*paths)
+        recovered.waitForCompactions()
+        ssts = recovered.getTablets(tableName)[0].ssTables
+        if len(ssts) < 2 or any(sst.opened for sst in ssts):
+            raise Exception("Error: SSTables opened on startup!")
+        if recovered.getEntry(tableName,"row042","cf1","c1") != [["Hello42!", 42.0]]:
+            raise Exception("Error: Lazily opened SSTable read failed!")
+        if sorted(sst.id for sst in ssts if sst.opened) != sorted(sst.id for sst in ssts if sst.coversKey("row042")):
+            raise Exception("Error: SSTables not covering the row opened!")
+        if len(recovered.getEntryRange(tableName,"row000","row999","cf1","c1")) != 100:
+            raise Exception("Error: Lazily opened SSTables not scanned!")
+        recovered.waitForCompactions()
+
+def test_splitTablet():
+    with serviceDirs() as paths:
+        service = TableService(*paths)
+        tableName = "splitting"
+        value = lambda i: ("Hello%d!" % i).ljust(200)
+        service.createTable(createTable(tableName), 5, 1000, 20, memTableMaxBytes=None)
+        for i in range(105):
+            service.addNewEntry(tableName,"row%03d" % i,"cf1","c1",value(i),float(i))
+        service.waitForCompactions()
+        parent = service.getTablets(tableName)[0]
+        files = set(sst.fileName for sst in parent.ssTables)
+        schedule = service.compactor.schedule
+        service.compactor.schedule = lambda tablet: None
+        parent.tabletCapacity = 50
+        start = time.perf_counter()
+        if not service.splitTablet(parent):
+            raise Exception("Error: Full tablet not split!")
+        print("split", time.perf_counter() - start)
+        left, right = service.getTablets(tableName)
+        if left.startKey != "0" or right.endKey != "z" or left.endKey != right.startKey or \
+                not "row030" <= left.endKey <= "row070":
+            raise Exception("Error: Tablet not split at its median key!")
+        if any(not sst.shared or sst.fileName not in files for t in (left, right) for sst in t.ssTables):
+            raise Exception("Error: Split copied SSTables instead of sharing them!")
+        if left.memTable.getCurrentSize() != 0 or right.memTable.getCurrentSize() != 5:
+            raise Exception("Error: Memtable rows not handed to the new tablets!")
+        try:
+            parent.addRow("row000","cf1","c1","lost",1000.0)
+            raise Exception("Error: Split tablet still takes writes!")
+        except TabletSplitError:
+            pass
+        service.addNewEntry(tableName,"row000","cf1","c1","Hello again!",200.0)
+        if parent.getRow("row000","cf1","c1") != [["Hello again!", 200.0], [value(0), 0.0]] or \
+                len(service.getEntryRange(tableName,"row000","row999","cf1","c1")) != 105 or \
+                len(left.getRowRange("row000","row999","cf1","c1")) + len(right.getRowRange("row000","row999","cf1","c1")) != 105:
+            raise Exception("Error: Rows not readable after the split!")
+        service.compactor.schedule = schedule
+        for t in (left, right):
+            service.compactor.schedule(t)
+        service.waitForCompactions()
+        if any(sst.shared for t in (left, right) for sst in t.ssTables) or any(os.path.exists(f) for f in files):
+            raise Exception("Error: Shared SSTables not cleaned up by compaction!")
+        for i in range(105, 300):
+            service.addNewEntry(tableName,"row%03d" % i,"cf1","c1",value(i),float(i))
+        service.waitForCompactions()
+        tablets = service.getTablets(tableName)
+        if len(tablets) < 4 or any(a.endKey != b.startKey for a, b in zip(tablets, tablets[1:])):
+            raise Exception("Error: Growing table not split into contiguous tablets!")
+        recovered = TableService(*paths)
+        if [(t.startKey, t.endKey) for t in recovered.getTablets(tableName)] != [(t.startKey, t.endKey) for t in tablets] or \
+                len(recovered.getEntryRange(tableName,"row000","row999","cf1","c1")) != 300 or \
+                recovered.getEntry(tableName,"row000","cf1","c1") != [["Hello again!", 200.0], [value(0), 0.0]]:
+            raise Exception("Error: Split tablets not recovered!")
+        recovered.waitForCompactions()
+
+def test_flushedTabletSplit():
+    with serviceDirs() as paths:
+        service = TableService(*paths)
+        tableName = "flushed"
+        service.createTable(createTable(tableName), 5, 1000, 20, memTableMaxBytes=None)
+        service.compactor.schedule = lambda tablet: None
+        for i in range(60):
+            service.addNewEntry(tableName,"row%02d" % i,"cf1","c1","Hello%d!" % i,float(i))
+        service.waitForFlushes()
+        tablet = service.getTablets(tableName)[0]
+        if len(tablet.ssTables) < 2 or tablet.getCurrentSize() != 60:
+            raise Exception("Error: Flushed rows not counted in the tablet size!")
+        tablet.tabletCapacity = 50
+        if not service.splitTablet(tablet) or len(service.getTablets(tableName)) != 2:
+            raise Exception("Error: Flushed tablet not split!")
+
 
 if __name__ == "__main__":
     init_service("metadata","sst","wal")
@@ -178,4 +996,33 @@ if __name__ == "__main__":
     test_getRowRange()
     test_maxCellCopies()
     test_memTableCapacity()
-    test_changeMemtableCapacity()
\ No newline at end of file
+    test_changeMemtableCapacity()
+    test_sstBlockLookup()
+    test_legacySSTable()
+    test_legacyFileNames()
+    test_bloomFilter()
+    test_blockCache()
+    test_sizeTieredCompaction()
+    test_leveledCompaction()
+    test_mergedRowRange()
+    test_rowRangePages()
+    test_localityGroups()
+    test_projection()
+    test_sortedMemTable()
+    test_backgroundFlush()
+    test_memTableBytes()
+    test_cellVersionOrder()
+    test_compactRow()
+    test_groupCommit()
+    test_walRecovery()
+    test_walCheckpoint()
+    test_sequenceReplay()
+    test_commitLogSplit()
+    test_recreatedTable()
+    test_recoveryTruncation()
+    test_durabilityModes()
+    test_tabletRouting()
+    test_metadataManifest()
+    test_lazyOpen()
+    test_splitTablet()
+    test_flushedTabletSplit()